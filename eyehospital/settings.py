@@ -223,4 +223,32 @@ ALGORITHM_TYPE = {
     "2": "medment_4",
     "3": "seour",
     "4": "seour_4",
-}
\ No newline at end of file
+}
+
+# K、Q、B 搜索
+# 平k是否同时搜索B值（-50~50，步长5），关闭时B固定为0
+KBQ_B_SEARCH = False
+# coarse_to_fine：先粗算B的最优位置再精算，结果与遍历一致；exhaustive：遍历全部组合
+KBQ_SEARCH_MODE = "coarse_to_fine"
+# 平k拟合时随设计一起保存的备选组合个数（按平均平方差从小到大）
+KBQ_TOP_N = 5
+
+# Medmont 角膜高度的取值方式
+# interpolant：按散点插值（普通定制线性、四轴定制三次），结果与原先一致；
+# polar：规则网格双线性插值，一次换算成极坐标数组后按子午线取值（services/polar_height.py）
+MEDMONT_HEIGHT_SAMPLER = "interpolant"
+
+# 角膜地形图解析结果缓存（按文件内容哈希，services/topography_cache.py）
+# 内存缓存和磁盘缓存（npz）的最大字节数，设为 0 不使用该级缓存
+TOPOGRAPHY_CACHE_DIR = os.path.join(MEDIA_ROOT, 'topography_cache')
+TOPOGRAPHY_CACHE_MEMORY_BYTES = 64 * 1024 * 1024
+TOPOGRAPHY_CACHE_DISK_BYTES = 1024 * 1024 * 1024
+# 并行生成地形图的工作进程数（services/topography_maps.py），设为 1 在当前进程中依次生成
+TOPOGRAPHY_MAP_WORKERS = min(4, os.cpu_count() or 1)
+# 地形图 PNG 的生成方式（services/map_raster.py）
+# raster：缓存坐标轴、颜色条等框架后直接栅格化数据并编码 PNG；matplotlib：按原先的画法用 matplotlib 绘制
+TOPOGRAPHY_MAP_RENDERER = "raster"
+# 地形图 50x50 -> 500x500 的插值方式（services/grid_upsample.py）
+# griddata：原先的散点三次插值；bicubic：规则网格双三次插值（NaN 区域不外扩），
+# 与 griddata 的差别（测量区边缘、泪膜质量图的色阶）确认前需手动启用
+TOPOGRAPHY_MAP_UPSAMPLER = "griddata"
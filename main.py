@@ -27,6 +27,8 @@ os.makedirs(LOCAL_DATA_DIR, exist_ok=True)
 # 配置文件 & 日志文件路径
 CONFIG_FILE_PATH = os.path.join(LOCAL_DATA_DIR, 'config.json')
 LOG_FILE_PATH = os.path.join(LOCAL_DATA_DIR, 'app.log')
+# Tomey 数据目录索引
+TOMEY_INDEX_PATH = os.path.join(LOCAL_DATA_DIR, 'tomey_index.sqlite3')
 
 # 环境变量
 os.environ['DATABASE_PATH'] = os.path.join(LOCAL_DATA_DIR, 'db.sqlite3')
@@ -211,14 +213,11 @@ class Api:
         """
         import requests
         import base64
-        import tempfile
         from pathlib import Path
         
         # 引入我们在 tomey_parser 中定义的解析器
         # 确保 tomey_parser 包在项目根目录下
-        from tomey_parser.tms.stat_extractor import StatExtractor
-        from tomey_parser.tms.radius_extractor import RadiusExtractor
-        from tomey_parser.tms.height_extractor import HeightExtractor
+        from tomey_parser.tms.tms_file import TmsFile
 
         try:
             # 1. 提取文件内容和信息
@@ -228,89 +227,73 @@ class Api:
             if not file_content_base64:
                 return {'success': False, 'error': '请先选择一个 .tms 地形图文件。'}
 
-            # 2. 解码并保存为临时文件
+            # 2. 解码文件内容
             try:
                 file_content = base64.b64decode(file_content_base64)
             except Exception:
                 return {'success': False, 'error': '文件解码失败，请重试。'}
 
-            # 创建临时文件用于解析 (因为解析器需要文件路径)
-            # delete=False 让我们能手动控制何时删除
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".tms") as tmp_file:
-                tmp_file.write(file_content)
-                tmp_file_path = Path(tmp_file.name)
+            # 直接在内存中解析，无需临时文件
+            logging.info(f"正在解析上传的文件: {file_name}")
+            tms = TmsFile.fromBytes(file_content, file_name or "upload.tms")
 
-            try:
-                logging.info(f"正在解析上传的文件: {file_name} (Temp: {tmp_file_path})")
+            # 3. 执行解析 (文件只扫描一次数据块)
+            # A. 提取 Stats (平K, 陡K, 角度等)
+            stats = tms.stats()
 
-                # 3. 执行解析
-                # A. 提取 Stats (平K, 陡K, 角度等)
-                stat_ext = StatExtractor()
-                stats = stat_ext.extract_data(tmp_file_path)
-                
-                # B. 提取 Radius CSV 数据
-                rad_ext = RadiusExtractor()
-                rad_csv = rad_ext.extract_to_csv_string(tmp_file_path)
-                
-                # C. 提取 Height CSV 数据
-                hit_ext = HeightExtractor()
-                hit_csv = hit_ext.extract_to_csv_string(tmp_file_path)
-
-                # 4. 构造 Django 请求数据
-                # 构造文件名
-                timestamp = int(time.time())
-                name_stem = Path(file_name).stem if file_name else "upload"
-                rad_filename = f"RAD_{name_stem}_{timestamp}.dat"
-                hit_filename = f"HIT_{name_stem}_{timestamp}.dat"
-
-                # 构造 POST 数据 (表单参数 + 解析出的参数)
-                payload = {
-                    'patient_id': params.get('patient_id') or params.get('patient'),
-                    'eye': params.get('eye'),
-                    # 解析出的参数
-                    'flat_k': stats.get('SimK1/ks', 0),
-                    'plane_angle': stats.get('SimK1/ks Ang', 0),
-                    'steep_k': stats.get('SimK2/kf', 0),
-                    'inclined_angle': stats.get('SimK2/kf Ang', 0),
-                    'delta_k': stats.get('Cyl', 0),
-                    # 用户表单填写的其他参数 (透传给后端)
-                    'overall_diameter': params.get('overall_diameter'),
-                    'optical_zone_diameter': params.get('optical_zone_diameter'),
-                    'mirror_degree': params.get('mirror_degree'),
-                    'cylindrical_power': params.get('cylindrical_power'),
-                    'overpressure': params.get('overpressure'),
-                    'custom_type': '4', # 明确指定为 Tomey 普通定制
-                }
+            # B. 提取 Radius 数据 (.npy 二进制，服务端直接加载，无需解析文本)
+            rad_npy = tms.radius_npy()
 
-                # 构造文件
-                files = {
-                    'radius_file': (rad_filename, rad_csv.encode('utf-8'), 'text/plain'),
-                    'height_file': (hit_filename, hit_csv.encode('utf-8'), 'text/plain'),
-                }
+            # C. 提取 Height 数据
+            hit_npy = tms.height_npy()
 
-                # 5. 发送给 Django
-                django_api_url = f'http://{SERVER_HOST}:{SERVER_PORT}/patient/api/process-tomey-data/'
-                
-                response = requests.post(django_api_url, data=payload, files=files, timeout=30)
-                
-                # 处理非 200 响应
-                if response.status_code != 200:
-                    logging.error(f"Django API Error: {response.text}")
-                    try:
-                        err_msg = response.json().get('error', '未知服务器错误')
-                    except:
-                        err_msg = f"服务器返回状态码 {response.status_code}"
-                    return {'success': False, 'error': err_msg}
+            # 4. 构造 Django 请求数据
+            # 构造文件名
+            timestamp = int(time.time())
+            name_stem = Path(file_name).stem if file_name else "upload"
+            rad_filename = f"RAD_{name_stem}_{timestamp}.npy"
+            hit_filename = f"HIT_{name_stem}_{timestamp}.npy"
 
-                return response.json()
+            # 构造 POST 数据 (表单参数 + 解析出的参数)
+            payload = {
+                'patient_id': params.get('patient_id') or params.get('patient'),
+                'eye': params.get('eye'),
+                # 解析出的参数
+                'flat_k': stats.get('SimK1/ks', 0),
+                'plane_angle': stats.get('SimK1/ks Ang', 0),
+                'steep_k': stats.get('SimK2/kf', 0),
+                'inclined_angle': stats.get('SimK2/kf Ang', 0),
+                'delta_k': stats.get('Cyl', 0),
+                # 用户表单填写的其他参数 (透传给后端)
+                'overall_diameter': params.get('overall_diameter'),
+                'optical_zone_diameter': params.get('optical_zone_diameter'),
+                'mirror_degree': params.get('mirror_degree'),
+                'cylindrical_power': params.get('cylindrical_power'),
+                'overpressure': params.get('overpressure'),
+                'custom_type': '4', # 明确指定为 Tomey 普通定制
+            }
 
-            finally:
-                # 6. 清理临时文件
-                if os.path.exists(tmp_file_path):
-                    try:
-                        os.remove(tmp_file_path)
-                    except:
-                        pass
+            # 构造文件
+            files = {
+                'radius_file': (rad_filename, rad_npy, 'application/octet-stream'),
+                'height_file': (hit_filename, hit_npy, 'application/octet-stream'),
+            }
+
+            # 5. 发送给 Django
+            django_api_url = f'http://{SERVER_HOST}:{SERVER_PORT}/patient/api/process-tomey-data/'
+            
+            response = requests.post(django_api_url, data=payload, files=files, timeout=30)
+            
+            # 处理非 200 响应
+            if response.status_code != 200:
+                logging.error(f"Django API Error: {response.text}")
+                try:
+                    err_msg = response.json().get('error', '未知服务器错误')
+                except:
+                    err_msg = f"服务器返回状态码 {response.status_code}"
+                return {'success': False, 'error': err_msg}
+
+            return response.json()
 
         except Exception as e:
             logging.error(f"Tomey 定制处理异常: {e}", exc_info=True)
@@ -319,9 +302,6 @@ class Api:
     # tms文件解析
     def process_tms_file(self, ocr_filename, patient_id=None, eye_type='right'):
         from pathlib import Path
-        from tomey_parser.tms.stat_extractor import StatExtractor
-        from tomey_parser.tms.radius_extractor import RadiusExtractor
-        from tomey_parser.tms.height_extractor import HeightExtractor
         """
         处理 Tomey 文件并上传
         :param ocr_filename: OCR 识别出的文件名 (如 "101")
@@ -330,31 +310,28 @@ class Api:
         """
         import requests
         
-        # 1. 获取目录
-        tomey_data_dir = self._read_config_value('tomey_data_path')
-        if not tomey_data_dir:
+        # 1. 获取目录索引
+        catalog = self._tomey_catalog()
+        if not catalog:
             return {'success': False, 'error': '请先在设置中配置 Tomey 数据文件目录。'}
         
-        # 2. 定位文件
-        filename = f"{ocr_filename}.tms" if not ocr_filename.lower().endswith('.tms') else ocr_filename
-        tms_file_path = Path(os.path.join(tomey_data_dir, filename))
-        
-        if not tms_file_path.exists():
-            return {'success': False, 'error': f'未找到文件: {tms_file_path}\n请确认OCR识别正确且文件在指定目录下。'}
+        # 2. 定位文件 (查索引，兼容 OCR 误识别的字符；相近但不确定的文件只作为候选返回，不上传)
+        record = catalog.find(ocr_filename)
+        if not record:
+            return {'success': False, 'error': f'未找到文件: {ocr_filename}\n请确认OCR识别正确且文件在指定目录下。',
+                    'candidates': [c['name'] for c in catalog.candidates(ocr_filename)]}
+        tms_file_path = Path(record['path'])
 
         try:
             logging.info(f"解析文件: {tms_file_path}")
 
-            # 3. 解析 Stats
-            stat_ext = StatExtractor()
-            stats = stat_ext.extract_data(tms_file_path) # 返回字典
-            
-            # 4. 解析 CSV 内容
-            rad_ext = RadiusExtractor()
-            rad_csv = rad_ext.extract_to_csv_string(tms_file_path)
+            # 3. 解析 Stats (使用索引中的数据块偏移量，文件只读取一次)
+            tms = catalog.open(record)
+            stats = tms.stats() # 返回字典
             
-            hit_ext = HeightExtractor()
-            hit_csv = hit_ext.extract_to_csv_string(tms_file_path)
+            # 4. 解析 Radius/Height 数据 (.npy 二进制)
+            rad_npy = tms.radius_npy()
+            hit_npy = tms.height_npy()
 
             # 5. 准备上传数据
             payload = {
@@ -371,8 +348,8 @@ class Api:
             # 使用时间戳防止重名
             ts = int(time.time())
             files = {
-                'radius_file': (f'RAD_{ocr_filename}_{ts}.dat', rad_csv.encode('utf-8'), 'text/plain'),
-                'height_file': (f'HIT_{ocr_filename}_{ts}.dat', hit_csv.encode('utf-8'), 'text/plain'),
+                'radius_file': (f'RAD_{ocr_filename}_{ts}.npy', rad_npy, 'application/octet-stream'),
+                'height_file': (f'HIT_{ocr_filename}_{ts}.npy', hit_npy, 'application/octet-stream'),
             }
 
             # 7. 发送
@@ -409,7 +386,7 @@ class Api:
             if window: window.hide()
             
             screen_width, screen_height = pyautogui.size()
-            win_w, win_h = 500, 480 
+            win_w, win_h = 500, 640 
             x_pos = screen_width - win_w - 20
             y_pos = screen_height - win_h - 80
 
@@ -450,9 +427,6 @@ class Api:
         import requests
         import time
         from pathlib import Path
-        from tomey_parser.tms.stat_extractor import StatExtractor
-        from tomey_parser.tms.radius_extractor import RadiusExtractor
-        from tomey_parser.tms.height_extractor import HeightExtractor
 
         global window
         
@@ -469,27 +443,26 @@ class Api:
         # window.evaluate_js("alert('正在处理数据并生成方案，请稍候...')")
 
         try:
-            # 1. 准备文件路径
-            tomey_data_dir = self._read_config_value('tomey_data_path')
-            name_stem = Path(filename).stem
-            target_path = Path(os.path.join(tomey_data_dir, f"{name_stem}.tms"))
-            
-            if not target_path.exists():
-                raise Exception(f"文件未找到: {target_path}")
+            # 1. 准备文件路径 (查索引，兼容 OCR 误识别的字符)
+            catalog = self._tomey_catalog()
+            if not catalog:
+                raise Exception("未配置 Tomey 数据目录")
+            record = catalog.find(filename)
+            if not record:
+                raise Exception(f"文件未找到: {filename}")
+            target_path = Path(record['path'])
+            name_stem = target_path.stem
 
             # 2. 执行解析
             logging.info(f"开始处理确认的文件: {target_path}")
             
-            # 解析指标
-            stat_ext = StatExtractor()
-            stats = stat_ext.extract_data(target_path)
-            
-            # 解析 CSV 数据流
-            rad_ext = RadiusExtractor()
-            rad_csv = rad_ext.extract_to_csv_string(target_path)
+            # 解析指标 (使用索引中的数据块偏移量，文件只读取一次)
+            tms = catalog.open(record)
+            stats = tms.stats()
             
-            hit_ext = HeightExtractor()
-            hit_csv = hit_ext.extract_to_csv_string(target_path)
+            # 解析 Radius/Height 数据 (.npy 二进制)
+            rad_npy = tms.radius_npy()
+            hit_npy = tms.height_npy()
 
             # 3. 构造提交数据
             ts = int(time.time())
@@ -516,8 +489,8 @@ class Api:
             }
 
             files = {
-                'radius_file': (f"RAD_{name_stem}_{ts}.dat", rad_csv.encode('utf-8'), 'text/plain'),
-                'height_file': (f"HIT_{name_stem}_{ts}.dat", hit_csv.encode('utf-8'), 'text/plain'),
+                'radius_file': (f"RAD_{name_stem}_{ts}.npy", rad_npy, 'application/octet-stream'),
+                'height_file': (f"HIT_{name_stem}_{ts}.npy", hit_npy, 'application/octet-stream'),
             }
 
             # 4. 发送请求给 Django
@@ -552,43 +525,51 @@ class Api:
         """
         根据文件名解析 .tms 文件，返回关键指标供前端预览
         """
-        from tomey_parser.tms.stat_extractor import StatExtractor
+        import base64
+        from tomey_parser.tms.tms_file import thumbnailCache
         from pathlib import Path
         
         try:
-            # 1. 获取数据目录
-            tomey_data_dir = self._read_config_value('tomey_data_path')
-            if not tomey_data_dir:
+            # 1. 获取数据目录索引
+            catalog = self._tomey_catalog()
+            if not catalog:
                 return {'success': False, 'error': '未配置 Tomey 数据目录'}
             
-            # 2. 拼接文件路径 (处理后缀)
-            if not filename.lower().endswith('.tms'):
-                real_filename = f"{filename}.tms"
-            else:
-                real_filename = filename
-                
-            file_path = Path(os.path.join(tomey_data_dir, real_filename))
-            
-            if not file_path.exists():
-                return {'success': False, 'error': f'未找到文件: {real_filename}\n请确认已导出数据'}
-
-            # 3. 解析 Stats
+            # 2. 查找文件 (查索引，兼容 OCR 误识别的字符)
+            record = catalog.find(filename)
+            if not record:
+                # 相近的文件由用户选择后再预览，不自动替换
+                candidates = [c['name'] for c in catalog.candidates(filename)]
+                error = f'未找到文件: {filename}\n' + ('请确认是否为以下文件' if candidates else '请确认已导出数据')
+                return {'success': False, 'error': error, 'candidates': candidates}
+            file_path = Path(record['path'])
+
+            # 3. Stats 直接取自索引
             logging.info(f"预览解析: {file_path}")
-            stat_ext = StatExtractor()
-            stats = stat_ext.extract_data(file_path)
+            stats = record['stats']
             
             if not stats:
                 return {'success': False, 'error': '解析成功但无数据'}
 
+            # 采集图片缩略图 (按文件缓存，失败不影响指标预览)
+            image = None
+            try:
+                png = thumbnailCache.get(file_path)
+                if png:
+                    image = 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+            except Exception as e:
+                logging.warning(f"预览图片提取失败: {e}")
+
             # 4. 组装返回数据 (保留两位小数)
             data = {
                 'flat_k': round(stats.get('SimK1/ks', 0), 2),
                 'plane_angle': round(stats.get('SimK1/ks Ang', 0), 2),
                 'steep_k': round(stats.get('SimK2/kf', 0), 2),
                 'inclined_angle': round(stats.get('SimK2/kf Ang', 0), 2),
-                'delta_k': round(stats.get('Cyl', 0), 2)
+                'delta_k': round(stats.get('Cyl', 0), 2),
+                'image': image,
             }
-            return {'success': True, 'data': data}
+            return {'success': True, 'data': data, 'filename': file_path.name}
 
         except Exception as e:
             logging.error(f"预览失败: {e}")
@@ -650,6 +631,15 @@ class Api:
                 height: 20px
             }
 
+            .candidates {
+                display: none;
+                flex-wrap: wrap;
+                justify-content: center;
+                gap: 8px;
+                margin-bottom: 10px;
+            }
+            .btn-candidate { background-color: #e9ecef; color: #206bc4; width: auto }
+
             .text-success { color: #2fb344 !important; font-weight: bold }
             .text-error { color: #d63939 !important }
 
@@ -676,6 +666,16 @@ class Api:
                 border-bottom: 1px solid #f0f0f0;
             }
 
+            .topo-image {
+                display: none;
+                width: 100%;
+                max-height: 150px;
+                object-fit: contain;
+                margin-bottom: 15px;
+                border-radius: 4px;
+                background-color: #000;
+            }
+
             .topo-grid {
                 display: grid;
                 grid-template-columns: repeat(3, 1fr);
@@ -714,11 +714,15 @@ class Api:
         <h4 id="title">Tomey 助手</h4>
         <div id="status-text">请打开地形图后点击识别</div>
 
+        <div class="candidates" id="candidates"></div>
+
         <div class="topo-card">
             <div class="topo-header">
                 <span id="file-info">地形图信息</span>
             </div>
 
+            <img class="topo-image" id="capture-image" alt="">
+
             <div class="topo-grid">
                 <div class="form-group">
                     <label class="form-label">平K(D)</label>
@@ -772,6 +776,7 @@ class Api:
                 
                 // 清空旧数据
                 clearInputs();
+                showCandidates([]);
 
                 // 1. 调用 OCR
                 window.pywebview.api.perform_ocr_recognition().then(res => {
@@ -786,6 +791,8 @@ class Api:
                             btnId.innerText = "识别";
 
                             if (previewRes.success) {
+                                // 索引按 OCR 误识别模糊匹配后的实际文件名
+                                if (previewRes.filename) currentFilename = previewRes.filename;
                                 // 3. 填充数据
                                 currentData = previewRes.data;
                                 fillInputs(currentData);
@@ -800,6 +807,8 @@ class Api:
                             } else {
                                 status.innerText = "读取文件失败: " + previewRes.error;
                                 status.className = "text-error";
+                                // 相近的文件由用户确认后再读取
+                                showCandidates(previewRes.candidates || []);
                                 // 即使读取失败，也允许重新识别
                                 btnReId.style.display = 'inline-block';
                             }
@@ -819,17 +828,61 @@ class Api:
                 });
             }
 
+            function showCandidates(names) {
+                const box = document.getElementById('candidates');
+                box.innerHTML = '';
+                names.forEach(name => {
+                    const btn = document.createElement('button');
+                    btn.className = 'btn btn-candidate';
+                    btn.innerText = name;
+                    btn.onclick = () => selectCandidate(name);
+                    box.appendChild(btn);
+                });
+                box.style.display = names.length ? 'flex' : 'none';
+            }
+
+            function selectCandidate(name) {
+                const status = document.getElementById('status-text');
+                showCandidates([]);
+                clearInputs();
+                currentFilename = name;
+                status.innerText = "正在读取 " + name + "...";
+                status.className = "";
+                window.pywebview.api.preview_tomey_file(name).then(previewRes => {
+                    if (previewRes.success) {
+                        currentData = previewRes.data;
+                        fillInputs(currentData);
+                        status.innerHTML = "读取成功: " + currentFilename;
+                        status.className = "text-success";
+                        document.getElementById('file-info').innerText = "地形图信息: " + currentFilename;
+                        document.getElementById('btn-confirm').style.display = 'inline-block';
+                    } else {
+                        status.innerText = "读取文件失败: " + previewRes.error;
+                        status.className = "text-error";
+                    }
+                });
+            }
+
             function fillInputs(data) {
                 document.getElementById('flat_k').value = data.flat_k;
                 document.getElementById('plane_angle').value = data.plane_angle;
                 document.getElementById('steep_k').value = data.steep_k;
                 document.getElementById('inclined_angle').value = data.inclined_angle;
                 document.getElementById('delta_k').value = data.delta_k;
+
+                const img = document.getElementById('capture-image');
+                if (data.image) {
+                    img.src = data.image;
+                    img.style.display = 'block';
+                }
             }
 
             function clearInputs() {
                 const inputs = document.querySelectorAll('.form-input');
                 inputs.forEach(input => input.value = '');
+                const img = document.getElementById('capture-image');
+                img.removeAttribute('src');
+                img.style.display = 'none';
                 currentData = null;
             }
 
@@ -869,6 +922,25 @@ class Api:
         except Exception as e:
             logging.error(f"Config save error: {e}")
 
+    _catalog = None
+    _catalog_lock = threading.Lock()
+
+    def _tomey_catalog(self):
+        """
+        Tomey 数据目录索引 (按数据目录复用)，未配置数据目录时返回 None
+        新建索引时 (启动、更换数据目录) 在后台扫描一次目录，之后查找只查索引
+        """
+        from tomey_parser.tms.tms_catalog import TmsCatalog
+        tomey_data_dir = self._read_config_value('tomey_data_path')
+        if not tomey_data_dir:
+            return None
+        with self._catalog_lock:
+            catalog = self._catalog
+            if catalog is None or catalog.dataDir != os.path.abspath(tomey_data_dir):
+                catalog = self._catalog = TmsCatalog(tomey_data_dir, TOMEY_INDEX_PATH)
+                threading.Thread(target=catalog.rescan, daemon=True).start()
+        return catalog
+
     def load_tomey_path(self):
         return self._read_config_value('tomey_path')
     def load_tomey_data_path(self):
@@ -919,6 +991,7 @@ class Api:
             # 这里不强制检查是否存在 .tms 文件，因为目录可能是空的
             
             self._save_config_value('tomey_data_path', selected_path)
+            self._tomey_catalog()  # 后台建立新目录的索引
             return {'success': True, 'message': 'Tomey 数据目录配置成功', 'path': selected_path}
         except Exception as e: 
             return {'success': False, 'error': str(e)}
@@ -1117,6 +1190,7 @@ if __name__ == '__main__':
         from webview import create_window, start
         import webview
         api = Api()
+        api._tomey_catalog()  # 后台更新 Tomey 数据目录索引
         
         logging.info("Creating webview window...")
         window = create_window(
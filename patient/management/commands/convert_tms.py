@@ -0,0 +1,66 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tomey_parser.tms.tms_archive import TmsArchive, convertFile
+
+
+class Command(BaseCommand):
+    help = '批量将 Tomey .tms 文件转换为列式归档 (npz 分片: radius、height、stats)，支持断点续转，跳过未变化的文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source_dir', help='.tms 文件所在目录')
+        parser.add_argument('--output', default=os.path.join(settings.MEDIA_ROOT, 'tms_archive'),
+                            help='归档目录，默认 MEDIA_ROOT/tms_archive')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行进程数')
+        parser.add_argument('--shard-size', type=int, default=500, help='每个分片的文件数，也是断点的粒度')
+        parser.add_argument('--recursive', action='store_true', help='包含子目录')
+        parser.add_argument('--force', action='store_true', help='忽略已有归档，全部重新转换')
+
+    def handle(self, *args, **options):
+        source_dir = os.path.abspath(options['source_dir'])
+        if not os.path.isdir(source_dir):
+            raise CommandError(f'目录不存在: {source_dir}')
+        shard_size = max(1, options['shard_size'])
+        workers = max(1, options['workers'])
+
+        archive = TmsArchive(options['output'])
+        todo, skipped = archive.pending(source_dir, recursive=options['recursive'], force=options['force'])
+        total = len(todo)
+        self.stdout.write(f'待转换 {total} 个文件，跳过未变化的 {skipped} 个，归档目录: {archive.archiveDir}')
+        if not total:
+            self.stdout.write(self.style.SUCCESS('没有需要转换的文件'))
+            return
+
+        start = time.time()
+        done = 0
+        failed = []
+        batch = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # 按分片提交，每个分片写完即落盘，中断后已完成的分片不会重复转换
+            for offset in range(0, total, shard_size):
+                futures = [executor.submit(convertFile, path) for path in todo[offset:offset + shard_size]]
+                for future in as_completed(futures):
+                    row = future.result()
+                    done += 1
+                    if 'error' in row:
+                        failed.append(row)
+                        self.stderr.write(f"转换失败: {row['source']}, {row['error']}")
+                    else:
+                        batch.append(row)
+                    if done % 50 == 0 or done == total:
+                        elapsed = time.time() - start
+                        self.stdout.write(f'[{done}/{total}] {done / elapsed:.1f} 个/秒')
+
+                shard_name = archive.writeShard(source_dir, batch)
+                if shard_name:
+                    self.stdout.write(f'写入分片 {shard_name}: {len(batch)} 个文件')
+                batch = []
+
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'转换完成: 成功 {total - len(failed)} 个，失败 {len(failed)} 个，跳过 {skipped} 个，用时 {elapsed:.1f} 秒'
+        ))
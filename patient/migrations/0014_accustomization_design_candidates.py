@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0013_patient_created_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accustomization',
+            name='design_candidates',
+            field=models.JSONField(blank=True, default=list, help_text='平k拟合的备选组合（按平均平方差排序）', verbose_name='备选设计'),
+        ),
+    ]
@@ -224,6 +224,8 @@ class ACCustomization(models.Model):
     tac_position = models.DecimalField(max_digits=5, decimal_places=2, default=0, help_text="Tac档位",
                                        verbose_name="Tac档位", null=True, blank=True)
     tear_film_data = models.JSONField(default=dict, help_text="泪膜图数据", verbose_name="泪膜图数据")
+    design_candidates = models.JSONField(default=list, blank=True, help_text="平k拟合的备选组合（按平均平方差排序）",
+                                         verbose_name="备选设计")
     ai_code = models.CharField(max_length=100, blank=True, null=True, verbose_name="AI码")
     fluorescent_staining_image = models.ImageField(upload_to='fa_image', null=True,
                                                    blank=True, help_text="荧光染色图", verbose_name="荧光染色图")
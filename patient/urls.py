@@ -28,6 +28,8 @@ from patient.views.other import (
     ParamsModifyView,
     GenerateExportDataView,
     UpdateExportCountView,
+    DiameterSweepView,
+    LensTypeComparisonView,
 
 )
 
@@ -69,6 +71,10 @@ urlpatterns = [
     path('api/generate-export-data/', GenerateExportDataView.as_view(), name='generate_export_data'),
     # 更新导出次数的API
     path('api/update-export-count/', UpdateExportCountView.as_view(), name='update_export_count'),
+    # 总直径试算的API（一次返回一组总直径下的最佳设计）
+    path('api/diameter-sweep/', DiameterSweepView.as_view(), name='diameter_sweep'),
+    # 镜片类型比较的API（同一角膜高度下一次计算 s、A、PRO 的泪膜图）
+    path('api/lens-type-comparison/', LensTypeComparisonView.as_view(), name='lens_type_comparison'),
     # ==========================================================
     # =============   ↑↑↑ 新增的 API 路径 ↑↑↑   ==================
     # ==========================================================
@@ -18,14 +18,10 @@ from patient.forms import (
 )
 from patient.views.other import *
 
-from services.medment import KBQ
-from services.medment_4 import KBQ as KBQ_4
+from services.fitting_session import FittingSession
 from services.zs_tear_film import TearFilmHeightCalculator, FluorescentStaining
 from services.z_leimo import TEARFILMDATA
-from services.dixingtu_med_height import parse_topographic_map_data
-from services.dixingt_med_qiexiang import parse_qiexiang_data
-from services.dixingt_med_zhouxiang import parse_zhouxiang_data
-from services.dixingt_med_leimozhiliang import parse_leiomozhilaing_data
+from services.topography_maps import generate_maps
 from services.z_qcode import txt_to_qrcode
 
 from django.http import JsonResponse
@@ -256,6 +252,9 @@ class BasicParasCreateView(CreateView):
                 # 3. (新增) 解析用于AI码的 50x50 原始数据矩阵
                 raw_data_array = mxf_parser.parse_calculated_value() 
 
+                # 4. 同一请求只加载一次地形图文件，平K、陡K拟合和泪膜图共用
+                session = FittingSession(0, filter_data=full_path)
+
             except Exception as e:
                 # 确保导入 traceback: import traceback
                 # traceback.print_exc() # 打印详细错误，帮助调试
@@ -273,9 +272,9 @@ class BasicParasCreateView(CreateView):
                   f"{[inclined_angle, inclined_angle + 180]}", )
 
             # 计算平K方向
-            flat_k_com_result = KBQ([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
-                                    [plane_angle, plane_angle + 180],
-                                    filter_data=full_path).main(k_type=0, special_type=special_type)
+            flat_k_com_result = session.fit([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
+                                            [plane_angle, plane_angle + 180],
+                                            k_type=0, special_type=special_type, top_n=settings.KBQ_TOP_N)
             if flat_k_com_result is None:
                 return {"data": "角膜地形图数据不全，请更换角膜地形图文件", "state": 0, }
 
@@ -286,6 +285,8 @@ class BasicParasCreateView(CreateView):
             ac_arc_k4 = flat_k_com_result['best_data']['K']
             reverse_arc_height = flat_k_com_result['best_data']["B"] + 5
             ace_position = flat_k_com_result['best_data']['Q']
+            # 平k拟合的前几个组合，随设计保存，供选择备选设计
+            design_candidates = flat_k_com_result.get('candidates', [])
 
             # 计算陡K方向
             print(f"陡K方向参数：{[round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end]}, "
@@ -294,12 +295,12 @@ class BasicParasCreateView(CreateView):
                   f"{flat_k_com_result['best_data']['B']}")
 
             # 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
-            steep_k_com_result = KBQ([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
-                                     [inclined_angle, inclined_angle + 180],
-                                     filter_data=full_path).main(k_type=1,
-                                                                 pin_q_values=flat_k_com_result['best_data']['Q'],
-                                                                 pin_b_values=flat_k_com_result['best_data']["B"],
-                                                                 special_type=special_type)
+            steep_k_com_result = session.fit([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
+                                             [inclined_angle, inclined_angle + 180],
+                                             k_type=1,
+                                             pin_q_values=flat_k_com_result['best_data']['Q'],
+                                             pin_b_values=flat_k_com_result['best_data']["B"],
+                                             special_type=special_type)
             if steep_k_com_result is None:
                 return {"data": "角膜地形图数据不全，请更换角膜地形图文件", "state": 0, }
 
@@ -335,11 +336,13 @@ class BasicParasCreateView(CreateView):
 
             
             # 原来的代码只获取了图片路径，现在我们获取包含路径和原始数据的整个字典
-            img_tangential_curvature = parse_qiexiang_data(file_path=full_path).get("save_dir_path")
-            raw_data_tangential = parse_qiexiang_data(file_path=full_path).get("raw_plotly_data") # 获取我们新增的原始数据
+            # 每张图只生成一次，图片和原始数据取自同一次结果，两张图并行生成
+            maps = generate_maps(full_path, ("tangential", "axial"))
+            img_tangential_curvature = maps["tangential"].get("save_dir_path")
+            raw_data_tangential = maps["tangential"].get("raw_plotly_data") # 获取我们新增的原始数据
             
-            img_axial_curvature = parse_zhouxiang_data(file_path=full_path).get("save_dir_path")
-            raw_data_axial = parse_zhouxiang_data(file_path=full_path).get("raw_plotly_data")
+            img_axial_curvature = maps["axial"].get("save_dir_path")
+            raw_data_axial = maps["axial"].get("raw_plotly_data")
             # ======================↑↑↑================================
 
 
@@ -383,6 +386,7 @@ class BasicParasCreateView(CreateView):
                     'reverse_arc_height': reverse_arc_height,
                     'ace_position': ace_position,
                     'tac_position': tac_position,
+                    'design_candidates': design_candidates,
                     'base_arc_curvature_radius': base_arc_curvature_radius,
                     # 'qrcode_medment_accustomization': qrcode_path,
                     # --- ↓↓↓ 新增这两行来保存计算结果 ↓↓↓ ---
@@ -404,7 +408,8 @@ class BasicParasCreateView(CreateView):
                 'reverse_arc_height': reverse_arc_height,
                 'overall_diameter': basic_params_data.overall_diameter,
                 'al_type': 0,
-                'file_path': full_path
+                'file_path': full_path,
+                'session': session,
             }
             # print(f"common_params:{common_params}")
             print("计算平K泪膜图")
@@ -602,6 +607,8 @@ class CustomizeViewCreate(CreateView):
 
             try:
                 parse_data = aop_mxf.OperationMXF(full_path).parse_parameters()
+                # 同一请求只加载一次地形图文件，平K、陡K拟合和泪膜图共用
+                session = FittingSession(1, filter_data=full_path)
             except Exception as e:
                 return {"data": "角膜地形图数据非当前左/右眼文件，请更换角膜地形图文件", "state": 0, }
 
@@ -616,9 +623,9 @@ class CustomizeViewCreate(CreateView):
             #       f"{[inclined_angle, inclined_angle + 180]}", )
 
             # 计算平K方向
-            flat_k_com_result = KBQ_4([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
-                                      [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
-                                      filter_data=full_path).main(k_type=0, special_type=special_type)
+            flat_k_com_result = session.fit([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
+                                            [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
+                                            k_type=0, special_type=special_type, top_n=settings.KBQ_TOP_N)
             if flat_k_com_result is None:
                 return {"data": "角膜地形图数据不全，请更换角膜地形图文件", "state": 0, }
             # print(f"平k:{flat_k_com_result}")
@@ -628,6 +635,8 @@ class CustomizeViewCreate(CreateView):
             ac_arc_k4 = flat_k_com_result[3]['best_data']['K']
             reverse_arc_height = flat_k_com_result[0]['best_data']["B"] + 5
             ace_position = flat_k_com_result[0]['best_data']['Q']
+            # 第一个方向平k拟合的前几个组合，随设计保存，供选择备选设计
+            design_candidates = flat_k_com_result[0].get('candidates', [])
 
             # 计算陡K方向
             # print(f"陡K方向参数：{[round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end]}, "
@@ -636,12 +645,12 @@ class CustomizeViewCreate(CreateView):
             #       f"{flat_k_com_result[0]['best_data']['B']}")
 
             # 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
-            steep_k_com_result = KBQ_4([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
-                                       [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
-                                       filter_data=full_path).main(k_type=1,
-                                                                   pin_q_values=flat_k_com_result[0]['best_data']['Q'],
-                                                                   pin_b_values=flat_k_com_result[0]['best_data']["B"],
-                                                                   special_type=special_type)
+            steep_k_com_result = session.fit([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
+                                             [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
+                                             k_type=1,
+                                             pin_q_values=flat_k_com_result[0]['best_data']['Q'],
+                                             pin_b_values=flat_k_com_result[0]['best_data']["B"],
+                                             special_type=special_type)
             if steep_k_com_result is None:
                 return {"data": "角膜地形图数据不全，请更换角膜地形图文件", "state": 0, }
 
@@ -653,21 +662,23 @@ class CustomizeViewCreate(CreateView):
 
             
 
-            img_corneal_height = parse_topographic_map_data(file_path=full_path).get("save_dir_path")
+            # 四张图并行生成，每张图只生成一次，图片和原始数据取自同一次结果
+            maps = generate_maps(full_path, ("height", "tangential", "axial", "tear_film_quality"))
+            img_corneal_height = maps["height"].get("save_dir_path")
             # ==========================================================
             # =============   ↓↓↓ 捕获完整结果 ↓↓↓   ==========
             # ==========================================================
             
             # 原来的代码只获取了图片路径，现在获取包含路径和原始数据的整个字典
-            img_tangential_curvature = parse_qiexiang_data(file_path=full_path).get("save_dir_path")
-            raw_data_tangential = parse_qiexiang_data(file_path=full_path).get("raw_plotly_data") 
+            img_tangential_curvature = maps["tangential"].get("save_dir_path")
+            raw_data_tangential = maps["tangential"].get("raw_plotly_data") 
 
-            img_axial_curvature = parse_zhouxiang_data(file_path=full_path).get("save_dir_path")
-            raw_data_axial = parse_zhouxiang_data(file_path=full_path).get("raw_plotly_data")
+            img_axial_curvature = maps["axial"].get("save_dir_path")
+            raw_data_axial = maps["axial"].get("raw_plotly_data")
              # ======================↑↑↑================================
              # ======================↑↑↑================================
              # ======================↑↑↑================================
-            img_tear_film_quality = parse_leiomozhilaing_data(file_path=full_path).get("save_dir_path")
+            img_tear_film_quality = maps["tear_film_quality"].get("save_dir_path")
 
             # 保存角膜地形图
             corneal_topography, created = CornealTopography.objects.update_or_create(
@@ -739,6 +750,7 @@ class CustomizeViewCreate(CreateView):
                     'reverse_arc_height': reverse_arc_height,
                     'ace_position': ace_position,
                     'tac_position': tac_position,
+                    'design_candidates': design_candidates,
                     'base_arc_curvature_radius': base_arc_curvature_radius,
                     'qrcode_medment_accustomization': qrcode_path,
                     'reverse_arc_width': f"{reverse_arc_width_val:.2f}",
@@ -758,7 +770,8 @@ class CustomizeViewCreate(CreateView):
                 'reverse_arc_height': reverse_arc_height,
                 'overall_diameter': basic_params_data.overall_diameter,
                 'al_type': 1,
-                'file_path': full_path
+                'file_path': full_path,
+                'session': session,
             }
             # print(f"common_params:{common_params}")
             print("计算平K泪膜图数据开始...")
@@ -15,6 +15,7 @@ from django.conf import settings
 from services.zs_tear_film import TearFilmHeightCalculator, FluorescentStaining
 from services.z_leimo import TEARFILMDATA
 from services.z_qcode import txt_to_qrcode
+from services.fitting_session import FittingSession
 
 from patient.views.constants import *
 
@@ -32,6 +33,7 @@ import random
 import string
 import numpy as np
 import re
+from decimal import Decimal
 
 from openpyxl import Workbook
 from openpyxl.styles import Alignment
@@ -597,6 +599,215 @@ class UpdateExportCountView(View):
             return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+
+class DiameterSweepView(View):
+    """
+    总直径试算 API
+    对已完成计算的普通定制（Medmont/Seour/Tomey），一次返回一组总直径下的最佳设计，
+    地形图只加载、采样一次，各直径的拟合结果与单独定制时相同
+    参数: basic_params_id；可选 diameter_start(默认10.0)、diameter_end(默认11.2)、diameter_step(默认0.1)、
+         optical_zone_diameter(默认取定制参数)、special_type(1 为特殊处理)
+    """
+    # 一次最多试算的直径个数
+    MAX_DIAMETERS = 100
+
+    @csrf_exempt
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            basic_params = BasicParams.objects.filter(id=request.POST.get('basic_params_id')).last()
+            if basic_params is None:
+                return JsonResponse({'success': False, 'error': '未找到定制参数。'}, status=400)
+            al_type = int(basic_params.custom_type)
+            if al_type not in FittingSession.SWEEP_TYPES:
+                return JsonResponse({'success': False, 'error': '直径试算只支持普通定制。'}, status=400)
+            corneal = CornealTopography.objects.filter(BasicParams=basic_params).last()
+            if corneal is None or not basic_params.corneal_file:
+                return JsonResponse({'success': False, 'error': '请先完成角膜地形图计算。'}, status=400)
+
+            try:
+                diameter_start = float(request.POST.get('diameter_start') or 10.0)
+                diameter_end = float(request.POST.get('diameter_end') or 11.2)
+                diameter_step = float(request.POST.get('diameter_step') or 0.1)
+                optical_zone_diameter = float(request.POST.get('optical_zone_diameter')
+                                              or basic_params.optical_zone_diameter)
+            except ValueError:
+                return JsonResponse({'success': False, 'error': '直径参数格式错误。'}, status=400)
+            if diameter_step <= 0 or diameter_end < diameter_start:
+                return JsonResponse({'success': False, 'error': '直径范围错误。'}, status=400)
+            count = int(round((diameter_end - diameter_start) / diameter_step)) + 1
+            if count > self.MAX_DIAMETERS:
+                return JsonResponse({'success': False, 'error': f'一次最多试算 {self.MAX_DIAMETERS} 个直径。'},
+                                    status=400)
+            diameters = [round(diameter_start + diameter_step * i, 2) for i in range(count)]
+            special_type = request.POST.get('special_type') in ('1', 'true', 'True')
+
+            corneal_file = os.path.normpath(os.path.join(settings.MEDIA_ROOT, str(basic_params.corneal_file)))
+            if al_type == 4:
+                if not basic_params.corneal_file2:
+                    return JsonResponse({'success': False, 'error': '缺少高度数据文件。'}, status=400)
+                corneal_file2 = os.path.normpath(os.path.join(settings.MEDIA_ROOT, str(basic_params.corneal_file2)))
+                session = FittingSession(al_type, rm_dat_path=corneal_file, ch_dat_path=corneal_file2)
+            else:
+                session = FittingSession(al_type, filter_data=corneal_file)
+
+            plane_angle = float(corneal.plane_angle)
+            inclined_angle = float(corneal.inclined_angle)
+            rows = session.diameter_sweep(diameters, optical_zone_diameter,
+                                          [plane_angle, plane_angle + 180],
+                                          [inclined_angle, inclined_angle + 180],
+                                          special_type=special_type)
+
+            designs = []
+            for row in rows:
+                flat, steep = row['flat'], row['steep']
+                design = {
+                    'overall_diameter': row['overall_diameter'],
+                    'ac_arc_start': round(row['ac_arc_start'], 3),
+                    'ac_arc_end': round(row['ac_arc_end'], 3),
+                    'ac_arc_k1': None,
+                    'ace_position': None,
+                    'reverse_arc_height': None,
+                    'steep_k_calculate': None,
+                    'tac_position': None,
+                    'flat_variance': None,
+                    'steep_variance': None,
+                }
+                if flat is not None:
+                    design.update({
+                        'ac_arc_k1': float(flat['best_data']['K']),
+                        'ace_position': float(flat['best_data']['Q']),
+                        'reverse_arc_height': float(flat['best_data']['B'] + 5),
+                        'flat_variance': float(flat['minimum_variance']),
+                    })
+                if steep is not None:
+                    design.update({
+                        'steep_k_calculate': float(steep['best_data']['K']),
+                        'tac_position': float(abs(steep['best_data']['K'] - flat['best_data']['K'])),
+                        'steep_variance': float(steep['minimum_variance']),
+                    })
+                designs.append(design)
+
+            return JsonResponse({
+                'success': True,
+                'custom_type': basic_params.custom_type,
+                'optical_zone_diameter': optical_zone_diameter,
+                'designs': designs,
+            })
+
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+class LensTypeComparisonView(View):
+    """
+    镜片类型比较 API
+    按已保存的定制参数，在同一角膜高度下一次计算所有镜片类型（s、A、PRO）的泪膜图，不必按类型重复提交
+    参数: ac_customization_id；可选 lens_types(逗号分隔，默认全部)
+    """
+
+    @csrf_exempt
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    @staticmethod
+    def serialize(tear_film):
+        """ 泪膜图结果转为可序列化的数据 """
+        return {key: value.tolist() if isinstance(value, np.ndarray) else
+                float(value) if isinstance(value, Decimal) else value
+                for key, value in tear_film.items()}
+
+    def post(self, request, *args, **kwargs):
+        try:
+            ac_customization = ACCustomization.objects.filter(id=request.POST.get('ac_customization_id')).last()
+            if ac_customization is None or ac_customization.BasicParams is None:
+                return JsonResponse({'success': False, 'error': '未找到定制信息。'}, status=400)
+            basic_params = ac_customization.BasicParams
+            corneal = CornealTopography.objects.filter(BasicParams=basic_params).last()
+            if corneal is None or not basic_params.corneal_file:
+                return JsonResponse({'success': False, 'error': '请先完成角膜地形图计算。'}, status=400)
+
+            lens_types = [item.strip() for item in request.POST.get('lens_types', '').split(',') if item.strip()]
+            unknown = [item for item in lens_types if item not in ('s', 'A', 'PRO')]
+            if unknown:
+                return JsonResponse({'success': False, 'error': f"不支持的镜片类型: {', '.join(unknown)}"}, status=400)
+
+            al_type = int(basic_params.custom_type)
+            corneal_file = os.path.normpath(os.path.join(settings.MEDIA_ROOT, str(basic_params.corneal_file)))
+            file_params = {'file_path': corneal_file}
+            if al_type in (4, 5):
+                corneal_file2 = os.path.normpath(os.path.join(settings.MEDIA_ROOT, str(basic_params.corneal_file2)))
+                file_params = {'rm_file': corneal_file, 'ch_file': corneal_file2}
+                session = FittingSession(al_type, rm_dat_path=corneal_file, ch_dat_path=corneal_file2)
+            else:
+                session = FittingSession(al_type, filter_data=corneal_file)
+
+            plane_angle = float(corneal.plane_angle)
+            inclined_angle = float(corneal.inclined_angle)
+            common_params = {
+                'lens_type': basic_params.lens_type,
+                'optical_zone_diameter': float(basic_params.optical_zone_diameter),
+                'ace_position': float(ac_customization.ace_position),
+                'flat_k': float(corneal.flat_k),
+                'base_arc_curvature_radius': float(ac_customization.base_arc_curvature_radius),
+                'side_arc_position': float(ac_customization.side_arc_position),
+                'ac_arc_start': float(basic_params.ac_arc_start),
+                'ac_arc_end': float(basic_params.ac_arc_end),
+                'reverse_arc_height': float(ac_customization.reverse_arc_height),
+                'overall_diameter': float(basic_params.overall_diameter),
+                'al_type': al_type,
+                'session': session,
+                **file_params,
+            }
+
+            # 普通定制分别比较平k、陡k方向；四轴定制四个方向一起比较
+            if al_type in FittingSession.SWEEP_TYPES:
+                directions = {
+                    'ping_k': TearFilmHeightCalculator(ac_arc_k1=float(ac_customization.ac_arc_k1),
+                                                       degree_list=[plane_angle, plane_angle + 180],
+                                                       **common_params),
+                    'steep_k': TearFilmHeightCalculator(ac_arc_k1=float(ac_customization.steep_k_calculate),
+                                                        degree_list=[inclined_angle, inclined_angle + 180],
+                                                        **common_params),
+                }
+            else:
+                directions = {
+                    'four_axis': TearFilmHeightCalculator(
+                        ac_arc_k1=float(ac_customization.ac_arc_k1),
+                        ac_arc_k2=float(ac_customization.ac_arc_k2),
+                        ac_arc_k3=float(ac_customization.ac_arc_k3),
+                        ac_arc_k4=float(ac_customization.ac_arc_k4),
+                        degree_list=[plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
+                        **common_params),
+                }
+
+            comparison = {}
+            for direction, calculator in directions.items():
+                for lens_type, result in calculator.compare_lens_types(lens_types or None).items():
+                    comparison.setdefault(lens_type, {})[direction] = {
+                        'summary': result['summary'],
+                        'tear_film': self.serialize(result['tear_film']),
+                    }
+
+            return JsonResponse({
+                'success': True,
+                'current_lens_type': basic_params.lens_type,
+                'comparison': comparison,
+            })
+
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
 class ImportCustomizedView(TemplateView):
     # template_name = 'patient/import_customized.html'
     # template_name = 'upexportimport/import_customized.html'
@@ -17,9 +17,8 @@ from patient.forms import (
 )
 from patient.views.other import ParamsModifyView
 
-from services.seour import KBQ
 from services.seour import SeourExtractor
-from services.seour_4 import KBQ as KBQ_4
+from services.fitting_session import FittingSession
 
 from services.zs_tear_film import TearFilmHeightCalculator, FluorescentStaining
 from services.z_leimo import TEARFILMDATA
@@ -138,6 +137,9 @@ class SeourBasicParasCreateView(CreateView):
                 #    (它在 services/seour.py 的 __init__ 中被加载到 self.height_data)
                 raw_data_array = seour_extractor.height_data 
 
+                # 4. 同一请求只加载一次地形图文件，平K、陡K拟合和泪膜图共用（直接复用上面的 extractor）
+                session = FittingSession(2, filter_data=full_path, extractor=seour_extractor)
+
             except Exception as e:
                 # (建议添加 traceback 以便调试)
                 import traceback
@@ -155,9 +157,9 @@ class SeourBasicParasCreateView(CreateView):
             #       f"{[inclined_angle, inclined_angle + 180]}", )
 
             # 计算平K方向
-            flat_k_com_result = KBQ([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
-                                    [plane_angle, plane_angle + 180],
-                                    filter_data=full_path).main(k_type=0, special_type=special_type)
+            flat_k_com_result = session.fit([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
+                                            [plane_angle, plane_angle + 180],
+                                            k_type=0, special_type=special_type, top_n=settings.KBQ_TOP_N)
 
             # print(f"平k:{flat_k_com_result}")
             ac_arc_k1 = flat_k_com_result['best_data']['K']
@@ -166,6 +168,8 @@ class SeourBasicParasCreateView(CreateView):
             ac_arc_k4 = flat_k_com_result['best_data']['K']
             reverse_arc_height = flat_k_com_result['best_data']["B"] + 5
             ace_position = flat_k_com_result['best_data']['Q']
+            # 平k拟合的前几个组合，随设计保存，供选择备选设计
+            design_candidates = flat_k_com_result.get('candidates', [])
 
             # 计算陡K方向
             # print(f"陡K方向参数：{[round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end]}, "
@@ -174,12 +178,12 @@ class SeourBasicParasCreateView(CreateView):
             #       f"{flat_k_com_result['best_data']['B']}")
 
             # 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
-            steep_k_com_result = KBQ([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
-                                     [inclined_angle, inclined_angle + 180],
-                                     filter_data=full_path).main(k_type=1,
-                                                                 pin_q_values=flat_k_com_result['best_data']['Q'],
-                                                                 pin_b_values=flat_k_com_result['best_data']["B"],
-                                                                 special_type=special_type)
+            steep_k_com_result = session.fit([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
+                                             [inclined_angle, inclined_angle + 180],
+                                             k_type=1,
+                                             pin_q_values=flat_k_com_result['best_data']['Q'],
+                                             pin_b_values=flat_k_com_result['best_data']["B"],
+                                             special_type=special_type)
 
             # print(f"陡k:{steep_k_com_result}")
             steep_k_calculate = steep_k_com_result['best_data']['K']
@@ -224,6 +228,7 @@ class SeourBasicParasCreateView(CreateView):
                     'reverse_arc_height': reverse_arc_height,
                     'ace_position': ace_position,
                     'tac_position': tac_position,
+                    'design_candidates': design_candidates,
                     'base_arc_curvature_radius': base_arc_curvature_radius,
                     # --- ↓↓↓ 3. 保存二维码路径 ↓↓↓ ---
                     # 'qrcode_medment_accustomization': qrcode_path,
@@ -248,7 +253,8 @@ class SeourBasicParasCreateView(CreateView):
                 'overall_diameter': basic_params_data.overall_diameter,
                 'al_type': 2,
                 'degree_list': [inclined_angle, inclined_angle + 180],
-                'file_path': full_path
+                'file_path': full_path,
+                'session': session,
             }
 
             # 计算平K泪膜图
@@ -473,6 +479,8 @@ class SeourCustomizeViewCreate(CreateView):
 
             try:
                 parse_data = SeourExtractor(full_path).parse_eye_data()['KeratometricIndices3mm']
+                # 同一请求只加载一次地形图文件，平K、陡K拟合和泪膜图共用
+                session = FittingSession(3, filter_data=full_path)
             except:
                 return {"data": "角膜地形图数据非当前左/右眼文件，请更换角膜地形图文件", "state": 0, }
 
@@ -488,9 +496,9 @@ class SeourCustomizeViewCreate(CreateView):
 
             # 计算平K方向
             try:
-                flat_k_com_result = KBQ_4([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
-                                          [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
-                                          filter_data=full_path).main(k_type=0, special_type=special_type)
+                flat_k_com_result = session.fit([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
+                                                [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
+                                                k_type=0, special_type=special_type, top_n=settings.KBQ_TOP_N)
             except ValueError as e:
                 return {"data": f"{e}", "state": 0, }
 
@@ -501,6 +509,8 @@ class SeourCustomizeViewCreate(CreateView):
             ac_arc_k4 = flat_k_com_result[3]['best_data']['K']
             reverse_arc_height = flat_k_com_result[0]['best_data']["B"] + 5
             ace_position = flat_k_com_result[0]['best_data']['Q']
+            # 第一个方向平k拟合的前几个组合，随设计保存，供选择备选设计
+            design_candidates = flat_k_com_result[0].get('candidates', [])
 
             # 计算陡K方向
             # print(f"陡K方向参数：{[round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end]}, "
@@ -510,12 +520,12 @@ class SeourCustomizeViewCreate(CreateView):
 
             # 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
             try:
-                steep_k_com_result = KBQ_4([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
-                                           [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
-                                           filter_data=full_path).main(k_type=1,
-                                                                       pin_q_values=flat_k_com_result[0]['best_data']['Q'],
-                                                                       pin_b_values=flat_k_com_result[0]['best_data']["B"],
-                                                                       special_type=special_type)
+                steep_k_com_result = session.fit([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
+                                                 [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
+                                                 k_type=1,
+                                                 pin_q_values=flat_k_com_result[0]['best_data']['Q'],
+                                                 pin_b_values=flat_k_com_result[0]['best_data']["B"],
+                                                 special_type=special_type)
             except ValueError as e:
                 return {"data": f"{e}", "state": 0, }
 
@@ -552,6 +562,7 @@ class SeourCustomizeViewCreate(CreateView):
                     'reverse_arc_height': reverse_arc_height,
                     'ace_position': ace_position,
                     'tac_position': tac_position,
+                    'design_candidates': design_candidates,
                     'base_arc_curvature_radius': base_arc_curvature_radius
                 }
             )
@@ -568,7 +579,8 @@ class SeourCustomizeViewCreate(CreateView):
                 'reverse_arc_height': reverse_arc_height,
                 'overall_diameter': basic_params_data.overall_diameter,
                 'al_type': basic_params_data.custom_type,
-                'file_path': full_path
+                'file_path': full_path,
+                'session': session,
             }
             # print(f"common_params:{common_params}")
 
@@ -18,9 +18,7 @@ from patient.forms import (
 
 from patient.views.other import ParamsModifyView
 
-from services.tomey import KBQ
-from services.tomey import TomeyExtractor
-from services.tomey_4 import KBQ as KBQ_4
+from services.fitting_session import FittingSession
 from services.zs_tear_film import TearFilmHeightCalculator, FluorescentStaining
 from services.z_leimo import TEARFILMDATA
 
@@ -147,14 +145,17 @@ class ProcessTomeyDataView(View):
             # 4. 智能设计计算 (KBQ算法)
             # ==========================================
             
+            # 同一请求只加载一次地形图文件，平K、陡K拟合和泪膜图共用
+            session = None
+
             # 4.1 平K方向
             try:
-                flat_k_result = KBQ(
+                session = FittingSession(4, rm_dat_path=rm_file_path, ch_dat_path=ch_file_path)
+                flat_k_result = session.fit(
                     [basic_param.ac_arc_start, basic_param.ac_arc_end],
                     [plane_angle, plane_angle + 180],
-                    rm_dat_path=rm_file_path, 
-                    ch_dat_path=ch_file_path
-                ).main(k_type=0, special_type=False)
+                    k_type=0, special_type=False, top_n=settings.KBQ_TOP_N
+                )
             except Exception as e:
                 # 捕获算法内部错误，防止崩溃，使用默认值兜底
                 print(f"KBQ算法(平K)计算错误: {str(e)}")
@@ -168,22 +169,23 @@ class ProcessTomeyDataView(View):
                 ac_arc_k4 = ac_arc_k1
                 reverse_arc_height = best_data_flat["B"] + 5
                 ace_position = best_data_flat['Q']
+                design_candidates = flat_k_result.get('candidates', [])
             else:
                 # 如果计算失败，给一个合理的默认值，避免报错
                 ac_arc_k1 = flat_k - 1.0
                 ac_arc_k2 = ac_arc_k3 = ac_arc_k4 = ac_arc_k1
                 reverse_arc_height = -0.05
                 ace_position = 0
+                design_candidates = []
 
             # 4.2 陡K方向
             steep_k_calculate = steep_k - 1.0 # 默认值
             try:
-                steep_k_result = KBQ(
+                steep_k_result = session.fit(
                     [round(basic_param.ac_arc_start, 2), basic_param.ac_arc_end],
                     [inclined_angle, inclined_angle + 180],
-                    rm_dat_path=rm_file_path, 
-                    ch_dat_path=ch_file_path
-                ).main(k_type=1, pin_q_values=ace_position, pin_b_values=reverse_arc_height-5, special_type=False) # 注意还原B值
+                    k_type=1, pin_q_values=ace_position, pin_b_values=reverse_arc_height-5, special_type=False # 注意还原B值
+                )
 
                 if steep_k_result and steep_k_result.get('best_data'):
                     steep_k_calculate = steep_k_result['best_data']['K']
@@ -227,6 +229,7 @@ class ProcessTomeyDataView(View):
                     'reverse_arc_height': reverse_arc_height,
                     'ace_position': ace_position,
                     'tac_position': tac_position,
+                    'design_candidates': design_candidates,
                     'base_arc_curvature_radius': base_arc_curvature_radius,
                     'side_arc_position': 8.8,
                     'reverse_arc_width': reverse_arc_width_val,
@@ -251,6 +254,7 @@ class ProcessTomeyDataView(View):
                 'al_type': 4,
                 'rm_file': rm_file_path,
                 'ch_file': ch_file_path,
+                'session': session,
             }
 
             try:
@@ -447,8 +451,9 @@ class TomeyBasicParasCreateView(CreateView):
             ch_file = os.path.join(settings.MEDIA_ROOT, str(ch_file))
             ch_file = os.path.normpath(ch_file)
 
+            # 同一请求只加载一次地形图文件，平K、陡K拟合和泪膜图共用
             try:
-                parse_data = TomeyExtractor(rm_dat_path=rm_file, ch_dat_path=ch_file)
+                session = FittingSession(4, rm_dat_path=rm_file, ch_dat_path=ch_file)
             except:
                 return {"data": "角膜地形图数据非当前左/右眼文件，请更换角膜地形图文件", "state": 0, }
 
@@ -464,9 +469,9 @@ class TomeyBasicParasCreateView(CreateView):
 
             # 计算平K方向
             try:
-                flat_k_com_result = KBQ([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
-                                        [plane_angle, plane_angle + 180],
-                                        rm_dat_path=rm_file, ch_dat_path=ch_file).main(k_type=0, special_type=special_type)
+                flat_k_com_result = session.fit([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
+                                                [plane_angle, plane_angle + 180],
+                                                k_type=0, special_type=special_type, top_n=settings.KBQ_TOP_N)
             except Exception as e:
                 return {"data": f"{e}", "state": 0, }
 
@@ -477,6 +482,8 @@ class TomeyBasicParasCreateView(CreateView):
             ac_arc_k4 = flat_k_com_result['best_data']['K']
             reverse_arc_height = flat_k_com_result['best_data']["B"] + 5
             ace_position = flat_k_com_result['best_data']['Q']
+            # 平k拟合的前几个组合，随设计保存，供选择备选设计
+            design_candidates = flat_k_com_result.get('candidates', [])
 
             # 计算陡K方向
             # print(f"陡K方向参数：{[round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end]}, "
@@ -486,12 +493,12 @@ class TomeyBasicParasCreateView(CreateView):
 
             # 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
             try:
-                steep_k_com_result = KBQ([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
-                                         [inclined_angle, inclined_angle + 180],
-                                         rm_dat_path=rm_file, ch_dat_path=ch_file).main(k_type=1,
-                                                                     pin_q_values=flat_k_com_result['best_data']['Q'],
-                                                                     pin_b_values=flat_k_com_result['best_data']["B"],
-                                                                     special_type=special_type)
+                steep_k_com_result = session.fit([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
+                                                 [inclined_angle, inclined_angle + 180],
+                                                 k_type=1,
+                                                 pin_q_values=flat_k_com_result['best_data']['Q'],
+                                                 pin_b_values=flat_k_com_result['best_data']["B"],
+                                                 special_type=special_type)
             except Exception as e:
                 return {"data": f"{e}", "state": 0, }
 
@@ -532,6 +539,7 @@ class TomeyBasicParasCreateView(CreateView):
                     'reverse_arc_height': reverse_arc_height,
                     'ace_position': ace_position,
                     'tac_position': tac_position,
+                    'design_candidates': design_candidates,
                     'base_arc_curvature_radius': base_arc_curvature_radius,
                     # --- ↓↓↓ 3. 保存二维码路径 ↓↓↓ ---
                     # 'qrcode_medment_accustomization': qrcode_path,
@@ -558,6 +566,7 @@ class TomeyBasicParasCreateView(CreateView):
                 'degree_list': [inclined_angle, inclined_angle + 180],
                 'rm_file': rm_file,
                 "ch_file": ch_file,
+                'session': session,
             }
 
             # 计算平K泪膜图
@@ -861,8 +870,9 @@ class TomeyCustomizeViewCreate(CreateView):
             ch_file = os.path.join(settings.MEDIA_ROOT, str(ch_file))
             ch_file = os.path.normpath(ch_file)
 
+            # 同一请求只加载一次地形图文件，平K、陡K拟合和泪膜图共用
             try:
-                parse_data = TomeyExtractor(rm_dat_path=rm_file, ch_dat_path=ch_file)
+                session = FittingSession(5, rm_dat_path=rm_file, ch_dat_path=ch_file)
             except:
                 return {"data": "角膜地形图数据非当前左/右眼文件，请更换角膜地形图文件", "state": 0, }
 
@@ -878,9 +888,9 @@ class TomeyCustomizeViewCreate(CreateView):
 
             # 计算平K方向
             try:
-                flat_k_com_result = KBQ_4([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
-                                          [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
-                                          rm_dat_path=rm_file, ch_dat_path=ch_file).main(k_type=0, special_type=special_type)
+                flat_k_com_result = session.fit([basic_params_data.ac_arc_start, basic_params_data.ac_arc_end],
+                                                [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
+                                                k_type=0, special_type=special_type, top_n=settings.KBQ_TOP_N)
             except ValueError as e:
                 return {"data": f"{e}", "state": 0, }
 
@@ -891,6 +901,8 @@ class TomeyCustomizeViewCreate(CreateView):
             ac_arc_k4 = flat_k_com_result[3]['best_data']['K']
             reverse_arc_height = flat_k_com_result[0]['best_data']["B"] + 5
             ace_position = flat_k_com_result[0]['best_data']['Q']
+            # 第一个方向平k拟合的前几个组合，随设计保存，供选择备选设计
+            design_candidates = flat_k_com_result[0].get('candidates', [])
 
             # 计算陡K方向
             # print(f"陡K方向参数：{[round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end]}, "
@@ -900,12 +912,12 @@ class TomeyCustomizeViewCreate(CreateView):
 
             # 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
             try:
-                steep_k_com_result = KBQ_4([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
-                                           [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
-                                           rm_dat_path=rm_file, ch_dat_path=ch_file).main(k_type=1,
-                                                                       pin_q_values=flat_k_com_result[0]['best_data']['Q'],
-                                                                       pin_b_values=flat_k_com_result[0]['best_data']["B"],
-                                                                       special_type=special_type)
+                steep_k_com_result = session.fit([round(basic_params_data.ac_arc_start, 2), basic_params_data.ac_arc_end],
+                                                 [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
+                                                 k_type=1,
+                                                 pin_q_values=flat_k_com_result[0]['best_data']['Q'],
+                                                 pin_b_values=flat_k_com_result[0]['best_data']["B"],
+                                                 special_type=special_type)
             except ValueError as e:
                 return {"data": f"{e}", "state": 0, }
 
@@ -942,6 +954,7 @@ class TomeyCustomizeViewCreate(CreateView):
                     'reverse_arc_height': reverse_arc_height,
                     'ace_position': ace_position,
                     'tac_position': tac_position,
+                    'design_candidates': design_candidates,
                     'base_arc_curvature_radius': base_arc_curvature_radius
                 }
             )
@@ -961,6 +974,7 @@ class TomeyCustomizeViewCreate(CreateView):
                 'degree_list': [plane_angle, plane_angle + 90, plane_angle + 180, plane_angle + 270],
                 'rm_file': rm_file,
                 "ch_file": ch_file,
+                'session': session,
             }
             # print(f"common_params:{common_params}")
 
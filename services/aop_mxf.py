@@ -1,107 +1,234 @@
+"""
+Medmont .mxf 文件解析
+
+MXFReader 用 iterparse 一遍读完文件，只保留角膜曲率指标（KeratometricIndices7mm、FlatK 等）和
+CornealHeight、TangentialCurvature、AxialCurvature、TearFilmQualityData 四个数据段，
+其余元素读完即释放，所需内容都读到后不再继续读文件。
+OperationMXF 的各个 parse_* 方法返回的内容与原先按整棵树查找（.//）时相同。
+读取结果和解码后的数据矩阵按文件内容缓存（services/topography_cache.py），同一文件不重复解析。
+"""
 import xml.etree.ElementTree as Et
 
 import numpy as np
 import pandas as pd
 import math
 
+from services.topography_cache import topography_cache
+
+# 地形图数据段
+MAP_SECTIONS = ("CornealHeight", "TangentialCurvature", "AxialCurvature", "TearFilmQualityData")
+# 角膜曲率指标
+K_SECTION = "KeratometricIndices7mm"
+K_TAGS = ("FlatK", "FlatAngle", "SteepK", "SteepAngle")
+
+
+def decode_grid(section):
+    """
+    解码数据段的 Data 文本
+    Data 每行一组用空格分隔的数值，首尾各有一个只含缩进的空行（即原先去除的首行、末行，行末空格对应去除的最后一列）。
+    按任意空白分行、分列，所有数值一次转换；转换用 pd.to_numeric（与原先逐列转换的舍入逐位一致，
+    np.float64 的转换在最后一位可能不同），无法转换的值为 NaN，行长不一时不足的补 NaN。
+    :param section: 数据段下的所有字段 {字段名: 文本}
+    :return: numpy.ndarray，每个数据行一行（Medmont 为 50x50）
+    """
+    rows = [line.split() for line in section['Data'].splitlines()]
+    rows = [row for row in rows if row]
+    if not rows:
+        return np.empty((0, 0))
+    width = max(len(row) for row in rows)
+    # 末尾多放一个空值：原先每列都含空值，全是整数时也按浮点数转换
+    tokens = np.full(len(rows) * width + 1, None, dtype=object)
+    if all(len(row) == width for row in rows):
+        tokens[:-1] = [token for row in rows for token in row]
+    else:
+        for number, row in enumerate(rows):
+            tokens[number * width:number * width + len(row)] = row
+    values = np.asarray(pd.to_numeric(tokens, errors='coerce'), dtype=np.float64)
+    return values[:-1].reshape(len(rows), width)
+
+
+class MXFReader:
+    """
+    一遍读取 .mxf 文件中定制和地形图需要的内容
+    每个标签只取文档中第一次出现的元素，与 root.find(".//标签") 一致
+    """
+
+    def __init__(self, xml_file, state=None, grids=None):
+        """
+        :param xml_file: .mxf 文件路径
+        :param state: 缓存的读取结果（state() 的返回值），传入时不再读取文件
+        :param grids: 缓存的各数据段数据矩阵
+        """
+        self.xml_file = xml_file
+        # 数据段名 -> {字段名: 文本}
+        self.sections = {}
+        # KeratometricIndices7mm 下的 FlatK 等（直接子元素）
+        self.k_section = None
+        # 文档中第一个 FlatK 等（没有 KeratometricIndices7mm 时使用）
+        self.k_texts = {}
+        # 数据段名 -> 解码后的数据矩阵，首次用到时解码
+        self.grids = dict(grids) if grids else {}
+        if state is None:
+            self._read()
+        else:
+            self.sections = state["sections"]
+            self.k_section = state["k_section"]
+            self.k_texts = state["k_texts"]
+
+    @classmethod
+    def load(cls, xml_file):
+        """按文件内容缓存读取结果，同一文件再次读取时直接取缓存"""
+        state, grids = topography_cache.load(xml_file, "mxf", cls.read_file)
+        return cls(xml_file, state=state, grids=grids)
+
+    @classmethod
+    def read_file(cls, xml_file):
+        """
+        读取文件并解码所有数据段，供缓存调用
+        :return: (读取结果, {数据段名: 数据矩阵})
+        """
+        reader = cls(xml_file)
+        return reader.state(), {name: reader.grid(name) for name in reader.sections}
+
+    def state(self):
+        """读取结果（可 JSON 序列化）"""
+        return {"sections": self.sections, "k_section": self.k_section, "k_texts": self.k_texts}
+
+    def grid(self, name):
+        """
+        数据段的数据矩阵，与 decode_grid(数据段) 相同
+        :param name: 数据段名
+        :return: numpy.ndarray 副本，调用方可以原地修改
+        """
+        if name not in self.grids:
+            self.grids[name] = decode_grid(self.sections[name])
+        return self.grids[name].copy()
+
+    def _read(self):
+        wanted = set(MAP_SECTIONS) | {K_SECTION} | set(K_TAGS)
+        # 标签 -> 第一次出现的元素（在 start 事件时认领，保证是文档顺序中的第一个）
+        claimed = {}
+        # 正在读取、尚未结束的数据段个数，期间不释放其子元素
+        open_sections = 0
+        # 当前元素的祖先
+        parents = []
+
+        with open(self.xml_file, "rb") as f:
+            for event, elem in Et.iterparse(f, events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    parents.append(elem)
+                    if tag in wanted and tag not in claimed:
+                        claimed[tag] = elem
+                        if tag in MAP_SECTIONS or tag == K_SECTION:
+                            open_sections += 1
+                    continue
+                parents.pop()
+
+                if claimed.get(tag) is elem:
+                    if tag in MAP_SECTIONS:
+                        self.sections[tag] = {child.tag: child.text for child in elem}
+                        open_sections -= 1
+                    elif tag == K_SECTION:
+                        self.k_section = {name: (child.text if child is not None else None)
+                                          for name, child in ((name, elem.find(name)) for name in K_TAGS)}
+                        open_sections -= 1
+                    else:
+                        self.k_texts[tag] = elem.text
+                if open_sections == 0:
+                    # 读完即释放：清空内容并从父元素中移除（结束的元素总是父元素的最后一个子元素）
+                    elem.clear()
+                    if parents:
+                        del parents[-1][-1]
+
+                # 四个数据段和 KeratometricIndices7mm 都已读到，其余内容用不到
+                if self.k_section is not None and len(self.sections) == len(MAP_SECTIONS):
+                    break
+
+    def parameters(self):
+        """与 OperationMXF.parse_parameters 相同"""
+        params = {}
+        if self.k_section is not None:
+            params.update(self.k_section)
+        else:
+            params['FlatK'] = float(self.k_texts['FlatK']) if 'FlatK' in self.k_texts else None
+            params['FlatAngle'] = math.degrees(float(self.k_texts['FlatAngle'])) if 'FlatAngle' in self.k_texts else None
+            params['SteepK'] = float(self.k_texts['SteepK']) if 'SteepK' in self.k_texts else None
+            params['SteepAngle'] = math.degrees(
+                float(self.k_texts['SteepAngle'])) if 'SteepAngle' in self.k_texts else None
+
+        if "CornealHeight" in self.sections:
+            params['cornealHeight'] = dict(self.sections["CornealHeight"])
+        return params
+
+    def section_data(self, name):
+        """与 OperationMXF.parse_*_map_data 相同：{'cornealHeight': {字段名: 文本}}，没有该数据段时为空字典"""
+        if name not in self.sections:
+            return {}
+        return {'cornealHeight': dict(self.sections[name])}
+
+    def arrays(self):
+        """
+        角膜曲率指标和四个数据段一起转为 numpy 数组
+        :return: {"keratometry": [FlatK, FlatAngle, SteepK, SteepAngle]（缺少的为 NaN）,
+                  数据段名: 数据矩阵, ...}，没有的数据段不包含在内
+        """
+        params = self.parameters()
+        result = {
+            "keratometry": np.array([np.nan if params[name] is None else float(params[name]) for name in K_TAGS],
+                                    dtype=np.float64),
+        }
+        for name in self.sections:
+            result[name] = self.grid(name)
+        return result
+
 
 class OperationMXF:
     def __init__(self, xml_file):
         self.xml_file = xml_file
-        self.tree = Et.parse(xml_file)
-        self.root = self.tree.getroot()
+        self.reader = MXFReader.load(xml_file)
+        self._tree = None
+
+    @property
+    def tree(self):
+        """完整的 ElementTree，只在需要读取其他内容时才解析"""
+        if self._tree is None:
+            self._tree = Et.parse(self.xml_file)
+        return self._tree
+
+    @property
+    def root(self):
+        return self.tree.getroot()
 
     def parse_parameters(self):
         """解析FlatK, FlatAngle, SteepK, SteepAngle和cornealHeight下的所有字段"""
-        params = {}
-
-        # 解析FlatK, FlatAngle, SteepK, SteepAngle
-        k_values = self.root.find(".//KeratometricIndices7mm")
-        if k_values is not None:
-            params['FlatK'] = k_values.find("FlatK").text if k_values.find("FlatK") is not None else None
-            params['FlatAngle'] = k_values.find("FlatAngle").text if k_values.find("FlatAngle") is not None else None
-            params['SteepK'] = k_values.find("SteepK").text if k_values.find("SteepK") is not None else None
-            params['SteepAngle'] = k_values.find("SteepAngle").text if k_values.find("SteepAngle") is not None else None
-        else:
-            params['FlatK'] = float(self.root.find(".//FlatK").text) if self.root.find(".//FlatK") is not None else None
-            params['FlatAngle'] = math.degrees(float(self.root.find(".//FlatAngle").text)) if self.root.find(
-                ".//FlatAngle") is not None else None
-            params['SteepK'] = float(self.root.find(".//SteepK").text) if self.root.find(
-                ".//SteepK") is not None else None
-            params['SteepAngle'] = math.degrees(float(self.root.find(".//SteepAngle").text)) if self.root.find(
-                ".//SteepAngle") is not None else None
-
-        # 解析cornealHeight下的所有字段
-        corneal_height = self.root.find(".//CornealHeight")
-        if corneal_height is not None:
-            params['cornealHeight'] = {
-                child.tag: child.text for child in corneal_height
-            }
-        return params
+        return self.reader.parameters()
 
     def parse_calculated_value(self, key_data=None):
         """
         解析cornealHeight下的所有字段
         返回: numpy.ndarray
         """
+        if key_data is None and "CornealHeight" in self.reader.sections:
+            return self.reader.grid("CornealHeight")
         data = self.parse_parameters() if key_data is None else key_data
-        data1 = data['cornealHeight']['Data'].replace(" ", ",").split("\n\t\t\t\t\t")
-        blank_list = []
-        for item in data1:
-            _list = []
-            data_list = item.split(',')
-            for a in data_list:
-                _list.append(a)
-            blank_list.append(_list)
-        result = pd.DataFrame(blank_list)
-        result = result.apply(pd.to_numeric, errors='coerce')
-
-        result = result.iloc[1:]  # 去除第一行
-        result = result.iloc[:-1]  # 去除最后一行
-        result = result.iloc[:, :-1]  # 去除最后一列
-        # result.to_excel("aaa.xlsx", index=False)
-        result = result.to_numpy()
-        return result
+        return decode_grid(data['cornealHeight'])
 
     def parse_topographic_map_data(self):
         """解析MXF文件，地形图数据"""
-        params = {}
-        corneal_height = self.root.find(".//CornealHeight")
-        if corneal_height is not None:
-            params['cornealHeight'] = {
-                child.tag: child.text for child in corneal_height
-            }
-        return params
+        return self.reader.section_data("CornealHeight")
 
     def parse_tangential_curvature_map_data(self):
         """解析MXF文件，切向曲率图"""
-        params = {}
-        corneal_height = self.root.find(".//TangentialCurvature")
-        if corneal_height is not None:
-            params['cornealHeight'] = {
-                child.tag: child.text for child in corneal_height
-            }
-        return params
+        return self.reader.section_data("TangentialCurvature")
 
     def parse_transverse_curvature_diagram_data(self):
         """轴向曲率图"""
-        params = {}
-        corneal_height = self.root.find(".//AxialCurvature")
-        if corneal_height is not None:
-            params['cornealHeight'] = {
-                child.tag: child.text for child in corneal_height
-            }
-        return params
+        return self.reader.section_data("AxialCurvature")
 
     def parse_tear_film_quality_map_data(self):
         """泪膜质量图"""
-        params = {}
-        corneal_height = self.root.find(".//TearFilmQualityData")
-        if corneal_height is not None:
-            params['cornealHeight'] = {
-                child.tag: child.text for child in corneal_height
-            }
-        return params
+        return self.reader.section_data("TearFilmQualityData")
 
 
 if __name__ == '__main__':
@@ -1,21 +1,16 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap, BoundaryNorm
-from scipy.interpolate import griddata
 from services.aop_mxf import OperationMXF
-from django.conf import settings
-import uuid
-import os
+from services.grid_upsample import upsample_map
+from services.map_raster import MapStyle, save_map
 from patient.models import CornealTopography
-from pathlib import Path
 
-# 绝对路径
-dirs = Path(settings.MEDIA_ROOT)
 
-
-def parse_zhouxiang_data(file_path):
-    """轴向曲率图"""
+def zhouxiang_map(file_path):
+    """
+    轴向曲率图的数据和样式
+    :return: (500x500 的轴向曲率（第 0 行在上）, MapStyle)
+    """
     xmf = OperationMXF(file_path)
     top_data = xmf.parse_transverse_curvature_diagram_data()
     data = xmf.parse_calculated_value(key_data=top_data)
@@ -24,24 +19,9 @@ def parse_zhouxiang_data(file_path):
     # 转换无效值为NaN
     Z[Z == 0] = np.nan
 
-    # 2. 创建原始坐标网格
-    x_range_orig = np.linspace(-6, 6, 50)
-    y_range_orig = np.linspace(-6, 6, 50)
-    X_orig, Y_orig = np.meshgrid(x_range_orig, y_range_orig)
-
-    # 3. 创建高分辨率网格用于插值
+    # 2. 插值到10倍分辨率（方式见 settings.TOPOGRAPHY_MAP_UPSAMPLER 和 services/grid_upsample.py）
     interp_factor = 10  # 插值因子，增加分辨率
-    x_range_highres = np.linspace(-6, 6, 50 * interp_factor)
-    y_range_highres = np.linspace(-6, 6, 50 * interp_factor)
-    X_highres, Y_highres = np.meshgrid(x_range_highres, y_range_highres)
-
-    # 4. 执行二维插值
-    valid_indices = np.where(~np.isnan(Z))
-    valid_points = np.column_stack((X_orig[valid_indices], Y_orig[valid_indices]))
-    valid_values = Z[valid_indices]
-
-    Z_highres = griddata(valid_points, valid_values,
-                         (X_highres, Y_highres), method='cubic', fill_value=np.nan)
+    Z_highres = upsample_map(Z, interp_factor)
 
     Z_highres = np.flipud(Z_highres)
 
@@ -65,39 +45,22 @@ def parse_zhouxiang_data(file_path):
                      [255, 142, 0], [255, 79, 0], [255, 15, 0], [191, 0, 0]
                  ][::-1]  # 反转顺序：红（陡峭）→蓝（平坦）
     normalized_colors = [[r / 255, g / 255, b / 255] for r, g, b in rgb_values]
-    custom_cmap = ListedColormap(normalized_colors, N=n_levels)
-    custom_cmap.set_bad(color=[0.4, 0.4, 0.4])  # NaN值显示为灰色
-
-    # 绘制热力图（其余设置不变）
-    plt.figure(figsize=(10, 10), dpi=100)
-    norm = BoundaryNorm(bounds, ncolors=n_levels)
-    im = plt.imshow(Z_highres, cmap=custom_cmap, norm=norm, extent=[-6, 6, -6, 6], aspect='equal')
 
     # 设置颜色条刻度标签（居中显示区间值）
     tick_positions = (bounds[:-1] + bounds[1:]) / 2  # 16个色块中心位置
     tick_labels = [f"{val:.2f}" for val in tick_positions]  # 标签为实际中心值
-    cbar = plt.colorbar(im, fraction=0.046, pad=0.04)
-    cbar.set_ticks(tick_positions)
-    cbar.set_ticklabels(tick_labels)
-    cbar.set_label('Elevation (μm)', fontsize=14)
-
-    # 13. 添加网格（使用浅灰色）
-    plt.grid(True, color='#999999', linestyle='--', alpha=0.3)
-
-    # 14. 设置背景为深灰色
-    plt.gca().set_facecolor('#222222')  # 深灰色背景
 
-    uuid_id = uuid.uuid4()
+    # 热力图的样式（NaN值显示为灰色），绘制见 services/map_raster.py
+    style = MapStyle(normalized_colors, [0.4, 0.4, 0.4], bounds, tick_positions, tick_labels, 'Elevation (μm)')
+    return Z_highres, style
 
-    # 确保目录存在并保存图片
-    fa_image_dir = dirs / "dxt_image_axial_curvature"
-    if not os.path.exists(fa_image_dir):
-        os.makedirs(fa_image_dir)
 
-    save_dir = dirs / "dxt_image_axial_curvature" / f"{uuid_id}.png"
-    save_dir_path = os.path.join("dxt_image_axial_curvature", f"{uuid_id}.png")
-    plt.savefig(save_dir)
-    plt.close()
+def parse_zhouxiang_data(file_path):
+    """轴向曲率图"""
+    Z_highres, style = zhouxiang_map(file_path)
+    x_range_highres = np.linspace(-6, 6, Z_highres.shape[1])
+    y_range_highres = np.linspace(-6, 6, Z_highres.shape[0])
+    save_dir_path = save_map(Z_highres, style, "dxt_image_axial_curvature")
 
     # 16. 显示结果
     # plt.tight_layout()
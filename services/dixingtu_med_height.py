@@ -1,23 +1,18 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap, BoundaryNorm
-from scipy.interpolate import griddata
-from django.conf import settings
-import uuid
-import os
 
 from services.aop_mxf import OperationMXF
+from services.grid_upsample import upsample_map
+from services.map_raster import MapStyle, save_map
 
 from patient.models import CornealTopography
-from pathlib import Path
 
-# 绝对路径
-dirs = Path(settings.MEDIA_ROOT)
 
-
-def parse_topographic_map_data(file_path):
-    """生成高度图"""
+def height_map(file_path):
+    """
+    高度图的数据和样式
+    :return: (500x500 的高度（μm，第 0 行在下）, MapStyle)
+    """
     xmf = OperationMXF(file_path)
     top_data = xmf.parse_topographic_map_data()
     data = xmf.parse_calculated_value(key_data=top_data)
@@ -26,24 +21,9 @@ def parse_topographic_map_data(file_path):
     # 转换无效值为NaN
     Z[Z == -500000000000000000000] = np.nan
 
-    # 2. 创建原始坐标网格
-    x_range_orig = np.linspace(-6, 6, 50)
-    y_range_orig = np.linspace(-6, 6, 50)
-    X_orig, Y_orig = np.meshgrid(x_range_orig, y_range_orig)
-
-    # 3. 创建高分辨率网格用于插值
+    # 2. 插值到10倍分辨率（方式见 settings.TOPOGRAPHY_MAP_UPSAMPLER 和 services/grid_upsample.py）
     interp_factor = 10  # 插值因子，增加分辨率
-    x_range_highres = np.linspace(-6, 6, 50 * interp_factor)
-    y_range_highres = np.linspace(-6, 6, 50 * interp_factor)
-    X_highres, Y_highres = np.meshgrid(x_range_highres, y_range_highres)
-
-    # 4. 执行二维插值
-    valid_indices = np.where(~np.isnan(Z))
-    valid_points = np.column_stack((X_orig[valid_indices], Y_orig[valid_indices]))
-    valid_values = Z[valid_indices]
-
-    Z_highres = griddata(valid_points, valid_values,
-                         (X_highres, Y_highres), method='cubic', fill_value=np.nan)
+    Z_highres = upsample_map(Z, interp_factor)
 
     # 5. 转换为微米
     Z_microns = Z_highres * 1000
@@ -79,38 +59,7 @@ def parse_topographic_map_data(file_path):
     step = 200
     bounds = np.arange(min_val, max_val, step)  # 17个边界点
 
-    # 8. 设置NaN值颜色为灰色
-    custom_cmap = ListedColormap(normalized_colors, N=n_levels)
-    custom_cmap.set_bad(color=[100 / 255, 100 / 255, 100 / 255])  # RGB(100,100,100)
-
-    # 9. 创建热力图
-    plt.figure(figsize=(10, 10), dpi=100)
-    norm = BoundaryNorm(bounds, ncolors=n_levels)
-
-    # 创建图像显示
-    im = plt.imshow(Z_microns,
-                    cmap=custom_cmap,
-                    norm=norm,  # 应用离散归一化
-                    origin='lower',
-                    extent=[-6, 6, -6, 6],
-                    aspect='equal')
-
-    # 10. 添加半透明黑色覆盖层降低亮度
-    # 创建一个覆盖整个图像区域的黑色半透明层
-    dark_layer = np.zeros((Z_microns.shape[0], Z_microns.shape[1], 4))  # 4通道：RGBA
-    dark_layer[:, :, 3] = 0.2  # 设置透明度为0.2（即20%的黑色）
-
-    # 显示这个半透明层
-    plt.imshow(dark_layer,
-               extent=[-6, 6, -6, 6],
-               origin='lower',
-               aspect='equal')
-
-    # 11. 添加颜色条
-    cbar = plt.colorbar(im, fraction=0.046, pad=0.04)
-    cbar.set_label('Elevation (μm)', fontsize=14)
-
-    # 12. 设置颜色条刻度和标签
+    # 8. 颜色条刻度和标签
     # 计算每个色块中心位置
     tick_positions = (bounds[:-1] + bounds[1:]) / 2  # 16个中心位置
 
@@ -123,32 +72,17 @@ def parse_topographic_map_data(file_path):
     tick_positions_sorted = np.sort(tick_positions)  # 从小到大排序：-3100到-100
     tick_positions_sorted = np.flip(tick_positions_sorted)  # 从大到小排序：-100到-3100
 
-    # 应用刻度设置
-    cbar.set_ticks(tick_positions_sorted)
-    cbar.set_ticklabels(tick_labels)
-    cbar.ax.tick_params(labelsize=10)  # 减小字体防止重叠
+    # 9. 热力图的样式：NaN值为灰色 RGB(100,100,100)，叠加20%的黑色降低亮度，
+    # 颜色条刻度减小字体防止重叠，绘制见 services/map_raster.py
+    style = MapStyle(normalized_colors, [100 / 255, 100 / 255, 100 / 255], bounds, tick_positions_sorted,
+                     tick_labels, 'Elevation (μm)', origin='lower', dark=True, tick_size=10)
+    return Z_microns, style
 
-    # 13. 添加网格（使用浅灰色）
-    plt.grid(True, color='#999999', linestyle='--', alpha=0.3)
 
-    # 14. 设置背景为深灰色
-    plt.gca().set_facecolor('#222222')  # 深灰色背景
-
-    uuid_id = uuid.uuid4()
-
-    # 确保目录存在并保存图片
-    fa_image_dir = dirs / "dxt_image_height"
-    if not os.path.exists(fa_image_dir):
-        os.makedirs(fa_image_dir)
-
-    save_dir = dirs / "dxt_image_height" / f"{uuid_id}.png"
-    save_dir_path = os.path.join("dxt_image_height", f"{uuid_id}.png")
-    # update = CornealTopography.objects.filter(id=corneal_id).update(
-    #     img_corneal_height=str(save_dir_path)
-    # )
-
-    plt.savefig(save_dir)
-    plt.close()
+def parse_topographic_map_data(file_path):
+    """生成高度图"""
+    Z_microns, style = height_map(file_path)
+    save_dir_path = save_map(Z_microns, style, "dxt_image_height")
 
     # 16. 显示结果
     # plt.tight_layout()
@@ -0,0 +1,150 @@
+"""
+定制计算会话：一次定制请求只加载一次角膜地形图文件
+
+平K拟合、陡K拟合和泪膜图的角膜高度原先各自新建 KBQ，同一文件在一次请求里要读取、解析四次以上。
+FittingSession 按算法类型只创建一次 Extractor，之后的 KBQ 都共用它；
+相同半径范围、相同角度的 KBQ 也只创建一次，角膜高度只采样一次。
+试算不同总直径时用环带前缀和索引（AnnulusIndex），一次采样即可得出每个直径的最佳设计。
+"""
+from services import medment, medment_4, seour, seour_4, tomey, tomey_4
+
+
+class FittingSession:
+    """一次定制请求内共用的地形图数据"""
+
+    # 算法类型（与 TearFilmHeightCalculator 的 al_type 一致）-> KBQ 所在模块
+    MODULES = {
+        0: medment,
+        1: medment_4,
+        2: seour,
+        3: seour_4,
+        4: tomey,
+        5: tomey_4,
+    }
+    # 支持直径试算的算法类型（普通定制）
+    SWEEP_TYPES = (0, 2, 4)
+
+    def __init__(self, al_type, filter_data=None, rm_dat_path=None, ch_dat_path=None, extractor=None):
+        """
+        :param al_type: 算法类型 0~5（Medmont、Seour、Tomey 的普通定制和四轴定制）
+        :param filter_data: Medmont、Seour 的角膜文件地址
+        :param rm_dat_path: Tomey 的 RM 文件地址
+        :param ch_dat_path: Tomey 的 CH 文件地址
+        :param extractor: 调用方已创建的对应模块的 Extractor，传入时不再重复解析文件
+        """
+        self.al_type = int(al_type)
+        if self.al_type not in self.MODULES:
+            raise ValueError(f"不支持的算法类型: {al_type}")
+        self.module = self.MODULES[self.al_type]
+        self.filter_data = filter_data
+        self.rm_dat_path = rm_dat_path
+        self.ch_dat_path = ch_dat_path
+
+        # 只在这里读取、解析一次文件，文件有误时在创建会话时报错
+        if extractor is not None:
+            self.extractor = extractor
+        elif self.al_type in (0, 1):
+            self.extractor = self.module.MedmentExtractor(xml_file=filter_data)
+        elif self.al_type in (2, 3):
+            self.extractor = self.module.SeourExtractor(xml_file=filter_data)
+        else:
+            self.extractor = self.module.TomeyExtractor(rm_dat_path=rm_dat_path, ch_dat_path=ch_dat_path)
+
+        # (半径范围, 角度) -> KBQ
+        self._kbq = {}
+        # (半径范围, 角度, 特殊情况) -> AnnulusIndex
+        self._annulus = {}
+
+    def kbq(self, radius, degree_list):
+        """
+        共用已加载文件的 KBQ，相同的半径范围和角度返回同一个实例
+        :param radius: 半径范围 [起点, 终点]
+        :param degree_list: 角度列表
+        """
+        key = (tuple(radius), tuple(degree_list))
+        kbq = self._kbq.get(key)
+        if kbq is None:
+            if self.al_type in (4, 5):
+                kbq = self.module.KBQ(radius, degree_list, rm_dat_path=self.rm_dat_path, ch_dat_path=self.ch_dat_path,
+                                      extractor=self.extractor)
+            else:
+                kbq = self.module.KBQ(radius, degree_list, filter_data=self.filter_data, extractor=self.extractor)
+            self._kbq[key] = kbq
+        return kbq
+
+    def fit(self, radius, degree_list, **kwargs):
+        """
+        计算平K、Q、B，参数与 KBQ.main 相同
+        :param radius: 半径范围 [起点, 终点]
+        :param degree_list: 角度列表
+        :return: KBQ.main 的结果
+        """
+        return self.kbq(radius, degree_list).main(**kwargs)
+
+    def cornea_profile(self, radius, degree_list):
+        """
+        泪膜图用的角膜高度，结果与 TearFilmHeightCalculator.wavelet_denoise 相同
+        :param radius: 半径范围 [起点, 终点]
+        :param degree_list: 角度列表
+        """
+        return {
+            "data_list": self.kbq(radius, degree_list).radius_angle(),
+            "degree_list": degree_list,
+        }
+
+    def annulus_index(self, radius, degree_list, special_type=False):
+        """
+        半径范围 radius 内任意连续半径段的快速拟合索引（只支持普通定制）
+        :param radius: 半径范围 [起点, 终点]，应覆盖所有要试算的半径段
+        :param degree_list: 角度列表
+        :param special_type: 特殊情况，平k时Q固定为-0.25
+        :return: AnnulusIndex
+        """
+        if self.al_type not in self.SWEEP_TYPES:
+            raise ValueError("直径试算只支持普通定制")
+        key = (tuple(radius), tuple(degree_list), special_type)
+        index = self._annulus.get(key)
+        if index is None:
+            index = self._annulus[key] = self.kbq(radius, degree_list).annulus_index(special_type)
+        return index
+
+    def diameter_sweep(self, overall_diameters, optical_zone_diameter, flat_degree_list, steep_degree_list,
+                       special_type=False):
+        """
+        试算一组总直径下的最佳设计（与定制时一样：先拟合平k，再固定Q、B拟合陡k）
+        AC弧范围与定制时相同：起点 = 光学区直径/2 + 0.8，终点 = 总直径/2 - 0.5
+        :param overall_diameters: 总直径列表
+        :param optical_zone_diameter: 光学区直径
+        :param flat_degree_list: 平k方向角度 [平角度, 平角度 + 180]
+        :param steep_degree_list: 陡k方向角度 [斜角度, 斜角度 + 180]
+        :param special_type: 特殊情况，平k时Q固定为-0.25
+        :return: 每个总直径一行；该直径下拟合失败时 flat/steep 为 None
+        """
+        ac_arc_start = optical_zone_diameter / 2 + 0.8
+        ac_arc_ends = [overall_diameter / 2 - 0.5 for overall_diameter in overall_diameters]
+        if not ac_arc_ends or min(ac_arc_ends) <= ac_arc_start:
+            raise ValueError("总直径过小，AC弧范围为空")
+        max_end = max(ac_arc_ends)
+
+        # 整个试算范围只采样、累加一次，每个直径只取对应的半径段
+        flat_index = self.annulus_index([ac_arc_start, max_end], flat_degree_list, special_type)
+        steep_index = self.annulus_index([round(ac_arc_start, 2), max_end], steep_degree_list)
+
+        rows = []
+        for overall_diameter, ac_arc_end in zip(overall_diameters, ac_arc_ends):
+            flat_radius = self.kbq([ac_arc_start, ac_arc_end], flat_degree_list).rounded_radius_list
+            flat = flat_index.best_fit(flat_radius)
+            steep = None
+            if flat is not None:
+                # 陡k固定平k的Q、B，只遍历k值
+                steep_kbq = self.kbq([round(ac_arc_start, 2), ac_arc_end], steep_degree_list)
+                pinned = steep_kbq.kbq_grid(1, flat['best_data']['Q'], flat['best_data']['B'])
+                steep = steep_index.best_fit(steep_kbq.rounded_radius_list, steep_index.matching(pinned))
+            rows.append({
+                "overall_diameter": overall_diameter,
+                "ac_arc_start": ac_arc_start,
+                "ac_arc_end": ac_arc_end,
+                "flat": flat,
+                "steep": steep,
+            })
+        return rows
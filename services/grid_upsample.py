@@ -0,0 +1,127 @@
+"""
+地形图的规则网格插值（50x50 -> 500x500）
+
+四张地形图原先都用 griddata(method='cubic') 插值：对有效点做 Delaunay 三角剖分后按 Clough-Tocher 插值，
+而数据本身是 linspace(-6, 6, 50) 上的规则网格。upsample_grid 直接在规则网格上做双三次卷积插值
+（Keys 三次卷积核，a = -0.5，经过各格点），行、列两个方向各是一个权重矩阵，整张图只需两次矩阵乘法。
+NaN 的处理：4x4 邻域内有无效格点的点（测量区边缘）改用忽略 NaN 的双线性插值，
+不会把无效格点的填充值带进结果；按双线性权重计算周围有效格点的权重合计，不足 min_weight 的为 NaN，
+无效区域不会被插值填上。upsample_grid 默认与 services/polar_height.py 的规则相同（MIN_VALID_WEIGHT），
+地形图（upsample_map）只保留四个角都有效的网格内的点（MAP_MIN_VALID_WEIGHT），
+测量区边缘不按部分格点外推，与 griddata 的差别见 services/map_benchmark.py。
+
+与 griddata 的结果并不逐点一致：平滑区域内相差很小，测量区边缘和数据有台阶的地方
+（如泪膜质量图中测量区外的 0）差别较大，griddata 在台阶附近有波动而双三次卷积离台阶两个格点后即恢复原值。
+对比和耗时见 services/map_benchmark.py；默认仍用 griddata，settings.TOPOGRAPHY_MAP_UPSAMPLER = "bicubic" 时启用。
+"""
+import numpy as np
+from django.conf import settings
+from scipy.interpolate import griddata
+
+from services.polar_height import MIN_VALID_WEIGHT
+
+# 三次卷积核的参数
+CUBIC_A = -0.5
+# 地形图范围（mm）
+MAP_RANGE = (-6, 6)
+# 地形图有效格点权重合计的下限：网格四个角都有效时才插值
+MAP_MIN_VALID_WEIGHT = 1.0
+
+
+def cubic_kernel(s, a=CUBIC_A):
+    """Keys 三次卷积核"""
+    s = np.abs(s)
+    return np.where(s <= 1, (a + 2) * s ** 3 - (a + 3) * s ** 2 + 1,
+                    np.where(s < 2, a * s ** 3 - 5 * a * s ** 2 + 8 * a * s - 4 * a, 0.0))
+
+
+def grid_position(coords, grid):
+    """
+    查询坐标所在的网格区间和区间内的位置
+    :param coords: 查询坐标，超出网格的按边界取值
+    :param grid: 等间距的网格坐标
+    :return: (区间左端下标, 区间内的位置 0~1)
+    """
+    position = np.clip((np.asarray(coords, dtype=np.float64) - grid[0]) / (grid[1] - grid[0]), 0, len(grid) - 1)
+    index = np.minimum(np.floor(position).astype(int), len(grid) - 2)
+    return index, position - index
+
+
+def cubic_weights(coords, grid):
+    """
+    一个方向上的三次卷积权重矩阵，插值结果 = 权重矩阵 @ 网格值；网格外的邻点按边界格点取值
+    :return: (len(coords), len(grid))
+    """
+    index, t = grid_position(coords, grid)
+    weights = np.zeros((len(index), len(grid)))
+    rows = np.arange(len(index))
+    for offset in (-1, 0, 1, 2):
+        np.add.at(weights, (rows, np.clip(index + offset, 0, len(grid) - 1)), cubic_kernel(t - offset))
+    return weights
+
+
+def linear_weights(coords, grid):
+    """一个方向上的线性插值权重矩阵（用于计算有效格点的权重合计）"""
+    index, t = grid_position(coords, grid)
+    weights = np.zeros((len(index), len(grid)))
+    rows = np.arange(len(index))
+    weights[rows, index] += 1 - t
+    weights[rows, index + 1] += t
+    return weights
+
+
+def upsample_grid(Z, x_range, y_range, x_new, y_new, min_weight=MIN_VALID_WEIGHT):
+    """
+    规则网格的双三次插值（忽略 NaN 格点）
+    :param Z: 网格值，Z[i, j] 对应 (x_range[j], y_range[i])，NaN 为无效
+    :param x_range: 等间距的 x 坐标
+    :param y_range: 等间距的 y 坐标
+    :param x_new: 插值的 x 坐标
+    :param y_new: 插值的 y 坐标
+    :param min_weight: 有效格点权重合计的下限，不足时结果为 NaN
+    :return: (len(y_new), len(x_new))，[i, j] 对应 (x_new[j], y_new[i])
+    """
+    Z = np.asarray(Z, dtype=np.float64)
+    invalid = np.isnan(Z)
+    cubic_y, cubic_x = cubic_weights(y_new, y_range), cubic_weights(x_new, x_range)
+    if not invalid.any():
+        return cubic_y @ Z @ cubic_x.T
+
+    valid = (~invalid).astype(np.float64)
+    filled = np.where(invalid, 0.0, Z)
+    result = cubic_y @ filled @ cubic_x.T
+    # 4x4 邻域内有无效格点的点改用忽略 NaN 的双线性插值（有效格点的权重重新归一）
+    stencil_invalid = (cubic_y != 0) @ invalid @ (cubic_x != 0).T
+    linear_y, linear_x = linear_weights(y_new, y_range), linear_weights(x_new, x_range)
+    valid_weight = linear_y @ valid @ linear_x.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        linear = (linear_y @ filled @ linear_x.T) / valid_weight
+    result = np.where(stencil_invalid, linear, result)
+    result[valid_weight < min_weight - 1e-9] = np.nan
+    return result
+
+
+def griddata_upsample(Z, x_range, y_range, x_new, y_new):
+    """原先的插值：有效点的散点三次插值（griddata cubic），凸包外为 NaN"""
+    X_orig, Y_orig = np.meshgrid(x_range, y_range)
+    X_new, Y_new = np.meshgrid(x_new, y_new)
+    valid_indices = np.where(~np.isnan(Z))
+    valid_points = np.column_stack((X_orig[valid_indices], Y_orig[valid_indices]))
+    return griddata(valid_points, Z[valid_indices], (X_new, Y_new), method='cubic', fill_value=np.nan)
+
+
+def upsample_map(Z, interp_factor=10):
+    """
+    地形图插值到 interp_factor 倍分辨率，方式见 settings.TOPOGRAPHY_MAP_UPSAMPLER
+    :param Z: linspace(-6, 6, n) 上的 n x n 网格，NaN 为无效
+    :param interp_factor: 插值因子
+    :return: (n * interp_factor) x (n * interp_factor)，范围同为 -6~6
+    """
+    x_range_orig = np.linspace(*MAP_RANGE, Z.shape[1])
+    y_range_orig = np.linspace(*MAP_RANGE, Z.shape[0])
+    x_range_highres = np.linspace(*MAP_RANGE, Z.shape[1] * interp_factor)
+    y_range_highres = np.linspace(*MAP_RANGE, Z.shape[0] * interp_factor)
+    if settings.TOPOGRAPHY_MAP_UPSAMPLER == "bicubic":
+        return upsample_grid(Z, x_range_orig, y_range_orig, x_range_highres, y_range_highres,
+                             min_weight=MAP_MIN_VALID_WEIGHT)
+    return griddata_upsample(Z, x_range_orig, y_range_orig, x_range_highres, y_range_highres)
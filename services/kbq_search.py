@@ -0,0 +1,255 @@
+"""
+K、Q、B 网格搜索（Medmont、Seour、Tomey 的普通定制与四轴定制共用）
+
+所有候选组合 (B, K, Q) 与所有半径一次算成 (半径数 x 候选数) 的矩阵，
+按候选求忽略 NaN 的平均平方差后取最小值。
+平均值按半径顺序逐个累加后再除以有效个数，与原先逐个组合、逐个半径循环求和的结果逐位一致。
+search_best_fit 默认先粗算每个 (K, Q) 下 B 的最优位置，只精算其两侧的 B 值，
+打开 B 值搜索（21 个 B 值）时计算量与不搜索 B 时基本相同，结果与遍历全部组合一致。
+传入 top_n 时同时返回平均平方差最小的前 top_n 个组合（备选设计），不需要额外拟合。
+AnnulusIndex 按半径累加平方差，任意连续半径段（环带）的最佳组合只需一次相减，用于试算不同直径。
+"""
+import numpy as np
+
+# 开启B值搜索时平k遍历的B值
+B_SEARCH_VALUES = np.arange(-50, 55, 5)
+
+
+def build_grid(B_values, K_values, Q_values):
+    """
+    生成候选组合
+    :param B_values: B 值列表（或单个值）
+    :param K_values: K 值列表
+    :param Q_values: Q 值列表（或单个值）
+    :return: 二维数组，每行一个组合 [B, K, Q]，顺序与 np.meshgrid(B, K, Q, indexing='ij') 展开一致
+    """
+    B, K, Q = np.meshgrid(B_values, K_values, Q_values, indexing='ij')
+    return np.column_stack((B.ravel(), K.ravel(), Q.ravel()))
+
+
+def squared_diff_matrix(formula, radius_values, target_values, combined_array):
+    """
+    计算每个半径、每个候选组合的镜片高度与角膜高度的平方差
+    :param formula: 镜片高度公式 formula(k, x, q, b)，即 KBQ.formula_numpy
+    :param radius_values: 半径列表
+    :param target_values: 各半径对应的角膜高度（已取平均）
+    :param combined_array: build_grid 生成的候选组合
+    :return: (半径数, 候选数) 的平方差矩阵，无法计算的为 NaN
+    """
+    radius = np.asarray(radius_values, dtype=np.float64).reshape(-1, 1)
+    target = np.asarray(target_values, dtype=np.float64).reshape(-1, 1)
+    with np.errstate(invalid='ignore'):
+        results = formula(combined_array[:, 1], radius, combined_array[:, 2], combined_array[:, 0])
+        return (results - target) ** 2
+
+
+def mean_squared_diff(squared_diff):
+    """
+    每个候选组合在所有半径上的平均平方差（忽略 NaN）
+    :param squared_diff: (半径数, 候选数) 的平方差矩阵
+    :return: (means, counts)；counts 为每个候选的有效半径数，为 0 时 mean 为 NaN
+    """
+    valid = ~np.isnan(squared_diff)
+    total = np.zeros(squared_diff.shape[1])
+    # 按半径顺序逐行累加，保证与逐个相加的求和顺序相同
+    for row, row_valid in zip(squared_diff, valid):
+        total = np.where(row_valid, total + row, total)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = total / counts
+    return means, counts
+
+
+def best_fit(squared_diff, combined_array, top_n=None):
+    """
+    取平均平方差最小的组合
+    :param squared_diff: (半径数, 候选数) 的平方差矩阵
+    :param combined_array: 候选组合
+    :param top_n: 同时返回的备选组合个数，不传则不返回
+    :return: {"minimum_variance", "best_data": {"K", "Q", "B"}}，传入 top_n 时另有 "candidates"；
+             所有组合都没有有效数据时返回 None
+    """
+    means, counts = mean_squared_diff(squared_diff)
+    return pick_best(means, counts, combined_array, top_n=top_n)
+
+
+def pick_best(means, counts, combined_array, mask=None, top_n=None):
+    """
+    在有有效数据的组合中取平均平方差最小的（相同时取排在前面的）
+    :param means: 每个组合的平均平方差
+    :param counts: 每个组合的有效半径数
+    :param combined_array: 候选组合
+    :param mask: 只在 mask 为 True 的组合中选取，不传则全部参与
+    :param top_n: 同时返回的备选组合个数，不传则不返回
+    :return: 与 best_fit 相同
+    """
+    selectable = counts > 0
+    if mask is not None:
+        selectable &= mask
+    candidates = np.flatnonzero(selectable)
+    if len(candidates) == 0:
+        return None
+    min_index = candidates[np.argmin(means[candidates])]
+    result = {
+        "minimum_variance": means[min_index],
+        "best_data": {
+            "K": combined_array[min_index][1],
+            "Q": combined_array[min_index][2],
+            "B": combined_array[min_index][0]
+        }
+    }
+    if top_n is not None:
+        result["candidates"] = rank_candidates(means, candidates, combined_array, top_n)
+    return result
+
+
+def rank_candidates(means, candidates, combined_array, top_n):
+    """
+    按平均平方差从小到大排列的前 top_n 个组合，第一个即最佳组合
+    :param means: 每个组合的平均平方差
+    :param candidates: 参与排序的组合下标（升序）
+    :param combined_array: 候选组合
+    :param top_n: 返回个数
+    :return: [{"rank", "K", "Q", "B", "variance"}, ...]，均为 Python 数值，可直接保存为 JSON
+    """
+    # 稳定排序：平均平方差相同时取排在前面的，与 argmin 一致
+    order = candidates[np.argsort(means[candidates], kind='stable')][:max(int(top_n), 0)]
+    return [
+        {
+            "rank": rank,
+            "K": float(combined_array[index][1]),
+            "Q": float(combined_array[index][2]),
+            "B": float(combined_array[index][0]),
+            "variance": float(means[index]),
+        }
+        for rank, index in enumerate(order, start=1)
+    ]
+
+
+def search_best_fit(formula, radius_values, target_values, B_values, K_values, Q_values, mode="coarse_to_fine",
+                    top_n=None):
+    """
+    在 (B, K, Q) 网格上搜索平均平方差最小的组合
+    :param formula: 镜片高度公式 formula(k, x, q, b)，即 KBQ.formula_numpy
+    :param radius_values: 半径列表
+    :param target_values: 各半径对应的角膜高度（已取平均）
+    :param B_values: B 值列表（或单个值）
+    :param K_values: K 值列表
+    :param Q_values: Q 值列表（或单个值）
+    :param mode: exhaustive，遍历全部组合；coarse_to_fine，先按 (K, Q) 粗算出 B 的最优位置，只精算其两侧的 B 值
+    :param top_n: 同时返回的备选组合个数，不传则不返回
+    :return: 与 best_fit 相同；结果与 exhaustive 一致
+    """
+    combined_array = build_grid(B_values, K_values, Q_values)
+    B_values = np.atleast_1d(np.asarray(B_values, dtype=np.float64))
+    # 每个 (K, Q) 下需要精算的 B 值个数：最佳组合只需顶点两侧各一个，前 top_n 个需要离顶点最近的 top_n + 1 个
+    nearest = 2 if top_n is None else max(2, int(top_n) + 1)
+    if mode == "exhaustive" or len(B_values) <= nearest:
+        squared_diff = squared_diff_matrix(formula, radius_values, target_values, combined_array)
+        return best_fit(squared_diff, combined_array, top_n)
+
+    candidates = fine_candidates(formula, radius_values, target_values, B_values, K_values, Q_values, nearest)
+    if len(candidates) == 0:
+        return None
+    squared_diff = squared_diff_matrix(formula, radius_values, target_values, combined_array[candidates])
+    return best_fit(squared_diff, combined_array[candidates], top_n)
+
+
+def fine_candidates(formula, radius_values, target_values, B_values, K_values, Q_values, nearest=2):
+    """
+    粗算：B 只是给镜片高度加上常数 B/1000，不影响哪些半径有效，
+    固定 (K, Q) 时平均平方差是 B 的开口向上的抛物线，顶点在 B = -1000 * mean(镜片高度(B=0) - 角膜高度)，
+    网格上的最小值一定是顶点两侧最近的两个 B 值之一，其余 B 值不必计算；
+    同一 (K, Q) 下第 n 小的值一定在离顶点最近的 n + 1 个 B 值之中。
+    :param nearest: 每个 (K, Q) 下精算的 B 值个数，不少于 2（顶点两侧各一个）
+    :return: 需要精算的组合在 build_grid(B_values, K_values, Q_values) 中的下标（升序，保持原来的先后顺序）
+    """
+    base_array = build_grid([0], K_values, Q_values)
+    radius = np.asarray(radius_values, dtype=np.float64).reshape(-1, 1)
+    target = np.asarray(target_values, dtype=np.float64).reshape(-1, 1)
+    with np.errstate(invalid='ignore'):
+        residual = formula(base_array[:, 1], radius, base_array[:, 2], base_array[:, 0]) - target
+    valid = ~np.isnan(residual)
+    counts = valid.sum(axis=0)
+    columns = np.flatnonzero(counts > 0)
+    if len(columns) == 0:
+        return columns
+    vertex = -1000 * np.where(valid, residual, 0).sum(axis=0)[columns] / counts[columns]
+
+    # 重复的 B 值取第一次出现的位置，与遍历时取第一个最小值一致
+    sorted_b, first_index = np.unique(B_values, return_index=True)
+    upper = np.clip(np.searchsorted(sorted_b, vertex), 0, len(sorted_b) - 1)
+    lower = np.clip(upper - 1, 0, len(sorted_b) - 1)
+    selected = [first_index[lower] * len(base_array) + columns, first_index[upper] * len(base_array) + columns]
+    if nearest > 2:
+        distance = np.abs(sorted_b[np.newaxis, :] - vertex[:, np.newaxis])
+        closest = np.argsort(distance, axis=1, kind='stable')[:, :nearest]
+        selected.append((first_index[closest] * len(base_array) + columns[:, np.newaxis]).ravel())
+    return np.unique(np.concatenate(selected))
+
+
+class AnnulusIndex:
+    """
+    环带前缀和索引：对一组连续半径，预先按半径顺序累加每个候选组合的平方差和有效个数，
+    任意连续半径段 [r_i, r_j] 的平均平方差 = (累加和[j] - 累加和[i-1]) / (个数[j] - 个数[i-1])。
+    试算不同总直径时 AC 弧的半径段随之变化，不必重新拟合。
+    累加和相减与逐个相加的舍入不同，minimum_variance 与直接拟合在最后几位可能不同，
+    最佳组合只在平均平方差几乎相等时才可能不同；正式定制仍以直接拟合为准。
+    """
+
+    def __init__(self, formula, radius_values, target_values, combined_array):
+        """
+        :param formula: 镜片高度公式 formula(k, x, q, b)，即 KBQ.formula_numpy
+        :param radius_values: 连续的半径列表（KBQ.rounded_radius_list）
+        :param target_values: 各半径对应的角膜高度（已取平均）
+        :param combined_array: 候选组合
+        """
+        self.combined_array = combined_array
+        self.radius_values = [float(radius) for radius in radius_values]
+        self.positions = {radius: index for index, radius in enumerate(self.radius_values)}
+
+        squared_diff = squared_diff_matrix(formula, radius_values, target_values, combined_array)
+        valid = ~np.isnan(squared_diff)
+        # 第 0 行为 0，第 i 行为前 i 个半径的累加
+        self.cum_sum = np.zeros((len(self.radius_values) + 1, len(combined_array)))
+        self.cum_count = np.zeros((len(self.radius_values) + 1, len(combined_array)), dtype=np.int64)
+        np.cumsum(np.where(valid, squared_diff, 0.0), axis=0, out=self.cum_sum[1:])
+        np.cumsum(valid, axis=0, out=self.cum_count[1:])
+
+    def span(self, radius_values):
+        """
+        半径段在索引中的位置
+        :param radius_values: 连续的半径列表，必须是建索引时半径列表中连续的一段
+        :return: (起始位置, 结束位置+1)
+        """
+        if len(radius_values) == 0:
+            raise ValueError("半径段为空")
+        try:
+            start = self.positions[float(radius_values[0])]
+            end = self.positions[float(radius_values[-1])] + 1
+        except KeyError as e:
+            raise ValueError(f"半径 {e.args[0]} 不在索引范围内")
+        if self.radius_values[start:end] != [float(radius) for radius in radius_values]:
+            raise ValueError("半径段必须是索引半径中连续的一段")
+        return start, end
+
+    def matching(self, combined_array):
+        """
+        索引中的组合是否出现在 combined_array 中（陡k固定Q、B时只在这些组合中选取）
+        :return: 与索引组合等长的布尔数组
+        """
+        wanted = {tuple(row) for row in np.asarray(combined_array, dtype=np.float64)}
+        return np.array([tuple(row) in wanted for row in self.combined_array], dtype=bool)
+
+    def best_fit(self, radius_values, mask=None):
+        """
+        半径段上平均平方差最小的组合
+        :param radius_values: 连续的半径列表
+        :param mask: 只在 mask 为 True 的组合中选取
+        :return: 与 best_fit 相同
+        """
+        start, end = self.span(radius_values)
+        counts = self.cum_count[end] - self.cum_count[start]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (self.cum_sum[end] - self.cum_sum[start]) / counts
+        return pick_best(means, counts, self.combined_array, mask)
@@ -0,0 +1,277 @@
+"""
+Medmont 地形图绘制性能基准
+
+对每个 .mxf 文件的四张地形图分别用以下方式生成 PNG，统计每张图绘制加编码的中位数耗时（不含解析和插值）：
+- matplotlib: 按原先的画法绘制；
+- raster-cold: 直接栅格化，缓存为空（含画出布局和图像区域，每个进程每种布局只有一次）；
+- raster-relabel: 布局已缓存，只重画颜色条刻度（切向、轴向曲率图的刻度随数据变化，新文件走这里）；
+- raster: 框架已缓存。
+同时解码对比 matplotlib 与 raster 的像素。
+另外对比数据插值（50x50 -> 500x500，含解析缓存命中后的取数）原先的 griddata 与规则网格双三次插值（bicubic）：
+耗时、两者都有效的点上的差值（相对数据范围）、有效区域不一致和色阶不同的点的比例。
+像素差（最大、平均、大差别像素比例）超出容差，或启用 bicubic 时插值差别（中位数、P99、最大、色阶）超出容差时以非零状态退出；
+未启用 bicubic 时插值差别只报告。
+
+用法（在项目根目录）:
+    python -m services.map_benchmark                     # 默认使用 data/medment 下的 .mxf 文件
+    python -m services.map_benchmark a.mxf -n 10         # 指定文件和重复次数
+    python -m services.map_benchmark --json result.json  # 同时保存结果，便于比较不同版本
+"""
+import argparse
+import importlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 项目自带的样例文件
+DEFAULT_FILES = sorted((Path(__file__).resolve().parents[1] / "data" / "medment").glob("*.mxf"))
+
+# 地形图名称 -> 数据和样式 (模块, 函数名)
+MAP_BUILDERS = {
+    "height": ("services.dixingtu_med_height", "height_map"),
+    "tangential": ("services.dixingt_med_qiexiang", "qiexiang_map"),
+    "axial": ("services.dixingt_med_zhouxiang", "zhouxiang_map"),
+    "tear_film_quality": ("services.dixingt_med_leimozhiliang", "leimozhiliang_map"),
+}
+
+MODES = ("matplotlib", "raster-cold", "raster-relabel", "raster")
+UPSAMPLERS = ("griddata", "bicubic")
+
+# 像素对比的容差: 最大差、平均差（灰度级）和差别大于 OUTLIER_LEVEL 的像素比例
+MAX_PIXEL_DIFF = 4
+MAX_MEAN_DIFF = 0.5
+OUTLIER_LEVEL = 16
+MAX_OUTLIER_RATIO = 0.001
+# 插值的容差: 两者都有效的点上差值（相对数据范围）的中位数、P99 和最大值（16 级色阶一级约 6%），
+# 以及色阶不同的点的比例；settings.TOPOGRAPHY_MAP_UPSAMPLER 为 bicubic 时才作为校验，否则只报告
+MAX_UPSAMPLE_MEDIAN_DIFF = 0.005
+MAX_UPSAMPLE_P99_DIFF = 0.01
+MAX_UPSAMPLE_MAX_DIFF = 0.06
+MAX_UPSAMPLE_LEVEL_RATIO = 0.03
+
+
+def pixel_diff(expected_png, actual_png):
+    """
+    两张 PNG 的像素差
+    :return: {max: 最大差, mean: 平均差, outliers: 差别大于 OUTLIER_LEVEL 的像素比例}
+    """
+    from PIL import Image
+    expected = np.asarray(Image.open(io.BytesIO(expected_png)).convert('RGBA'), dtype=np.int16)
+    actual = np.asarray(Image.open(io.BytesIO(actual_png)).convert('RGBA'), dtype=np.int16)
+    if expected.shape != actual.shape:
+        return {'max': 255, 'mean': 255.0, 'outliers': 1.0}
+    diff = np.abs(expected - actual)
+    return {
+        'max': int(diff.max()),
+        'mean': float(diff.mean()),
+        'outliers': float((diff.max(axis=2) > OUTLIER_LEVEL).mean()),
+    }
+
+
+def upsample_diff(expected, actual, style):
+    """
+    两种插值结果的差别
+    :return: {median/p99/max: 两者都有效的点上差值的绝对值（相对数据范围），mask: 有效区域不一致的点的比例，
+              levels: 色阶不同的点的比例（含有效区域不一致的点）}
+    """
+    valid = ~np.isnan(expected) & ~np.isnan(actual)
+    if not valid.any():
+        return {'median': 0.0, 'p99': 0.0, 'max': 0.0, 'mask': 1.0, 'levels': 1.0}
+    scale = np.ptp(expected[valid]) or 1.0
+    diff = np.abs(expected[valid] - actual[valid]) / scale
+    return {
+        'median': float(np.median(diff)),
+        'p99': float(np.percentile(diff, 99)),
+        'max': float(diff.max()),
+        'mask': float((np.isnan(expected) != np.isnan(actual)).mean()),
+        'levels': float((style.color_indices(expected) != style.color_indices(actual)).mean()),
+    }
+
+
+class MapBenchmark:
+    """地形图绘制性能基准: 每个文件的每张图按各方式重复生成 repeat 次，记录耗时（秒）"""
+
+    def __init__(self, files, repeat=5):
+        self.files = [Path(f) for f in files]
+        self.repeat = repeat
+        # 方式 -> 地形图 -> 每次的耗时
+        self.timings = {mode: {name: [] for name in MAP_BUILDERS} for mode in MODES}
+        # 插值方式 -> 地形图 -> 每次的耗时
+        self.upsample_timings = {mode: {name: [] for name in MAP_BUILDERS} for mode in UPSAMPLERS}
+        # "文件:地形图" -> 插值的差别
+        self.upsample_diffs = {}
+        # "文件:地形图" -> 超出容差的插值差别（bicubic 未启用时只报告，不算校验失败）
+        self.upsample_mismatches = {}
+        # "文件:地形图" -> 像素差
+        self.diffs = {}
+        # "文件:地形图" -> 超出容差的像素差
+        self.mismatches = {}
+
+    @staticmethod
+    def timed(func):
+        start = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - start
+
+    def run(self):
+        from services.map_raster import MapRasterizer, figure_png
+        warm = MapRasterizer()
+        relabel = MapRasterizer()
+        for source_file in self.files:
+            for name, (module_name, func_name) in MAP_BUILDERS.items():
+                builder = getattr(importlib.import_module(module_name), func_name)
+                values, style = self.run_upsample(source_file, name, builder)
+                # 先生成一次，raster 的计时只包含命中缓存后的栅格化和编码
+                warm.render_png(values, style)
+                relabel.render_png(values, style)
+                for i in range(self.repeat):
+                    expected, elapsed = self.timed(lambda: figure_png(values, style))
+                    self.timings["matplotlib"][name].append(elapsed)
+                    _, elapsed = self.timed(lambda: MapRasterizer().render_png(values, style))
+                    self.timings["raster-cold"][name].append(elapsed)
+                    relabel.frames.clear()
+                    _, elapsed = self.timed(lambda: relabel.render_png(values, style))
+                    self.timings["raster-relabel"][name].append(elapsed)
+                    actual, elapsed = self.timed(lambda: warm.render_png(values, style))
+                    self.timings["raster"][name].append(elapsed)
+                    # 输出与重复次数无关，只对比第一次
+                    if i == 0:
+                        self.verify(f"{source_file.name}:{name}", expected, actual)
+
+    def run_upsample(self, source_file, name, builder):
+        """
+        分别用 griddata 和 bicubic 取地形图数据并对比
+        :return: settings.TOPOGRAPHY_MAP_UPSAMPLER 对应的 (数据, 样式)
+        """
+        from django.conf import settings
+        from django.test import override_settings
+        results = {}
+        for mode in UPSAMPLERS:
+            with override_settings(TOPOGRAPHY_MAP_UPSAMPLER=mode):
+                # 第一次不计时（解析结果进入缓存）
+                results[mode] = builder(str(source_file))
+                for _ in range(self.repeat):
+                    _, elapsed = self.timed(lambda: builder(str(source_file)))
+                    self.upsample_timings[mode][name].append(elapsed)
+
+        (expected, style), (actual, _) = results["griddata"], results["bicubic"]
+        key = f"{source_file.name}:{name}"
+        diff = upsample_diff(expected, actual, style)
+        self.upsample_diffs[key] = diff
+        if not (diff['median'] <= MAX_UPSAMPLE_MEDIAN_DIFF and diff['p99'] <= MAX_UPSAMPLE_P99_DIFF
+                and diff['max'] <= MAX_UPSAMPLE_MAX_DIFF and diff['levels'] <= MAX_UPSAMPLE_LEVEL_RATIO):
+            self.upsample_mismatches[key] = diff
+            if settings.TOPOGRAPHY_MAP_UPSAMPLER == "bicubic":
+                self.mismatches[f"{key}:upsample"] = diff
+        return results["bicubic" if settings.TOPOGRAPHY_MAP_UPSAMPLER == "bicubic" else "griddata"]
+
+    def verify(self, key, expected, actual):
+        """对比 matplotlib 与 raster 的像素，记录超出容差的图"""
+        diff = pixel_diff(expected, actual)
+        self.diffs[key] = diff
+        if diff['max'] > MAX_PIXEL_DIFF or diff['mean'] > MAX_MEAN_DIFF or diff['outliers'] > MAX_OUTLIER_RATIO:
+            self.mismatches[key] = diff
+
+    @staticmethod
+    def summarize(timings):
+        """
+        :return: 方式 -> {maps_per_sec, maps: 地形图 -> 中位数耗时ms}
+        """
+        result = {}
+        for mode, maps in timings.items():
+            total = sum(sum(values) for values in maps.values())
+            count = sum(len(values) for values in maps.values())
+            result[mode] = {
+                'maps_per_sec': count / total if total else 0.0,
+                'maps': {name: statistics.median(values) * 1000 for name, values in maps.items() if values},
+            }
+        return result
+
+    def summary(self):
+        """汇总结果: {render: 绘制的耗时, upsample: 插值的耗时}"""
+        return {'render': self.summarize(self.timings), 'upsample': self.summarize(self.upsample_timings)}
+
+    @staticmethod
+    def timing_lines(summary):
+        """耗时表和相对第一种方式的加速"""
+        lines = ["{:<15} {:>8}".format("mode", "maps/s") + "".join(f" {name:>18}" for name in MAP_BUILDERS)]
+        for mode, values in summary.items():
+            line = "{:<15} {:>8.1f}".format(mode, values['maps_per_sec'])
+            for name in MAP_BUILDERS:
+                latency = values['maps'].get(name)
+                line += f" {'-':>18}" if latency is None else f" {latency:>18.1f}"
+            lines.append(line)
+        base_mode, *modes = summary
+        base = summary[base_mode]['maps_per_sec']
+        if base:
+            lines.append(f"相对 {base_mode} 加速: " + "，".join(
+                f"{mode} {summary[mode]['maps_per_sec'] / base:.1f} 倍" for mode in modes))
+        return lines
+
+    def report(self):
+        """文本报表"""
+        summary = self.summary()
+        lines = [f"文件: {', '.join(f.name for f in self.files)}，每张图重复 {self.repeat} 次，各地形图为中位数耗时(ms)",
+                 "数据插值:"]
+        lines += self.timing_lines(summary['upsample'])
+        for key, diff in self.upsample_diffs.items():
+            lines.append(f"插值差 {key}: 相对数据范围 中位数 {diff['median']:.5f}，P99 {diff['p99']:.4f}，"
+                         f"最大 {diff['max']:.4f}；有效区域不一致 {diff['mask']:.2%}，色阶不同 {diff['levels']:.2%}")
+        if self.upsample_mismatches:
+            lines.append(f"bicubic 插值超出容差（中位数 <= {MAX_UPSAMPLE_MEDIAN_DIFF:.1%}、P99 <= {MAX_UPSAMPLE_P99_DIFF:.0%}、"
+                         f"最大 <= {MAX_UPSAMPLE_MAX_DIFF:.0%}、色阶不同 <= {MAX_UPSAMPLE_LEVEL_RATIO:.0%}）: "
+                         f"{', '.join(self.upsample_mismatches)}")
+        lines.append("绘制和编码 PNG:")
+        lines += self.timing_lines(summary['render'])
+        for key, diff in self.diffs.items():
+            lines.append(f"像素差 {key}: 最大 {diff['max']}，平均 {diff['mean']:.4f}，"
+                         f"大于 {OUTLIER_LEVEL} 的像素 {diff['outliers']:.4%}")
+        if self.mismatches:
+            lines.append(f"超出容差: {', '.join(self.mismatches)}")
+        else:
+            lines.append(f"校验: 均在容差内（像素最大差 <= {MAX_PIXEL_DIFF}，平均差 <= {MAX_MEAN_DIFF}，差别大于 {OUTLIER_LEVEL} 的像素 <= "
+                         f"{MAX_OUTLIER_RATIO:.1%}；插值只在启用 bicubic 时校验）")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Medmont 地形图绘制性能基准")
+    parser.add_argument("files", nargs="*", type=Path, default=DEFAULT_FILES, help=".mxf 文件，默认使用项目自带的样例文件")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="每张图的重复次数")
+    parser.add_argument("--json", dest="json_path", help="将结果保存为 JSON 文件")
+    args = parser.parse_args(argv)
+
+    missing = [str(f) for f in args.files if not f.is_file()]
+    if missing or not args.files:
+        print(f"文件不存在: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    # 地形图模块会用到 Django 的 settings 和 models
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "eyehospital.settings")
+    import django
+    django.setup()
+
+    benchmark = MapBenchmark(args.files, max(1, args.repeat))
+    benchmark.run()
+    print(benchmark.report())
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "files": [str(f) for f in benchmark.files],
+                "repeat": benchmark.repeat,
+                "summary": benchmark.summary(),
+                "diffs": benchmark.diffs,
+                "upsample_diffs": benchmark.upsample_diffs,
+                "mismatches": benchmark.mismatches,
+            }, f, ensure_ascii=False, indent=2)
+    return 1 if benchmark.mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""
+Medmont 地形图直接栅格化
+
+高度图、切向曲率图、轴向曲率图、泪膜质量图原先每张都用 pyplot 画一张 10x10 英寸的图
+（imshow + 暗化层 + 颜色条 + 网格）再保存 PNG，绘制和编码占了生成时间的大部分。
+MapRasterizer 把一张图拆成两部分：
+- 与数据无关的框架（坐标轴、刻度、颜色条、网格、背景）：用 matplotlib 画一次后缓存（MapLayout）。
+  颜色条按色阶均匀分段，切向、轴向曲率图随数据变化的只有颜色条的刻度标签，
+  换标签时恢复缓存的背景后只重画颜色条的 y 轴；
+- 图像区域（ImageArea）：区域内的像素是图像颜色经暗化层、网格线叠加后的结果，对图像颜色是线性的，
+  图像取全黑、全白各画一次即得 像素 = 全黑时的像素 + 颜色 x (全白时的像素 - 全黑时的像素)。
+  数据用 BoundaryNorm 算出色阶下标后查颜色表，用 matplotlib 自己的 resample（Agg 的 hanning 滤波，
+  变换和输出大小取自 AxesImage.make_image）缩放到区域内，与框架合成后直接用 Pillow 编码 PNG。
+与 matplotlib 的输出只在合成的取整上有 1~2 个灰度级的差别，对比和耗时见 services/map_benchmark.py；
+settings.TOPOGRAPHY_MAP_RENDERER = "matplotlib" 时仍按原先的画法绘制。
+"""
+import io
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import BoundaryNorm, ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.image import HANNING, NEAREST, resample
+from PIL import Image
+
+# 图片大小（英寸）和分辨率，即 1000x1000 像素
+FIGURE_SIZE = (10, 10)
+DPI = 100
+# 图像范围（mm）
+EXTENT = [-6, 6, -6, 6]
+# 网格线和背景
+GRID_STYLE = {'color': '#999999', 'linestyle': '--', 'alpha': 0.3}
+FACE_COLOR = '#222222'
+# 暗化层的不透明度（20% 的黑色）
+DARK_ALPHA = 0.2
+# 缓存的框架和布局个数（切向、轴向曲率图的颜色条刻度标签随数据变化，每组标签一个框架，布局相同）
+FRAME_CACHE_SIZE = 8
+
+
+class MapStyle:
+    """地形图中与数据无关的设置：色阶、颜色条刻度、暗化层、图像方向"""
+
+    def __init__(self, colors, bad_color, bounds, ticks, tick_labels, label, origin='upper', dark=False,
+                 tick_size=None, label_size=14):
+        """
+        :param colors: 各色阶的 RGB（0~1），从低到高
+        :param bad_color: NaN 的颜色
+        :param bounds: 色阶边界（BoundaryNorm）
+        :param ticks: 颜色条刻度位置
+        :param tick_labels: 颜色条刻度标签
+        :param label: 颜色条标题
+        :param origin: 图像第 0 行在上（upper）还是在下（lower）
+        :param dark: 是否叠加暗化层
+        :param tick_size: 颜色条刻度字号，None 为默认
+        :param label_size: 颜色条标题字号
+        """
+        self.colors = tuple(tuple(float(c) for c in color) for color in colors)
+        self.bad_color = tuple(float(c) for c in bad_color)
+        self.bounds = tuple(float(b) for b in bounds)
+        self.ticks = tuple(float(t) for t in ticks)
+        self.tick_labels = tuple(str(label) for label in tick_labels)
+        self.label = label
+        self.origin = origin
+        self.dark = dark
+        self.tick_size = tick_size
+        self.label_size = label_size
+
+    @property
+    def key(self):
+        return (self.colors, self.bad_color, self.bounds, self.ticks, self.tick_labels, self.label,
+                self.origin, self.dark, self.tick_size, self.label_size)
+
+    def layout(self):
+        """
+        布局：颜色条按色阶均匀分段（与边界的取值无关），把边界换成 0..n-1、刻度换成对应的分段位置后，
+        只差刻度标签的样式画出来的框架相同，共用一张缓存的背景
+        :return: (布局的键, 换算后的 MapStyle)
+        """
+        positions = np.arange(len(self.bounds), dtype=np.float64)
+        ticks = np.interp(self.ticks, self.bounds, positions)
+        style = MapStyle(self.colors, self.bad_color, positions, ticks, self.tick_labels, self.label, self.origin,
+                         self.dark, self.tick_size, self.label_size)
+        key = (self.colors, self.bad_color, len(self.bounds), tuple(np.round(ticks, 6)), self.origin, self.dark,
+               self.tick_size, self.label_size)
+        return key, style
+
+    def colormap(self):
+        return ListedColormap(self.colors).with_extremes(bad=self.bad_color)
+
+    def norm(self):
+        return BoundaryNorm(self.bounds, ncolors=len(self.colors))
+
+    def color_table(self):
+        """
+        颜色表: 下标 0..N-1 为各色阶，N 为低于最小边界，N+1 为高于最大边界，N+2 为 NaN（N 为色阶数）
+        """
+        cmap = self.colormap()
+        table = cmap(np.arange(len(self.colors)))
+        table = np.vstack([table, cmap.get_under(), cmap.get_over(), cmap.get_bad()])
+        return table[:, :3]
+
+    def color_indices(self, values):
+        """
+        按 BoundaryNorm 把数值换算成颜色表的下标（与 matplotlib 取色一致）
+        :param values: 二维数组，NaN 为无效
+        """
+        count = len(self.colors)
+        invalid = np.isnan(values)
+        index = np.ma.getdata(self.norm()(np.where(invalid, self.bounds[0], values))).astype(np.intp)
+        index = np.where(index < 0, count, np.where(index >= count, count + 1, index))
+        index[invalid] = count + 2
+        return index
+
+
+def draw_figure(values, style):
+    """
+    按原先 pyplot 的画法画出地形图
+    :param values: 二维数组（或 RGB 图像，用于画框架），第 0 行的位置由 style.origin 决定
+    :param style: MapStyle
+    :return: (Figure, 数据图像 AxesImage, Colorbar)
+    """
+    fig = Figure(figsize=FIGURE_SIZE, dpi=DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    cmap = style.colormap()
+    norm = style.norm()
+    im = ax.imshow(values, cmap=cmap, norm=norm, origin=style.origin, extent=EXTENT, aspect='equal')
+
+    if style.dark:
+        dark_layer = np.zeros((values.shape[0], values.shape[1], 4))
+        dark_layer[:, :, 3] = DARK_ALPHA
+        ax.imshow(dark_layer, extent=EXTENT, origin=style.origin, aspect='equal')
+
+    cbar = fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04)
+    cbar.set_ticks(style.ticks)
+    cbar.set_ticklabels(style.tick_labels)
+    cbar.set_label(style.label, fontsize=style.label_size)
+    if style.tick_size is not None:
+        cbar.ax.tick_params(labelsize=style.tick_size)
+
+    ax.grid(True, **GRID_STYLE)
+    ax.set_facecolor(FACE_COLOR)
+    return fig, im, cbar
+
+
+def figure_png(values, style):
+    """用 matplotlib 绘制并保存 PNG（原先的画法）"""
+    fig, _, _ = draw_figure(values, style)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def resample_interpolation(shape, transform):
+    """
+    matplotlib 对 interpolation='auto' 的取法：按整数倍或 3 倍以上放大时为 nearest，否则为 hanning
+    :param shape: 数据的 (行数, 列数)
+    :param transform: 数据下标 -> 输出图像坐标 的变换
+    """
+    rows, cols = shape
+    disp = transform.transform(np.array([[0, 0], [cols, rows]]))
+    width, height = np.abs(np.diff(disp, axis=0))[0]
+    if width in (cols, 2 * cols) or width > 3 * cols:
+        if height in (rows, 2 * rows) or height > 3 * rows:
+            return NEAREST
+    return HANNING
+
+
+class ImageArea:
+    """
+    图像在图片中占的区域：像素 = base + 缩放后的图像颜色（0~255） x gain，
+    以及 matplotlib 缩放图像时使用的变换和输出大小
+    """
+
+    def __init__(self, style, shape):
+        """
+        :param style: MapStyle（只用到暗化层和方向）
+        :param shape: 数据的 (行数, 列数)
+        """
+        fig, image, _ = draw_figure(np.zeros(shape + (3,)), style)
+        fig.canvas.draw()
+        black = np.array(fig.canvas.buffer_rgba())[:, :, :3]
+        image.set_data(np.ones(shape + (3,)))
+        fig.canvas.draw()
+        white = np.asarray(fig.canvas.buffer_rgba())[:, :, :3]
+
+        # 数据下标 -> 缩放后图像的变换（含 matplotlib 把输出补齐到整像素的缩放）；
+        # 缩放后的图像第 0 行在下，Agg 按 (int(x), int(图片高 - (y + 图像高))) 贴到图片上
+        output, x, y, self.transform = image.make_image(fig.canvas.get_renderer(), unsampled=False)
+        self.out_shape = output.shape[:2]
+        top = int(black.shape[0] - (y + self.out_shape[0]))
+        left = int(x)
+        self.rows = slice(top, top + self.out_shape[0])
+        self.cols = slice(left, left + self.out_shape[1])
+
+        # 放大倍数不小于 3 时 matplotlib 先插值数据再取色（interpolation_stage='data'），颜色表的做法不适用
+        (scale_x, _, _), (_, scale_y, _), _ = np.abs(self.transform.get_matrix())
+        self.exact = scale_x < 3 or scale_y < 3
+        self.interpolation = resample_interpolation(shape, self.transform)
+        self.resample_args = (image.get_resample(), 1, image.get_filternorm(), image.get_filterrad())
+
+        # 加 0.5 后截断即四舍五入
+        self.base = black[self.rows, self.cols].astype(np.float32) + 0.5
+        self.gain = (white[self.rows, self.cols].astype(np.float32) - black[self.rows, self.cols]) / 255
+
+    def resample(self, colors):
+        """
+        按 matplotlib 的方式（interpolation_stage='rgba'）把数据的颜色缩放到区域内的每个像素
+        :param colors: (行数, 列数, 3) 的颜色（0~1）
+        :return: (区域高, 区域宽, 3) 的颜色，取值 0~255 的整数（与 matplotlib 一样截断）
+        """
+        rgba = np.ones(colors.shape[:2] + (4,))
+        rgba[:, :, :3] = colors
+        output = np.zeros(self.out_shape + (4,))
+        resample(rgba, output, self.transform, self.interpolation, *self.resample_args)
+        return (output[::-1, :, :3] * 255).astype(np.uint8)
+
+    def compose(self, colors):
+        """区域内的像素（uint8 RGB）"""
+        # 颜色在 0~255 之间，结果在全黑和全白的像素之间，不会越界
+        pixels = self.resample(colors).astype(np.float32)
+        pixels *= self.gain
+        pixels += self.base
+        return pixels.astype(np.uint8)
+
+
+class MapLayout:
+    """
+    一种布局的图，缓存不含颜色条 y 轴（刻度、刻度标签、标题）的背景；
+    换刻度标签时恢复背景后只重画颜色条的 y 轴（matplotlib 的 blit）
+    """
+
+    def __init__(self, style):
+        """
+        :param style: MapStyle.layout() 换算后的样式
+        """
+        self.figure, _, colorbar = draw_figure(np.zeros((1, 1, 3)), style)
+        self.axes = colorbar.ax
+        self.axis = colorbar.ax.yaxis
+        self.axis.set_visible(False)
+        self.figure.canvas.draw()
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        self.axis.set_visible(True)
+        self.lock = threading.Lock()
+
+    def render(self, style):
+        """
+        画出样式的框架（图像区域内的像素另行合成）
+        :return: (高, 宽, 3) 的 uint8 RGB
+        """
+        with self.lock:
+            canvas = self.figure.canvas
+            canvas.restore_region(self.background)
+            # 同一布局的刻度位置只在取整后相同，按样式自己的位置放刻度，否则标签可能差一个像素
+            self.axis.set_ticks(style.layout()[1].ticks, labels=style.tick_labels)
+            self.axis.set_label_text(style.label)
+            self.axes.draw_artist(self.axis)
+            return np.array(canvas.buffer_rgba())[:, :, :3]
+
+
+class MapRasterizer:
+    """缓存框架和图像区域，直接栅格化地形图"""
+
+    def __init__(self, max_frames=FRAME_CACHE_SIZE):
+        self.max_frames = max_frames
+        # 样式 -> 框架的 RGB
+        self.frames = OrderedDict()
+        # 布局的键 -> MapLayout
+        self.layouts = OrderedDict()
+        # (暗化层, 方向, 数据形状) -> ImageArea（与颜色条无关）
+        self.areas = {}
+        self.lock = threading.Lock()
+
+    def frame(self, style):
+        """样式对应的框架：先查缓存，再用同布局的背景重画颜色条刻度，都没有时画出布局"""
+        with self.lock:
+            frame = self.frames.get(style.key)
+            if frame is not None:
+                self.frames.move_to_end(style.key)
+                return frame
+            layout_key, layout_style = style.layout()
+            layout = self.layouts.get(layout_key)
+            if layout is not None:
+                self.layouts.move_to_end(layout_key)
+
+        if layout is None:
+            layout = MapLayout(layout_style)
+        frame = layout.render(style)
+
+        with self.lock:
+            self.layouts[layout_key] = layout
+            self.frames[style.key] = frame
+            while len(self.layouts) > self.max_frames:
+                self.layouts.popitem(last=False)
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)
+        return frame
+
+    def area(self, style, shape):
+        key = (style.dark, style.origin, shape)
+        with self.lock:
+            area = self.areas.get(key)
+        if area is None:
+            area = ImageArea(style, shape)
+            with self.lock:
+                self.areas[key] = area
+        return area
+
+    def render(self, values, style):
+        """
+        栅格化一张地形图
+        :param values: 二维数组，NaN 为无效，第 0 行的位置由 style.origin 决定
+        :param style: MapStyle
+        :return: (高, 宽, 3) 的 uint8 RGB
+        """
+        values = np.asarray(values, dtype=np.float64)
+        area = self.area(style, values.shape)
+        pixels = self.frame(style).copy()
+        colors = style.color_table()[style.color_indices(values)]
+        pixels[area.rows, area.cols] = area.compose(colors)
+        return pixels
+
+    def render_png(self, values, style):
+        """栅格化并编码为 PNG（放大 3 倍以上、matplotlib 先插值数据再取色时按原先的画法绘制）"""
+        if not self.area(style, np.shape(values)).exact:
+            return figure_png(values, style)
+        buffer = io.BytesIO()
+        Image.fromarray(self.render(values, style)).save(buffer, format='png')
+        return buffer.getvalue()
+
+
+# 进程内共享的栅格化器
+map_rasterizer = MapRasterizer()
+
+
+def render_png(values, style):
+    """按 settings.TOPOGRAPHY_MAP_RENDERER 生成地形图 PNG：raster 直接栅格化，matplotlib 原样绘制"""
+    if settings.TOPOGRAPHY_MAP_RENDERER == "matplotlib":
+        return figure_png(values, style)
+    return map_rasterizer.render_png(values, style)
+
+
+def save_map(values, style, image_dir):
+    """
+    生成地形图并保存到 MEDIA_ROOT/image_dir/<uuid>.png
+    :return: 相对 MEDIA_ROOT 的路径
+    """
+    os.makedirs(Path(settings.MEDIA_ROOT) / image_dir, exist_ok=True)
+    save_dir_path = os.path.join(image_dir, f"{uuid.uuid4()}.png")
+    with open(Path(settings.MEDIA_ROOT) / save_dir_path, 'wb') as f:
+        f.write(render_png(values, style))
+    return save_dir_path
@@ -3,11 +3,13 @@ import json
 
 import numpy as np
 import pandas as pd
-from scipy.interpolate import griddata
+from scipy.interpolate import CloughTocher2DInterpolator, griddata
 from django.conf import settings
 from loguru import logger
 
 from services.aop_mxf import OperationMXF
+from services.kbq_search import B_SEARCH_VALUES, search_best_fit
+from services.polar_height import PolarHeightMap
 import os, django
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "eyehospital.settings")
@@ -40,36 +42,44 @@ class MedmentExtractor:
         self.y_range = np.linspace(-6, 6, 50)
         self.X, self.Y = np.meshgrid(self.x_range, self.y_range)
 
+        # 三次插值器只创建一次（三角剖分和梯度估计），之后每次查询只做插值；
+        # 与每次调用 griddata(..., method='cubic') 的结果相同
+        valid_indices = np.where(~np.isnan(self.Z))
+        valid_points = np.column_stack((self.X[valid_indices], self.Y[valid_indices]))
+        self.interpolator = CloughTocher2DInterpolator(valid_points, self.Z[valid_indices], fill_value=np.nan)
+
+        # 规则网格的极坐标数组，settings.MEDMONT_HEIGHT_SAMPLER 为 polar 时才使用
+        self.polar = PolarHeightMap(self.Z, self.x_range, self.y_range) \
+            if settings.MEDMONT_HEIGHT_SAMPLER == "polar" else None
+
     def get_z_value(self, angle, chord_length):
         """
         根据角度和弦长计算对应的Z值。
         参数:
         - angle: float，输入角度（度）
-        - chord_length: float，输入弦长
+        - chord_length: float 或数组，输入弦长；传入数组时一次算出同一方向上所有弦长的Z值
         返回:
-        - Z_value: float，对应的Z值
+        - Z_value: float，对应的Z值（弦长为数组时为同样形状的数组）
         """
 
         # 将角度转换为弧度
         theta = np.deg2rad(angle)
 
         # 计算弦的中点坐标
-        x = (chord_length / 2) * np.cos(theta)
-        y = (chord_length / 2) * np.sin(theta)
+        x = (np.asarray(chord_length, dtype=np.float64) / 2) * np.cos(theta)
+        y = (np.asarray(chord_length, dtype=np.float64) / 2) * np.sin(theta)
 
         # 限制坐标范围在 -6 到 6 之间
         x = np.clip(x, -6, 6)
         y = np.clip(y, -6, 6)
 
-        # 提取非 NaN 的数据点
-        if np.isnan(self.Z).any():
-            valid_indices = np.where(~np.isnan(self.Z))
-            valid_X = self.X[valid_indices]
-            valid_Y = self.Y[valid_indices]
-            valid_Z = self.Z[valid_indices]
-
         # 使用三次插值法计算Z值
-        z_value = griddata((valid_X, valid_Y), valid_Z, (x, y), method='cubic')
+        # 逐点求值：批量求值时三角形查找从上一个点开始，落在三角形边上的点可能取到相邻三角形，末位与逐次 griddata 不同
+        if x.ndim == 0:
+            z_value = self.interpolator((x, y))
+        else:
+            z_value = np.array([self.interpolator((x_item, y_item)) for x_item, y_item in zip(x.ravel(), y.ravel())],
+                               dtype=np.float64).reshape(x.shape)
 
         # 处理插值结果为 NaN 的情况
         # if np.isnan(z_value):
@@ -79,6 +89,19 @@ class MedmentExtractor:
         # logger.info(f"{angle}高度值：{z_value}")
         return abs(z_value)
 
+    def meridian(self, angle, radius_list):
+        """
+        同一方向上各半径的高度
+        :param angle: 角度（度）
+        :param radius_list: 半径列表
+        :return: 高度数组；开启极坐标数组时直接取对应子午线，否则与 get_z_value(angle, 半径 * 2) 相同
+        """
+        if self.polar is not None:
+            heights = self.polar.meridian(angle, radius_list)
+            if heights is not None:
+                return abs(heights)
+        return self.get_z_value(angle, np.array([float(radius) * 2 for radius in radius_list]))
+
     def fill_missing_value(self, x, y):
         """
         在Z矩阵缺少有效值的情况下，尝试用周围值填充并重新插值。
@@ -127,7 +150,10 @@ class MedmentExtractor:
 class KBQ:
     """计算平K、Q、B"""
 
-    def __init__(self, radius: list = None, degree_list: list = None, filter_data=None):
+    # 四个方向的高度在 radius_angle 结果中的键
+    DEGREE_KEYS = ['degree_list_k1', 'degree_list_k2', 'degree_list_k3', 'degree_list_k4']
+
+    def __init__(self, radius: list = None, degree_list: list = None, filter_data=None, extractor=None):
         self.filter_data = filter_data
         self.radius = radius  # degree_list作为一个2个数据的列表,切记暂为半径
         self.degree_list = degree_list  # degree_list作为一个2个数据的列表
@@ -136,33 +162,41 @@ class KBQ:
         self.radius_list = np.arange(self.radius[0], self.radius[1] + 0.1, 0.1).tolist()
         self.rounded_radius_list = [round(num, 1) for num in self.radius_list]
 
+        # 只创建一次 Extractor（只解析一次文件），各方向、各半径共用；FittingSession 传入已加载的 extractor 时直接共用
+        self.extractor = extractor if extractor is not None else MedmentExtractor(xml_file=self.filter_data)
+        # radius_angle 的结果，同一实例只采样一次
+        self._data_list = None
+
     def radius_angle(self):
         """
         通过半径和平k方向高度、陡K方向高度,生成一个大list
         :param self:
-        :return:
+        :return: 同一实例只采样一次，之后直接返回缓存的结果
         """
-
+        if self._data_list is not None:
+            return self._data_list
+        # 每个方向所有半径一起取值
+        heights = [self.extractor.meridian(degree, self.rounded_radius_list) for degree in self.degree_list[:4]]
         data_list = []
-        for item in self.rounded_radius_list:
-            data_dict = {'radius': float(item),
-                         'degree_list_k1': MedmentExtractor(xml_file=self.filter_data).get_z_value(
-                             self.degree_list[0],
-                             float(item) * 2),
-                         'degree_list_k2': MedmentExtractor(xml_file=self.filter_data).get_z_value(
-                             self.degree_list[1],
-                             float(item) * 2),
-                         'degree_list_k3': MedmentExtractor(xml_file=self.filter_data).get_z_value(
-                             self.degree_list[2],
-                             float(item) * 2),
-                         'degree_list_k4': MedmentExtractor(xml_file=self.filter_data).get_z_value(
-                             self.degree_list[3],
-                             float(item) * 2),
-                         }
+        for index, item in enumerate(self.rounded_radius_list):
+            data_dict = {'radius': float(item)}
+            for key, height in zip(self.DEGREE_KEYS, heights):
+                data_dict[key] = height[index]
             data_list.append(data_dict)
         # print(data_list)
+        self._data_list = data_list
         return data_list
 
+    def meridian_profiles(self):
+        """
+        四个方向的高度矩阵
+        :return: (半径列表, (半径数, 4) 的高度矩阵)，各列依次为 degree_list_k1 ~ degree_list_k4
+        """
+        data_list = self.radius_angle()
+        radius_values = [item['radius'] for item in data_list]
+        profiles = np.array([[item[key] for key in self.DEGREE_KEYS] for item in data_list], dtype=np.float64)
+        return radius_values, profiles.reshape(len(data_list), len(self.DEGREE_KEYS))
+
     @staticmethod
     def formula_numpy(_k, _x, _q, _b):
         """
@@ -182,119 +216,51 @@ class KBQ:
         denominator = 1 + np.sqrt(1 - (1 + _q) * _c ** 2 * _x ** 2)
         return numerator / denominator + _b / 1000
 
-    def difference_square_deviation(self, radius, degree_01, k_type=None, pin_q_values=None,
-                                    pin_b_values=None):
+    def kbq_axes(self, k_type=None, pin_q_values=None, pin_b_values=None):
         """
-        根据三个值，算出一个方差list; 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
-        :param radius:
-        :param degree_01:
-        :param degree_02:
+        候选组合的取值，B 值是否参与搜索由 settings.KBQ_B_SEARCH 决定
         :param k_type: 0,平k；1,陡k
-        :param pin_q_values: 平k 最佳q值
-        :param pin_b_values: 陡k 最佳b值
-        :return:
+        :param pin_q_values: 平k 最佳q值（陡k时Q固定，只遍历k值）
+        :param pin_b_values: 平k 最佳b值（开启B值搜索时陡k的B固定）
+        :return: (B_values, K_values, Q_values)
         """
-        # 计算平均数
-        average_k = np.mean([degree_01])
-        # B_values = list(np.arange(-50, 55, 5)) if k_type == 0 else pin_b_values
-        B_values = [0]
         K_values = list(np.arange(35, 50.25, 0.25))
+        B_values = [0]
+        if settings.KBQ_B_SEARCH:
+            B_values = list(B_SEARCH_VALUES) if k_type == 0 else ([0] if pin_b_values is None else pin_b_values)
         Q_values = [0, -0.25, -0.5, -0.75, -1] if k_type == 0 else pin_q_values
+        return B_values, K_values, Q_values
 
-        # 建立三维坐标
-        B, K, Q = np.meshgrid(B_values, K_values, Q_values, indexing='ij')
-        # 将三维坐标合成一个二维数组
-        combined_array = np.column_stack((B.ravel(), K.ravel(), Q.ravel()))
-        # 镜片高度数据, 并计算平方差
-        results = self.formula_numpy(combined_array[:, 1], radius, combined_array[:, 2], combined_array[:, 0])
-        # np.set_printoptions(threshold=np.inf)
-        # aaa = np.array(results)
-        # logger.info(f"高度数据：{aaa}")
-        squared_diff = (results - average_k) ** 2
-
-        return {
-            "radius": radius,
-            "qbk": combined_array,
-            "squared_diff": squared_diff,
-            "qbk_len": len(combined_array),
-            "squared_diff_len": len(squared_diff),
-            "type": k_type
-        }
-
-    def main(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False):
+    def main(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False, top_n=None):
         """
         计算平K、Q、B"
         :param k_type: 0,平k；1,陡k
         :param pin_q_values: 平k 最佳q值
         :param pin_b_values: 陡k 最佳b值
+        :param top_n: 同时返回平均平方差最小的前 top_n 个组合（candidates），不传则不返回
         :return: 最佳数据，K,Q,B
         """
         best_data = []
 
-        degree_list = ['degree_list_k1', 'degree_list_k2', 'degree_list_k3', 'degree_list_k4']
-
-        for number, iaa in enumerate(degree_list):
-            finally_array = []
-            count: int = 0
-            for item in self.radius_angle():
-                if str(number) != "0":
-                    k_type = 1
-                    pin_q_values = best_data[0]['best_data']['Q']
-                    pin_b_values = best_data[0]['best_data']['B']
-
-                data = self.difference_square_deviation(item['radius'],
-                                                        item[iaa],
-                                                        k_type) if k_type == 0 else (
-                    self.difference_square_deviation(item['radius'],
-                                                     item[f'degree_list_k{number + 1}'],
-                                                     k_type,
-                                                     pin_q_values,
-                                                     pin_b_values))
-                count = data['qbk_len']
-                finally_array.append(data)
-
-            p_diff_list = []
-            for i in range(count):
-                diff_list = []
-                for item1 in finally_array:
-                    diff_list.append({"diff": item1['squared_diff'][i], "qbk": item1['qbk'][i], "radius": item1['radius']})
-
-                diff_list = [item for item in diff_list if not np.isnan(item['diff'])]
-
-                if len(diff_list) != 0:
-                    mean_variance = sum(item3['diff'] for item3 in diff_list) / len(diff_list)
-                    p_diff_list.append({"qbk": diff_list[0]['qbk'], "mean": mean_variance})
-                else:
-                    pass
-
-            try:
-                means = np.array([item4["mean"] for item4 in p_diff_list])
-                min_index = np.argmin(means)
-                min_value = means[min_index]
-            except Exception as e:
+        # 四个方向的高度只采样一次，四轴共用
+        radius_values, profiles = self.meridian_profiles()
+
+        for number in range(profiles.shape[1]):
+            if number != 0:
+                # 其余三个方向沿用第一个方向的Q、B，只遍历k值
+                k_type = 1
+                pin_q_values = best_data[0]['best_data']['Q']
+                pin_b_values = best_data[0]['best_data']['B']
+
+            # 所有半径、所有组合按矩阵计算平方差，取平均平方差最小的组合
+            best_data_a = search_best_fit(self.formula_numpy, radius_values, profiles[:, number],
+                                          *self.kbq_axes(k_type, pin_q_values, pin_b_values),
+                                          mode=settings.KBQ_SEARCH_MODE, top_n=top_n)
+            if best_data_a is None:
                 return None
 
-            """
-            四轴定制和基础定制不同,需要根据每个角度选出相对应的KQB,因此不需要将所有的KQB放在同一个列表里边计算
-            每一个度数进行一次计算,最后出现4个KQB
-            最小方差的位置：{min_position}
-            最小方差的值：{min_number}
-            平方差最小的组合：{result[min_position]}
-            最佳数据：combined_array[min_position]
-                  平K:combined_array[min_position][1]
-                  Q:combined_array[min_position][2]
-                  B:combined_array[min_position][0]
-            """
-
-            best_data_a = {
-                "minimum_variance": min_value,
-                "best_data": {
-                    "K": p_diff_list[min_index]['qbk'][1],
-                    "Q": p_diff_list[min_index]['qbk'][2],
-                    "B": p_diff_list[min_index]['qbk'][0]
-                    # "B": 0
-                }
-            }
+            # 四轴定制和基础定制不同,需要根据每个角度选出相对应的KQB,因此不需要将所有的KQB放在同一个列表里边计算
+            # 每一个度数进行一次计算,最后出现4个KQB
             best_data.append(best_data_a)
 
         return best_data
@@ -0,0 +1,125 @@
+"""
+Medmont 角膜高度的极坐标重采样
+
+CornealHeight 是 linspace(-6, 6, 50) 上的 50x50 规则网格（行为 y，列为 x，无效点为 NaN）。
+PolarHeightMap 直接按规则网格做双线性插值，一次把整个网格换算成 (半径 x 360°) 的极坐标数组并缓存，
+之后每条子午线的查询只是取两列相邻角度按权重相加，不再逐点在散点三角剖分上插值。
+NaN 的处理：周围四个格点中有无效点时只用有效格点并按权重重新归一；
+有效格点的权重合计不足一半（查询点更靠近无效格点）时为 NaN，不向测量区外延伸。角度方向同理。
+
+极坐标数组的高度与原先散点插值（LinearNDInterpolator / griddata cubic）的结果并不逐位一致，
+由 settings.MEDMONT_HEIGHT_SAMPLER = "polar" 开启，默认仍使用原插值器。
+"""
+import math
+
+import numpy as np
+
+# 极坐标数组的半径步长、最大半径（与 KBQ 的半径步长、地形图范围一致）和角度数（每度一列）
+RADIUS_STEP = 0.1
+MAX_RADIUS = 6.0
+ANGLE_COUNT = 360
+# 有效格点权重合计的下限
+MIN_VALID_WEIGHT = 0.5
+
+
+def nan_weighted_sum(values, weights, axis, min_weight=MIN_VALID_WEIGHT):
+    """
+    忽略 NaN 的加权和，有效项的权重重新归一
+    :param values: 取值，NaN 为无效
+    :param weights: 与 values 同形状（或可广播）的权重，沿 axis 合计为 1
+    :param axis: 求和的轴
+    :param min_weight: 有效项权重合计的下限，不足时结果为 NaN
+    :return: 加权和
+    """
+    valid = ~np.isnan(values)
+    weights = np.where(valid, weights, 0.0)
+    total = weights.sum(axis=axis)
+    summed = (np.where(valid, values, 0.0) * weights).sum(axis=axis)
+    enough = (total >= min_weight) & (total > 0)
+    return np.where(enough, summed / np.where(enough, total, 1.0), np.nan)
+
+
+def bilinear(Z, x_range, y_range, x, y):
+    """
+    规则网格上的双线性插值（忽略 NaN 格点）
+    :param Z: 网格高度，Z[i, j] 对应 (x_range[j], y_range[i])
+    :param x_range: 等间距的 x 坐标
+    :param y_range: 等间距的 y 坐标
+    :param x: 查询点 x 坐标（数组），超出网格的按边界取值
+    :param y: 查询点 y 坐标（与 x 同形状）
+    :return: 与 x 同形状的高度
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # 换算成网格上的小数下标
+    fx = np.clip((x - x_range[0]) / (x_range[1] - x_range[0]), 0, len(x_range) - 1)
+    fy = np.clip((y - y_range[0]) / (y_range[1] - y_range[0]), 0, len(y_range) - 1)
+    ix = np.minimum(np.floor(fx).astype(int), len(x_range) - 2)
+    iy = np.minimum(np.floor(fy).astype(int), len(y_range) - 2)
+    wx = fx - ix
+    wy = fy - iy
+
+    # 四个格点：左下、右下、左上、右上
+    values = np.stack((Z[iy, ix], Z[iy, ix + 1], Z[iy + 1, ix], Z[iy + 1, ix + 1]))
+    weights = np.stack(((1 - wx) * (1 - wy), wx * (1 - wy), (1 - wx) * wy, wx * wy))
+    return nan_weighted_sum(values, weights, axis=0)
+
+
+class PolarHeightMap:
+    """角膜高度网格换算成的极坐标数组，heights[半径下标, 角度下标]"""
+
+    def __init__(self, Z, x_range, y_range, radius_step=RADIUS_STEP, max_radius=MAX_RADIUS,
+                 angle_count=ANGLE_COUNT):
+        """
+        :param Z: 50x50 角膜高度网格（无效点为 NaN）
+        :param x_range: 网格的 x 坐标
+        :param y_range: 网格的 y 坐标
+        :param radius_step: 半径步长
+        :param max_radius: 最大半径
+        :param angle_count: 一周的角度数，角度步长为 360 / angle_count
+        """
+        self.radius_step = radius_step
+        self.angle_step = 360 / angle_count
+        count = int(round(max_radius / radius_step)) + 1
+        self.radii = np.array([round(index * radius_step, 10) for index in range(count)])
+        self.angles = np.arange(angle_count) * self.angle_step
+
+        # 一次算出所有 (半径, 角度) 点的高度
+        theta = np.deg2rad(self.angles)
+        x = self.radii[:, None] * np.cos(theta)[None, :]
+        y = self.radii[:, None] * np.sin(theta)[None, :]
+        self.heights = bilinear(Z, x_range, y_range, x, y)
+
+    def radius_indices(self, radius_list):
+        """
+        半径在极坐标数组中的下标
+        :param radius_list: 半径列表
+        :return: 下标数组；有半径不在步长网格上或超出最大半径时返回 None
+        """
+        radius = np.asarray(radius_list, dtype=np.float64)
+        indices = np.rint(radius / self.radius_step).astype(int)
+        if indices.size == 0 or indices.min() < 0 or indices.max() >= len(self.radii):
+            return None
+        if not np.allclose(self.radii[indices], radius, rtol=0, atol=1e-9):
+            return None
+        return indices
+
+    def meridian(self, angle, radius_list):
+        """
+        一条子午线上各半径的高度：取角度两侧相邻的两列，按角度线性插值（忽略 NaN）
+        :param angle: 角度（度），任意实数，按一周取余
+        :param radius_list: 半径列表
+        :return: 高度数组；半径不在步长网格上时返回 None，由调用方改用原插值器
+        """
+        indices = self.radius_indices(radius_list)
+        if indices is None:
+            return None
+        position = (float(angle) % 360) / self.angle_step
+        lower = int(math.floor(position)) % len(self.angles)
+        upper = (lower + 1) % len(self.angles)
+        weight = position - math.floor(position)
+        if weight == 0:
+            return self.heights[indices, lower].copy()
+        values = np.stack((self.heights[indices, lower], self.heights[indices, upper]))
+        weights = np.array([1 - weight, weight])[:, None]
+        return nan_weighted_sum(values, weights, axis=0)
@@ -1,8 +1,12 @@
+import copy
+
 import numpy as np
 import pandas as pd
 import xml.etree.ElementTree as ET
 from django.conf import settings
 from loguru import logger
+from services.topography_cache import topography_cache
+from services.kbq_search import B_SEARCH_VALUES, search_best_fit
 from scipy.interpolate import interp1d
 
 import os, django
@@ -16,9 +20,8 @@ logger.add(f'{BASE_DIR}/loguru.log', rotation="100 MB")
 
 class SeourExtractor:
     def __init__(self, xml_file):
-        # 解析XML文件
-        self.tree = ET.parse(xml_file)
-        self.root = self.tree.getroot()
+        self.xml_file = xml_file
+        self._tree = None
 
         # radius_excel_path = BASE_DIR / 'data' / 'seour' / 'seour-radius.xlsx'
         # height_excel_path = BASE_DIR / 'data' / 'seour' / 'seour-height.xlsx'
@@ -27,11 +30,39 @@ class SeourExtractor:
         # self.radius_data = pd.read_excel(radius_excel_path, header=None).values
         # self.height_data = pd.read_excel(height_excel_path, header=None).values
 
+        # 解析结果按文件内容缓存，同一文件再次创建时不再解析XML
+        meta, arrays = topography_cache.load(xml_file, "seour_4", self.read_file)
+        self.eye_data = meta["eye_data"]
+        self.radius_data = arrays["radius"]
+        self.height_data = arrays["height"]
+
+    @property
+    def tree(self):
+        """解析XML文件，只在缓存未命中时才需要"""
+        if self._tree is None:
+            self._tree = ET.parse(self.xml_file)
+        return self._tree
+
+    @property
+    def root(self):
+        return self.tree.getroot()
+
+    def read_file(self, xml_file):
+        """
+        解析XML文件，供缓存调用
+        :return: (眼别数据, RadiusMillimeter 和 CornealHeight 数据)
+        """
         # 从XML文件中读取 RadiusMillimeter 和 CornealHeight 数据
-        self.radius_data = self.parser_xml_radiusMillimeter().values
-        self.height_data = self.parser_xml_cornealHeight().values
+        return {"eye_data": self.read_eye_data()}, {
+            "radius": self.parser_xml_radiusMillimeter().values,
+            "height": self.parser_xml_cornealHeight().values,
+        }
 
     def parse_eye_data(self):
+        """根据 EyeType 解析的 KeratometricIndices3mm 内容（与 read_eye_data 相同，取自缓存）"""
+        return copy.deepcopy(self.eye_data)
+
+    def read_eye_data(self):
         """根据 EyeType 解析 KeratometricIndices3mm 内容（Radius和Height使用Excel数据）"""
         eye_data = {}
         for eye in self.root.findall(".//SW6000PatientTest"):
@@ -127,7 +158,10 @@ class SeourExtractor:
 class KBQ:
     """计算平K、Q、B"""
 
-    def __init__(self, radius: list = None, degree_list: list = None, filter_data=None):
+    # 四个方向的高度在 radius_angle 结果中的键
+    DEGREE_KEYS = ['degree_list_k1', 'degree_list_k2', 'degree_list_k3', 'degree_list_k4']
+
+    def __init__(self, radius: list = None, degree_list: list = None, filter_data=None, extractor=None):
         self.filter_data = filter_data
         self.radius = radius  # degree_list作为一个2个数据的列表,切记暂为半径
         self.degree_list = degree_list  # degree_list作为一个2个数据的列表
@@ -136,33 +170,50 @@ class KBQ:
         self.radius_list = np.arange(self.radius[0], self.radius[1] + 0.1, 0.1).tolist()
         self.rounded_radius_list = [round(num, 3) for num in self.radius_list]
 
+        # 只创建一次 Extractor（只解析一次文件），各方向、各半径共用；FittingSession 传入已加载的 extractor 时直接共用
+        self.extractor = extractor if extractor is not None else SeourExtractor(xml_file=self.filter_data)
+        # radius_angle 的结果，同一实例只采样一次
+        self._data_list = None
+
     def radius_angle(self):
         """
         通过半径和平k方向高度、陡K方向高度,生成一个大list
         :param self:
-        :return:
+        :return: 同一实例只采样一次，之后直接返回缓存的结果
         """
-
+        if self._data_list is not None:
+            return self._data_list
         data_list = []
         for item in self.rounded_radius_list:
             data_dict = {'radius': float(item),
-                         'degree_list_k1': SeourExtractor(xml_file=self.filter_data).find_closest_height(
+                         'degree_list_k1': self.extractor.find_closest_height(
                              theta=self.degree_list[0],
                              R=float(item)),
-                         'degree_list_k2': SeourExtractor(xml_file=self.filter_data).find_closest_height(
+                         'degree_list_k2': self.extractor.find_closest_height(
                              theta=self.degree_list[1],
                              R=float(item)),
-                         'degree_list_k3': SeourExtractor(xml_file=self.filter_data).find_closest_height(
+                         'degree_list_k3': self.extractor.find_closest_height(
                              theta=self.degree_list[2],
                              R=float(item)),
-                         'degree_list_k4': SeourExtractor(xml_file=self.filter_data).find_closest_height(
+                         'degree_list_k4': self.extractor.find_closest_height(
                              theta=self.degree_list[3],
                              R=float(item)),
                          }
             data_list.append(data_dict)
             # logger.info(data_list)
+        self._data_list = data_list
         return data_list
 
+    def meridian_profiles(self):
+        """
+        四个方向的高度矩阵
+        :return: (半径列表, (半径数, 4) 的高度矩阵)，各列依次为 degree_list_k1 ~ degree_list_k4
+        """
+        data_list = self.radius_angle()
+        radius_values = [item['radius'] for item in data_list]
+        profiles = np.array([[item[key] for key in self.DEGREE_KEYS] for item in data_list], dtype=np.float64)
+        return radius_values, profiles.reshape(len(data_list), len(self.DEGREE_KEYS))
+
     @staticmethod
     def formula_numpy(_k, _x, _q, _b):
         """
@@ -182,117 +233,51 @@ class KBQ:
         denominator = 1 + np.sqrt(1 - (1 + _q) * _c ** 2 * _x ** 2)
         return numerator / denominator + _b / 1000
 
-    def difference_square_deviation(self, radius, degree_01, k_type=None, pin_q_values=None,
-                                    pin_b_values=None):
+    def kbq_axes(self, k_type=None, pin_q_values=None, pin_b_values=None):
         """
-        根据三个值，算出一个方差list; 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
-        :param radius:
-        :param degree_01:
-        :param degree_02:
+        候选组合的取值，B 值是否参与搜索由 settings.KBQ_B_SEARCH 决定
         :param k_type: 0,平k；1,陡k
-        :param pin_q_values: 平k 最佳q值
-        :param pin_b_values: 陡k 最佳b值
-        :return:
+        :param pin_q_values: 平k 最佳q值（陡k时Q固定，只遍历k值）
+        :param pin_b_values: 平k 最佳b值（开启B值搜索时陡k的B固定）
+        :return: (B_values, K_values, Q_values)
         """
-        # 计算平均数
-        average_k = np.mean([degree_01])
-        # B_values = list(np.arange(-50, 55, 5)) if k_type == 0 else pin_b_values
-        B_values = [0]
         K_values = list(np.arange(35, 50.25, 0.25))
+        B_values = [0]
+        if settings.KBQ_B_SEARCH:
+            B_values = list(B_SEARCH_VALUES) if k_type == 0 else ([0] if pin_b_values is None else pin_b_values)
         Q_values = [0, -0.25, -0.5, -0.75, -1] if k_type == 0 else pin_q_values
+        return B_values, K_values, Q_values
 
-        # 建立三维坐标
-        B, K, Q = np.meshgrid(B_values, K_values, Q_values, indexing='ij')
-        # 将三维坐标合成一个二维数组
-        combined_array = np.column_stack((B.ravel(), K.ravel(), Q.ravel()))
-        # 镜片高度数据, 并计算平方差
-        results = self.formula_numpy(combined_array[:, 1], radius, combined_array[:, 2], combined_array[:, 0])
-        squared_diff = (results - average_k) ** 2
-
-        return {
-            "radius": radius,
-            "qbk": combined_array,
-            "squared_diff": squared_diff,
-            "qbk_len": len(combined_array),
-            "squared_diff_len": len(squared_diff),
-            "type": k_type
-        }
-
-    def main(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False):
+    def main(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False, top_n=None):
         """
         计算平K、Q、B"
         :param k_type: 0,平k；1,陡k
         :param pin_q_values: 平k 最佳q值
         :param pin_b_values: 陡k 最佳b值
+        :param top_n: 同时返回平均平方差最小的前 top_n 个组合（candidates），不传则不返回
         :return: 最佳数据，K,Q,B
         """
         best_data = []
 
-        degree_list = ['degree_list_k1', 'degree_list_k2', 'degree_list_k3', 'degree_list_k4']
-
-        for number, iaa in enumerate(degree_list):
-            finally_array = []
-            count: int = 0
-            for item in self.radius_angle():
-                if str(number) != "0":
-                    k_type = 1
-                    pin_q_values = best_data[0]['best_data']['Q']
-                    pin_b_values = best_data[0]['best_data']['B']
-
-                data = self.difference_square_deviation(item['radius'],
-                                                        item[iaa],
-                                                        k_type) if k_type == 0 else (
-                    self.difference_square_deviation(item['radius'],
-                                                     item[f'degree_list_k{number + 1}'],
-                                                     k_type,
-                                                     pin_q_values,
-                                                     pin_b_values))
-                count = data['qbk_len']
-                finally_array.append(data)
-
-            p_diff_list = []
-            for i in range(count):
-                diff_list = []
-                for item1 in finally_array:
-                    diff_list.append(
-                        {"diff": item1['squared_diff'][i], "qbk": item1['qbk'][i], "radius": item1['radius']})
-
-                diff_list = [item for item in diff_list if not np.isnan(item['diff'])]
-
-                if len(diff_list) != 0:
-                    mean_variance = sum(item3['diff'] for item3 in diff_list) / len(diff_list)
-                    p_diff_list.append({"qbk": diff_list[0]['qbk'], "mean": mean_variance})
-                else:
-                    pass
-
-            try:
-                means = np.array([item4["mean"] for item4 in p_diff_list])
-                min_index = np.argmin(means)
-                min_value = means[min_index]
-            except Exception as e:
+        # 四个方向的高度只采样一次，四轴共用
+        radius_values, profiles = self.meridian_profiles()
+
+        for number in range(profiles.shape[1]):
+            if number != 0:
+                # 其余三个方向沿用第一个方向的Q、B，只遍历k值
+                k_type = 1
+                pin_q_values = best_data[0]['best_data']['Q']
+                pin_b_values = best_data[0]['best_data']['B']
+
+            # 所有半径、所有组合按矩阵计算平方差，取平均平方差最小的组合
+            best_data_a = search_best_fit(self.formula_numpy, radius_values, profiles[:, number],
+                                          *self.kbq_axes(k_type, pin_q_values, pin_b_values),
+                                          mode=settings.KBQ_SEARCH_MODE, top_n=top_n)
+            if best_data_a is None:
                 return None
 
-            """
-            四轴定制和基础定制不同,需要根据每个角度选出相对应的KQB,因此不需要将所有的KQB放在同一个列表里边计算
-            每一个度数进行一次计算,最后出现4个KQB
-            最小方差的位置：{min_position}
-            最小方差的值：{min_number}
-            平方差最小的组合：{result[min_position]}
-            最佳数据：combined_array[min_position]
-                  平K:combined_array[min_position][1]
-                  Q:combined_array[min_position][2]
-                  B:combined_array[min_position][0]
-            """
-
-            best_data_a = {
-                "minimum_variance": min_value,
-                "best_data": {
-                    "K": p_diff_list[min_index]['qbk'][1],
-                    "Q": p_diff_list[min_index]['qbk'][2],
-                    "B": p_diff_list[min_index]['qbk'][0]
-                    # "B": 0
-                }
-            }
+            # 四轴定制和基础定制不同,需要根据每个角度选出相对应的KQB,因此不需要将所有的KQB放在同一个列表里边计算
+            # 每一个度数进行一次计算,最后出现4个KQB
             best_data.append(best_data_a)
 
         return best_data
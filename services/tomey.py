@@ -4,6 +4,8 @@ import pandas as pd
 from scipy.interpolate import interp1d, splev, splrep
 import xml.etree.ElementTree as ET
 from loguru import logger
+from services.topography_cache import topography_cache
+from services.kbq_search import B_SEARCH_VALUES, AnnulusIndex, build_grid, search_best_fit
 
 from django.conf import settings
 import django
@@ -19,15 +21,18 @@ logger.add(f'{BASE_DIR}/loguru.log', rotation="100 MB")
 
 
 class TomeyExtractor:
+    # .npy 文件头，用于区分二进制数据文件和旧的 CSV .dat 文件
+    NPY_MAGIC = b'\x93NUMPY'
+
     def __init__(self, rm_dat_path, ch_dat_path):
         # # 从Excel文件读取数据
         # self.RM_data = pd.read_excel(rm_excel_path).values
         # # print(self.RM_data)
         # self.CH_data = pd.read_excel(ch_excel_path).values
 
-        # 从.dat中读取数据
-        self.RM_data = self.parse_dat(rm_dat_path).values
-        self.CH_data = self.parse_dat(ch_dat_path).values
+        # 从.dat/.npy中读取数据（取可写副本，下面会原地替换无效值）
+        self.RM_data = self.parse_dat(rm_dat_path).to_numpy(dtype=np.float64, copy=True)
+        self.CH_data = self.parse_dat(ch_dat_path).to_numpy(dtype=np.float64, copy=True)
 
         # 将无效的特殊值替换为NaN（参照 Medmont 的处理方式）
         # 注意：角膜高度数据可能包含负值和零值，这些是有效数据，不应替换
@@ -61,15 +66,45 @@ class TomeyExtractor:
             print(f"错误：在数据后处理步骤中发生错误: {e}")
             self.angle_step = 0 # 确保即使出错也有默认值
         self.angle_columns = np.arange(0, self.CH_data.shape[1]) * self.angle_step  # 角度数组
+        # 每一环去掉 NaN 后的角度方向数据，首次在非整列角度上插值时计算
+        self._angular_rings = None
 
     def parse_dat(self, file_path):
+        """
+        解析 .dat 文件，获取数据并返回 DataFrame（与 read_dat 相同）。
+        解析结果按文件内容缓存，同一文件再次解析时直接取缓存。
+        参数:
+        - file_path: str，.dat/.npy 文件的路径
+        返回:
+        - df: pandas.DataFrame，包含解析后的数据
+        """
+        _, arrays = topography_cache.load(
+            file_path, "tomey.dat", lambda path: ({}, {"data": self.read_dat(path).to_numpy(dtype=np.float64)}))
+        return pd.DataFrame(arrays["data"])
+
+    def read_dat(self, file_path):
         """
         解析 .dat 文件，获取数据并返回 DataFrame。
+        支持两种格式：二进制 .npy（按文件头识别，直接加载）和旧的 CSV 文本 .dat。
         参数:
-        - file_path: str，.dat 文件的路径
+        - file_path: str，.dat/.npy 文件的路径
         返回:
         - df: pandas.DataFrame，包含解析后的数据
         """
+        # 二进制 .npy 文件直接加载，无需逐行解析文本
+        with open(file_path, 'rb') as file:
+            is_npy = file.read(len(self.NPY_MAGIC)) == self.NPY_MAGIC
+        if is_npy:
+            try:
+                data = np.load(file_path, allow_pickle=False)
+            except Exception as e:
+                logger.error(f"解析文件时发生错误: {e}")
+                raise ValueError(f"文件格式错误")
+            if data.ndim != 2:
+                logger.error(f"数据维度错误: {data.shape}")
+                raise ValueError(f"文件格式错误")
+            return pd.DataFrame(data.astype(np.float64, copy=False))
+
         # 读取 .dat 文件
         with open(file_path, 'r', encoding='utf-8') as file:
             lines = file.readlines()
@@ -109,6 +144,104 @@ class TomeyExtractor:
         返回:
         - height: float，对应的高度值，如果角度或半径无效则返回NaN
         """
+        return self.get_heights([R], theta)[0]
+
+    def get_heights(self, R_array, theta):
+        """
+        一次计算同一子午线（角度 theta）上多个半径对应的高度值，子午线数据只提取一次。
+
+        参数:
+        - R_array: 半径数组（或列表）
+        - theta: float，输入的角度（0-359）
+
+        返回:
+        - heights: numpy 数组，与 R_array 一一对应，超出数据范围的半径为NaN
+        """
+        R_array = np.asarray(R_array, dtype=np.float64)
+        RM_row, CH_row = self.meridian_profile(theta)
+
+        heights = np.full(R_array.shape, np.nan)
+        # 超出该子午线半径范围的为NaN，其余在半径方向上线性插值
+        in_range = ~((R_array < np.min(RM_row)) | (R_array > np.max(RM_row)))
+        if np.any(in_range):
+            heights[in_range] = interp1d(RM_row, CH_row, kind='linear', bounds_error=False,
+                                         fill_value=np.nan)(R_array[in_range])
+        return np.abs(heights)
+
+    def angular_rings(self):
+        """
+        预先计算每一环（同一半径序号、不同角度）去掉 NaN 后的角度方向数据，每个文件只计算一次。
+        各环有效点数不同，有效点按角度顺序靠左排列，补齐为二维数组（角度补 inf，数据补 NaN）。
+
+        返回:
+        - dict: angles/RM/CH 为 (环数, 最大有效点数) 数组，counts 为每环有效点数
+        """
+        if self._angular_rings is None:
+            valid = ~np.isnan(self.RM_data) & ~np.isnan(self.CH_data)
+            counts = valid.sum(axis=1)
+            width = max(int(counts.max()) if counts.size else 0, 1)
+            # 稳定排序把有效点移到每行前面，并保持原有的角度顺序
+            order = np.argsort(~valid, axis=1, kind='stable')[:, :width]
+            keep = np.take_along_axis(valid, order, axis=1)
+            angle_grid = np.broadcast_to(self.angle_columns, valid.shape)
+            self._angular_rings = {
+                'angles': np.where(keep, np.take_along_axis(angle_grid, order, axis=1), np.inf),
+                'RM': np.where(keep, np.take_along_axis(self.RM_data, order, axis=1), np.nan),
+                'CH': np.where(keep, np.take_along_axis(self.CH_data, order, axis=1), np.nan),
+                'counts': counts,
+            }
+        return self._angular_rings
+
+    def interp_angle(self, theta):
+        """
+        在角度方向上对每一环线性插值，得到角度 theta 方向上每一环的半径和高度。
+        与逐环 interp1d(kind='linear', bounds_error=False, fill_value=np.nan) 的计算方式相同，结果逐位一致。
+
+        参数:
+        - theta: float，输入的角度
+
+        返回:
+        - (RM_interp_angle, CH_interp_angle): 每一环的插值结果，无有效数据或超出角度范围的环为NaN
+        """
+        rings = self.angular_rings()
+        angles, counts = rings['angles'], rings['counts']
+        rows = np.arange(len(counts))
+
+        # 与 interp1d 相同：左侧插入位置，限制在 [1, 有效点数-1]
+        hi = np.minimum(np.maximum(np.sum(angles < theta, axis=1), 1), np.maximum(counts - 1, 0))
+        lo = np.maximum(hi - 1, 0)
+        x_lo, x_hi = angles[rows, lo], angles[rows, hi]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = theta - x_lo
+            results = []
+            for data in (rings['RM'], rings['CH']):
+                y_lo, y_hi = data[rows, lo], data[rows, hi]
+                slope = (y_hi - y_lo) / (x_hi - x_lo)
+                values = slope * fraction + y_lo
+                # 只有一个有效点时，只有角度正好相等才有值
+                values = np.where(counts == 1, y_lo, values)
+                results.append(values)
+
+        # 超出该环有效角度范围、没有有效点的环为NaN
+        first = angles[:, 0]
+        last = angles[rows, np.maximum(counts - 1, 0)]
+        outside = (counts == 0) | (theta < first) | (theta > last)
+        RM_interp_angle, CH_interp_angle = results
+        RM_interp_angle[outside] = np.nan
+        CH_interp_angle[outside] = np.nan
+        return RM_interp_angle, CH_interp_angle
+
+    def meridian_profile(self, theta):
+        """
+        提取角度 theta 方向子午线上的 (半径, 高度) 数据，已移除 NaN 值。
+        角度正好是某一列时直接取该列，否则在角度方向上逐环线性插值。
+
+        参数:
+        - theta: float，输入的角度（0-359）
+
+        返回:
+        - (RM_row, CH_row): 半径数组、高度数组
+        """
         # 检查角度范围
         if theta >= 360:
             theta = theta - 180
@@ -151,69 +284,30 @@ class TomeyExtractor:
         RM_row = RM_row[valid_idx]
         CH_row = CH_row[valid_idx]
 
-        height = np.nan
         # 如果最接近的角度不是精确匹配，则使用spline插值方法
         if angle_columns[nearest_index] != theta:
             # logger.debug('警告: 使用双线性插值方法来查找对应列')
-            # 在角度方向上进行插值
-            RM_interp_angle = np.zeros(self.RM_data.shape[0])
-            CH_interp_angle = np.zeros(self.CH_data.shape[0])
-
-            for i in range(self.RM_data.shape[0]):
-                # 获取当前半径对应的 RM 和 CH 数据
-                RM_temp = self.RM_data[i, :]
-                CH_temp = self.CH_data[i, :]
-
-                # 移除 NaN 值
-                valid_idx = ~np.isnan(RM_temp) & ~np.isnan(CH_temp)
-                RM_temp = RM_temp[valid_idx]
-                CH_temp = CH_temp[valid_idx]
-                angle_temp = angle_columns[valid_idx]
-
-                # 插值
-                if len(RM_temp) > 0 and len(CH_temp) > 0:
-                    RM_interp_angle[i] = interp1d(angle_temp, RM_temp, kind='linear', bounds_error=False,
-                                                  fill_value=np.nan)(theta)
-                    CH_interp_angle[i] = interp1d(angle_temp, CH_temp, kind='linear', bounds_error=False,
-                                                  fill_value=np.nan)(theta)
-                else:
-                    RM_interp_angle[i] = np.nan
-                    CH_interp_angle[i] = np.nan
+            # 在角度方向上进行插值（所有环一次向量化计算）
+            RM_interp_angle, CH_interp_angle = self.interp_angle(theta)
 
                 # 移除插值结果中的 NaN 值
             valid_idx = ~np.isnan(RM_interp_angle) & ~np.isnan(CH_interp_angle)
             RM_interp_angle = RM_interp_angle[valid_idx]
             CH_interp_angle = CH_interp_angle[valid_idx]
 
-            # 在半径方向上进行插值
             if len(RM_interp_angle) > 0 and len(CH_interp_angle) > 0:
-                if R < np.min(RM_interp_angle) or R > np.max(RM_interp_angle):
-                    # logger.info(f'{R:.1f}   | 超出范围')
-                    pass
-                else:
-                    height = interp1d(RM_interp_angle, CH_interp_angle, kind='linear', bounds_error=False,
-                                      fill_value=np.nan)(R)
-                    # logger.info(f'{R:.1f}   | {height:.4f}')
-            else:
-                raise ValueError('所请求的角度没有有效数据')
-        else:
-            if len(RM_row) > 0 and len(CH_row) > 0:
-                if R < np.min(RM_row) or R > np.max(RM_row):
-                    # logger.info(f'{R:.1f}   | 超出范围')
-                    pass
-                else:
-                    height = interp1d(RM_row, CH_row, kind='linear', bounds_error=False, fill_value=np.nan)(R)
-                    # logger.info(f'{R:.1f}   | {height:.4f}')
-            else:
-                raise ValueError('所请求的角度没有有效数据')
-
-        return abs(height)
+                return RM_interp_angle, CH_interp_angle
+            raise ValueError('所请求的角度没有有效数据')
+        if len(RM_row) > 0 and len(CH_row) > 0:
+            return RM_row, CH_row
+        raise ValueError('所请求的角度没有有效数据')
 
 
 class KBQ:
     """计算平K、Q、B"""
 
-    def __init__(self, radius: list = None, degree_list: list = None, rm_dat_path=None, ch_dat_path=None):
+    def __init__(self, radius: list = None, degree_list: list = None, rm_dat_path=None, ch_dat_path=None,
+                 extractor=None):
         self.rm_dat_path = rm_dat_path
         self.ch_dat_path = ch_dat_path
 
@@ -224,27 +318,56 @@ class KBQ:
         self.radius_list = np.arange(self.radius[0], self.radius[1] + 0.1, 0.1).tolist()
         self.rounded_radius_list = [round(num, 1) for num in self.radius_list]
 
+        # 只创建一次 Extractor（只读取、解析一次 .dat 文件；FittingSession 传入已加载的 extractor 时直接共用）
+        self.extractor = extractor if extractor is not None else TomeyExtractor(rm_dat_path=self.rm_dat_path,
+                                                                                ch_dat_path=self.ch_dat_path)
+        # radius_angle 的结果，同一实例只采样一次
+        self._data_list = None
+
     def radius_angle(self):
         """
         通过半径和平k方向高度、陡K方向高度,生成一个大list
         :param self:
-        :return:
+        :return: 同一实例只采样一次，之后直接返回缓存的结果
         """
+        if self._data_list is not None:
+            return self._data_list
+        # 每条子午线一次算出所有半径的高度
+        heights_k1 = self.extractor.get_heights(self.rounded_radius_list, self.degree_list[0])
+        heights_k2 = self.extractor.get_heights(self.rounded_radius_list, self.degree_list[1])
 
         data_list = []
-        for item in self.rounded_radius_list:
+        for index, item in enumerate(self.rounded_radius_list):
             data_dict = {'radius': float(item),
-                         'degree_list_k1': TomeyExtractor(rm_dat_path=self.rm_dat_path, ch_dat_path=self.ch_dat_path).get_height(
-                             theta=self.degree_list[0],
-                             R=float(item)),
-                         'degree_list_k2': TomeyExtractor(rm_dat_path=self.rm_dat_path, ch_dat_path=self.ch_dat_path).get_height(
-                             theta=self.degree_list[1],
-                             R=float(item))}
+                         'degree_list_k1': heights_k1[index],
+                         'degree_list_k2': heights_k2[index]}
             data_list.append(data_dict)
 
         logger.info(data_list)
+        self._data_list = data_list
         return data_list
 
+    def fit_targets(self):
+        """
+        拟合用的半径和角膜高度
+        :return: (半径列表, 每个半径上平k方向、陡k方向高度的平均数)
+        """
+        data_list = self.radius_angle()
+        radius_values = [item['radius'] for item in data_list]
+        target_values = [np.mean([item['degree_list_k1'], item['degree_list_k2']]) for item in data_list]
+        return radius_values, target_values
+
+    def annulus_index(self, special_type=False):
+        """
+        本实例半径范围内任意连续半径段的快速拟合索引，用于试算不同直径
+        候选组合为平k的组合；陡k固定Q、B的组合都包含在其中，用 AnnulusIndex.matching 选出
+        :param special_type: 特殊情况，平k时Q固定为-0.25
+        :return: AnnulusIndex
+        """
+        radius_values, target_values = self.fit_targets()
+        return AnnulusIndex(self.formula_numpy, radius_values, target_values,
+                            self.kbq_grid(0, special_type=special_type))
+
     @staticmethod
     def formula_numpy(_k, _x, _q, _b):
         """
@@ -264,165 +387,49 @@ class KBQ:
         denominator = 1 + np.sqrt(1 - (1 + _q) * _c ** 2 * _x ** 2)
         return numerator / denominator + _b / 1000
 
-    def difference_square_deviation(self, radius, degree_01, degree_02, k_type=None, pin_q_values=None,
-                                    pin_b_values=None):
+    def kbq_axes(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False):
         """
-        根据三个值，算出一个方差list; 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
-        :param radius:
-        :param degree_01:
-        :param degree_02:
+        候选组合的取值，B 值是否参与搜索由 settings.KBQ_B_SEARCH 决定
         :param k_type: 0,平k；1,陡k
-        :param pin_q_values: 平k 最佳q值
-        :param pin_b_values: 陡k 最佳b值
-        :return:
+        :param pin_q_values: 平k 最佳q值（陡k时Q固定，只遍历k值）
+        :param pin_b_values: 平k 最佳b值（开启B值搜索时陡k的B固定）
+        :param special_type: 特殊情况，平k时Q固定为-0.25
+        :return: (B_values, K_values, Q_values)
         """
-        # 计算平均数
-        average_k = np.mean([degree_01, degree_02])
-        # B_values = list(np.arange(-50, 55, 5)) if k_type == 0 else pin_b_values
-        B_values = [0]
         K_values = list(np.arange(35, 50.25, 0.25))
-        Q_values = [0, -0.25, -0.5, -0.75, -1] if k_type == 0 else pin_q_values
-
-        # 建立三维坐标
-        B, K, Q = np.meshgrid(B_values, K_values, Q_values, indexing='ij')
-        # 将三维坐标合成一个二维数组
-        combined_array = np.column_stack((B.ravel(), K.ravel(), Q.ravel()))
-        # 镜片高度数据, 并计算平方差
-        results = self.formula_numpy(combined_array[:, 1], radius, combined_array[:, 2], combined_array[:, 0])
-        # np.set_printoptions(threshold=np.inf)
-        # aaa = np.array(results)
-        # logger.info(f"高度数据：{aaa}")
-        squared_diff = (results - average_k) ** 2
-
-        return {
-            "radius": radius,
-            "qbk": combined_array,
-            "squared_diff": squared_diff,
-            "qbk_len": len(combined_array),
-            "squared_diff_len": len(squared_diff),
-            "type": k_type
-        }
-
-    def difference_square_deviation_special(self, radius, degree_01, degree_02, k_type=None, pin_q_values=None,
-                                            pin_b_values=None):
+        if special_type:
+            B_values = list(B_SEARCH_VALUES) if settings.KBQ_B_SEARCH else [0]
+            Q_values = [-0.25]
+        else:
+            B_values = [0]
+            if settings.KBQ_B_SEARCH:
+                B_values = list(B_SEARCH_VALUES) if k_type == 0 else ([0] if pin_b_values is None else pin_b_values)
+            Q_values = [0, -0.25, -0.5, -0.75, -1] if k_type == 0 else pin_q_values
+        return B_values, K_values, Q_values
+
+    def kbq_grid(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False):
         """
-        根据三个值，算出一个方差list; 计算陡K，将平k计算的Q和B给定，只遍历k值，寻找最佳k值
-        :param radius:
-        :param degree_01:
-        :param degree_02:
-        :param k_type: 0,平k；1,陡k
-        :param pin_q_values: 平k 最佳q值
-        :param pin_b_values: 陡k 最佳b值
-        :return:
+        候选组合 (B, K, Q)
+        :return: 二维数组，每行一个组合 [B, K, Q]
         """
-        # 计算平均数
-        average_k = np.mean([degree_01, degree_02])
-        # B_values = list(np.arange(-50, 55, 5))
-        B_values = [0]
-        K_values = list(np.arange(35, 50.25, 0.25))
-        Q_values = [-0.25]
-
-        # 建立三维坐标
-        B, K, Q = np.meshgrid(B_values, K_values, Q_values, indexing='ij')
-        # 将三维坐标合成一个二维数组
-        combined_array = np.column_stack((B.ravel(), K.ravel(), Q.ravel()))
-        # 镜片高度数据, 并计算平方差
-        results = self.formula_numpy(combined_array[:, 1], radius, combined_array[:, 2], combined_array[:, 0])
-        # np.set_printoptions(threshold=np.inf)
-        # aaa = np.array(results)
-        # logger.info(f"高度数据：{aaa}")
-        squared_diff = (results - average_k) ** 2
-
-        return {
-            "radius": radius,
-            "qbk": combined_array,
-            "squared_diff": squared_diff,
-            "qbk_len": len(combined_array),
-            "squared_diff_len": len(squared_diff),
-            "type": k_type
-        }
-
-    def main(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False):
+        return build_grid(*self.kbq_axes(k_type, pin_q_values, pin_b_values, special_type))
+
+    def main(self, k_type=None, pin_q_values=None, pin_b_values=None, special_type=False, top_n=None):
         """
         计算平K、Q、B"
         :param k_type: 0,平k；1,陡k
         :param pin_q_values: 平k 最佳q值
         :param pin_b_values: 陡k 最佳b值
+        :param top_n: 同时返回平均平方差最小的前 top_n 个组合（candidates），不传则不返回
         :return: 最佳数据，K,Q,B
         """
-        finally_array = []
-        count: int = 0
-        for item in self.radius_angle():
-            # 如果特殊情况下，走special方法
-            if special_type:
-                data = self.difference_square_deviation_special(item['radius'],
-                                                                item['degree_list_k1'],
-                                                                item['degree_list_k2'], k_type) \
-                    if k_type == 0 else self.difference_square_deviation(item['radius'],
-                                                                         item['degree_list_k1'],
-                                                                         item['degree_list_k2'],
-                                                                         k_type,
-                                                                         pin_q_values,
-                                                                         pin_b_values)
-            else:
-                data = self.difference_square_deviation(item['radius'],
-                                                        item['degree_list_k1'],
-                                                        item['degree_list_k2'], k_type) \
-                    if k_type == 0 else self.difference_square_deviation(item['radius'],
-                                                                         item['degree_list_k1'],
-                                                                         item['degree_list_k2'],
-                                                                         k_type,
-                                                                         pin_q_values,
-                                                                         pin_b_values)
-            count = data['qbk_len']
-            finally_array.append(data)
-
-        p_diff_list = []
-        for i in range(count):
-            diff_list = []
-            for item1 in finally_array:
-                diff_list.append({"diff": item1['squared_diff'][i], "qbk": item1['qbk'][i], "radius": item1['radius']})
-
-            diff_list = [item for item in diff_list if not np.isnan(item['diff'])]
-            if len(diff_list) != 0:
-                mean_variance = sum(item3['diff'] for item3 in diff_list) / len(diff_list)
-                p_diff_list.append({"qbk": diff_list[0]['qbk'], "mean": mean_variance})
-            else:
-                pass
-
-        try:
-            means = np.array([item4["mean"] for item4 in p_diff_list])
-            min_index = np.argmin(means)
-            min_value = means[min_index]
-        except Exception as e:
-            return None
-
-        # logger.success(f"最小值的位置是: {min_index}")
-        # logger.success(f"最小值的值是: {min_value}")
-        # logger.success(f"最小值的组合是: {p_diff_list[min_index]}")
-        # logger.success(f"最佳K值：{p_diff_list[min_index]['qbk'][1]}")
-
-        """
-        最小方差的位置：{min_position}
-        最小方差的值：{min_number}
-        平方差最小的组合：{result[min_position]}
-        最佳数据：combined_array[min_position]
-              平K:combined_array[min_position][1]
-              Q:combined_array[min_position][2]
-              B:combined_array[min_position][0]
-        """
-
-        best_data = {
-            "minimum_variance": min_value,
-            "best_data": {
-                "K": p_diff_list[min_index]['qbk'][1],
-                "Q": p_diff_list[min_index]['qbk'][2],
-                "B": p_diff_list[min_index]['qbk'][0]
-                # "B": 0
-            }
-        }
+        radius_values, target_values = self.fit_targets()
 
-        return best_data
+        # 如果特殊情况下，平k走special的候选组合
+        axes = self.kbq_axes(k_type, pin_q_values, pin_b_values, special_type=special_type and k_type == 0)
+        # 所有半径、所有组合按矩阵计算平方差，取平均平方差最小的组合
+        return search_best_fit(self.formula_numpy, radius_values, target_values, *axes,
+                               mode=settings.KBQ_SEARCH_MODE, top_n=top_n)
 
 
 if __name__ == '__main__':
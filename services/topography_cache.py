@@ -0,0 +1,266 @@
+"""
+角膜地形图解析结果缓存（进程内共享）
+
+同一个上传的地形图文件在一次定制、每次调整参数的二次计算和每张地形图里都要重新解析。
+TopographyCache 按文件内容的 SHA-256 缓存解析结果，分两级：
+内存 LRU（按占用字节数淘汰）和 MEDIA_ROOT/topography_cache 下的 npz 文件（按总大小淘汰最久未用的）。
+文件被覆盖后内容哈希随之改变，旧结果不会再被命中；同一路径、大小、修改时间的文件不重复计算哈希。
+
+解析结果为 (元数据, 数组)：元数据是可 JSON 序列化的字典，数组是 {名称: numpy.ndarray}。
+每次取出的都是副本，调用方可以原地修改（如把无效值替换为 NaN），不影响缓存。
+不同解析器用不同的 kind 区分，解析结果的格式变化时提高 CACHE_VERSION，旧的缓存文件不再使用。
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from loguru import logger
+
+# 解析结果格式的版本
+CACHE_VERSION = 1
+# npz 中保存元数据的键
+META_KEY = "__meta__"
+# 缓存的文件哈希个数（路径、大小、修改时间 -> 哈希）
+DIGEST_CACHE_SIZE = 1024
+
+
+class TopographyCache:
+    """
+    地形图解析结果的两级缓存，键为 (解析器类型, 文件内容哈希)
+    """
+
+    def __init__(self, cache_dir, max_memory_bytes, max_disk_bytes):
+        """
+        :param cache_dir: npz 缓存目录
+        :param max_memory_bytes: 内存缓存的最大字节数，0 为不使用内存缓存
+        :param max_disk_bytes: 磁盘缓存的最大字节数，0 为不使用磁盘缓存
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        # (kind, digest) -> (元数据 JSON, 数组, 字节数)
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        # (绝对路径, 文件大小, 修改时间ns) -> 内容哈希
+        self.digests = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    def file_digest(self, path):
+        """
+        文件内容的 SHA-256，路径、大小、修改时间不变时直接取上次的结果
+        :param path: 文件路径
+        :return: 十六进制哈希
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            digest = self.digests.get(key)
+            if digest is not None:
+                self.digests.move_to_end(key)
+                return digest
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        with self.lock:
+            self.digests[key] = digest
+            while len(self.digests) > DIGEST_CACHE_SIZE:
+                self.digests.popitem(last=False)
+        return digest
+
+    def load(self, path, kind, parse):
+        """
+        取文件的解析结果：先查内存，再查磁盘，都没有时调用 parse 解析并写入两级缓存
+        :param path: 地形图文件路径
+        :param kind: 解析器类型，不同解析器（结果格式不同）的缓存互不影响
+        :param parse: 解析函数 parse(path) -> (元数据, 数组)；解析出错时异常直接抛出，不缓存
+        :return: (元数据, 数组) 的副本
+        """
+        key = (kind, self.file_digest(path))
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.copy_entry(entry)
+
+        entry = self.read_disk(key)
+        if entry is not None:
+            with self.lock:
+                self.disk_hits += 1
+                self.put_memory(key, entry)
+            return self.copy_entry(entry)
+
+        meta, arrays = parse(path)
+        entry = self.make_entry(meta, arrays)
+        with self.lock:
+            self.misses += 1
+            self.put_memory(key, entry)
+        self.write_disk(key, entry)
+        return self.copy_entry(entry)
+
+    @staticmethod
+    def make_entry(meta, arrays):
+        """缓存条目：(元数据 JSON, 数组的私有副本, 字节数)"""
+        meta_json = json.dumps(meta, ensure_ascii=False)
+        arrays = {name: np.array(value) for name, value in arrays.items()}
+        if META_KEY in arrays:
+            raise ValueError(f"数组名不能为 {META_KEY}")
+        size = len(meta_json.encode('utf-8')) + sum(value.nbytes for value in arrays.values())
+        return meta_json, arrays, size
+
+    @staticmethod
+    def copy_entry(entry):
+        meta_json, arrays, _ = entry
+        return json.loads(meta_json), {name: value.copy() for name, value in arrays.items()}
+
+    def put_memory(self, key, entry):
+        """写入内存缓存，超出容量时淘汰最久未用的（调用方持有锁）"""
+        if entry[2] > self.max_memory_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= old[2]
+        self.entries[key] = entry
+        self.memory_bytes += entry[2]
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory_bytes -= evicted[2]
+            self.evictions += 1
+
+    def disk_path(self, key):
+        kind, digest = key
+        return os.path.join(self.cache_dir, f"v{CACHE_VERSION}", kind, f"{digest}.npz")
+
+    def read_disk(self, key):
+        """读取磁盘缓存，命中时更新修改时间（用作最近使用时间）；文件损坏时删除并视为未命中"""
+        if not self.max_disk_bytes:
+            return None
+        path = self.disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            meta_json = arrays.pop(META_KEY).tobytes().decode('utf-8')
+            os.utime(path)
+        except Exception as e:
+            logger.warning(f"地形图缓存文件无法读取，已删除: {path}, {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        size = len(meta_json.encode('utf-8')) + sum(value.nbytes for value in arrays.values())
+        return meta_json, arrays, size
+
+    def write_disk(self, key, entry):
+        """写入磁盘缓存（先写临时文件再改名），写入失败只记录日志"""
+        if not self.max_disk_bytes or entry[2] > self.max_disk_bytes:
+            return
+        meta_json, arrays, _ = entry
+        path = self.disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays, **{META_KEY: np.frombuffer(meta_json.encode('utf-8'), dtype=np.uint8)})
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"地形图缓存写入失败: {path}, {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self.evict_disk()
+
+    def disk_files(self):
+        """磁盘缓存的所有文件 [(修改时间, 大小, 路径)]"""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.npz'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime_ns, st.st_size, path))
+        return files
+
+    def evict_disk(self):
+        """磁盘缓存超出总大小时，按修改时间从旧到新删除"""
+        files = self.disk_files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self.lock:
+                self.disk_evictions += 1
+
+    def clear(self, disk=False):
+        """
+        清空内存缓存和统计
+        :param disk: 同时删除磁盘缓存文件
+        """
+        with self.lock:
+            self.entries.clear()
+            self.memory_bytes = 0
+            self.digests.clear()
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.disk_evictions = 0
+        if disk:
+            for _, _, path in self.disk_files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        """
+        命中统计: hits 内存命中，disk_hits 磁盘命中，misses 重新解析，
+        evictions/disk_evictions 淘汰次数，entries/memory_bytes 内存缓存的条目数和字节数
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_evictions': self.disk_evictions,
+                'entries': len(self.entries),
+                'memory_bytes': self.memory_bytes,
+            }
+
+
+# 进程内共享的地形图缓存（首次使用时按 settings 创建，导入本模块时 Django 可能尚未初始化）
+topography_cache = SimpleLazyObject(lambda: TopographyCache(
+    settings.TOPOGRAPHY_CACHE_DIR,
+    settings.TOPOGRAPHY_CACHE_MEMORY_BYTES,
+    settings.TOPOGRAPHY_CACHE_DISK_BYTES,
+))
@@ -0,0 +1,107 @@
+"""
+Medmont 地形图生成流水线
+
+高度图、切向曲率图、轴向曲率图、泪膜质量图各自只生成一次，图片路径和原始数据（raw_plotly_data）
+取自同一次生成的结果；多张图在工作进程中并行生成（插值和绘制框架都要占用 GIL，用线程无法并行）。
+进程池在首次使用时创建并在进程内复用，使用 spawn 方式启动，工作进程启动时初始化 Django；
+进程池不可用时改为在当前进程中依次生成。
+"""
+import importlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from loguru import logger
+
+# 地形图名称 -> 生成函数 (模块, 函数名)，工作进程中按名称导入
+MAP_RENDERERS = {
+    "height": ("services.dixingtu_med_height", "parse_topographic_map_data"),
+    "tangential": ("services.dixingt_med_qiexiang", "parse_qiexiang_data"),
+    "axial": ("services.dixingt_med_zhouxiang", "parse_zhouxiang_data"),
+    "tear_film_quality": ("services.dixingt_med_leimozhiliang", "parse_leiomozhilaing_data"),
+}
+
+
+def init_worker():
+    """工作进程初始化：生成函数会用到 Django 的 settings 和 models"""
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "eyehospital.settings")
+    import django
+    django.setup()
+
+
+def render_map(name, file_path):
+    """
+    生成一张地形图（供进程池调用，必须是模块级函数才能被 pickle）
+    :param name: 地形图名称，MAP_RENDERERS 的键
+    :param file_path: .mxf 文件路径
+    :return: 生成函数的返回值 {"save_dir_path": ..., 可能还有 "raw_plotly_data": ...}
+    """
+    module_name, func_name = MAP_RENDERERS[name]
+    return getattr(importlib.import_module(module_name), func_name)(file_path)
+
+
+class MapPipeline:
+    """并行生成地形图"""
+
+    def __init__(self, workers):
+        """
+        :param workers: 工作进程数，不大于 1 时在当前进程中依次生成
+        """
+        self.workers = workers
+        self._executor = None
+        self.lock = threading.Lock()
+
+    def executor(self):
+        """进程池，首次使用时创建"""
+        with self.lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=init_worker)
+            return self._executor
+
+    def shutdown(self):
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def generate(self, file_path, names=None):
+        """
+        生成地形图，每张图只生成一次
+        :param file_path: .mxf 文件路径
+        :param names: 地形图名称列表，默认全部
+        :return: {名称: 生成函数的返回值}；生成出错时抛出该图的异常
+        """
+        names = list(MAP_RENDERERS) if names is None else list(dict.fromkeys(names))
+        unknown = [name for name in names if name not in MAP_RENDERERS]
+        if unknown:
+            raise ValueError(f"不支持的地形图: {', '.join(unknown)}")
+
+        if self.workers <= 1 or len(names) <= 1:
+            return {name: render_map(name, file_path) for name in names}
+        try:
+            futures = {name: self.executor().submit(render_map, name, file_path) for name in names}
+            return {name: future.result() for name, future in futures.items()}
+        except BrokenProcessPool as e:
+            # 工作进程异常退出（如内存不足被杀），重建进程池留到下次，本次依次生成
+            logger.warning(f"地形图进程池不可用，改为依次生成: {e}")
+            self.shutdown()
+            return {name: render_map(name, file_path) for name in names}
+
+
+# 进程内共享的地形图流水线
+map_pipeline = SimpleLazyObject(lambda: MapPipeline(settings.TOPOGRAPHY_MAP_WORKERS))
+
+
+def generate_maps(file_path, names=None):
+    """
+    生成地形图，见 MapPipeline.generate
+    :param file_path: .mxf 文件路径
+    :param names: 地形图名称列表（height、tangential、axial、tear_film_quality），默认全部
+    """
+    return map_pipeline.generate(file_path, names)
@@ -52,6 +52,7 @@ class TearFilmHeightCalculator:
                  ac_arc_k2=None,
                  ac_arc_k3=None,
                  ac_arc_k4=None,
+                 session=None,
                  ):
 
         """
@@ -70,6 +71,7 @@ class TearFilmHeightCalculator:
             :param al_type: 算法类型
             :param degree_list: 角度范围
             :param file_path: 角膜文件地址
+            :param session: FittingSession，传入时角膜高度直接用会话中已加载的文件
             :return: 一个字典，包含x坐标和对应的 tear film 高度
         """
         self.map_lens_type = {
@@ -111,6 +113,12 @@ class TearFilmHeightCalculator:
         # 角膜文件地址 tomey
         self.rm_dat_path = rm_file
         self.ch_dat_path = ch_file
+        # 定制计算会话（同一请求内共用已加载的地形图文件）
+        self.session = session
+        # (镜片类型, 段数) -> 关系表记录
+        self._relationship_rows = {}
+        # (镜片类型, 方向数) -> 各方向的镜片高度
+        self._lens_heights = {}
 
         # logger.info(f"bc_interval: {self.bc_interval}")
         # logger.info(f"rc_interval: {self.rc_interval}")
@@ -118,9 +126,17 @@ class TearFilmHeightCalculator:
         # logger.info(f"pc_interval: {self.pc_interval}")
 
     # 以下为泪膜图生成用法
-    def calculate_tear_film_height(self, ac_arc_k=None):
+    def relationship_rows(self, lens_type, belongs_level):
+        """ 镜片类型、段数对应的关系表记录，同一计算器内只查询一次 """
+        key = (lens_type, belongs_level)
+        if key not in self._relationship_rows:
+            self._relationship_rows[key] = list(
+                RelationshipTable.objects.filter(lens_type=lens_type, belongs_level=belongs_level))
+        return self._relationship_rows[key]
+
+    def calculate_tear_film_height(self, ac_arc_k=None, lens_type=None):
         # 参数设置
-        rel_data = RelationshipTable.objects.filter(lens_type=self.len_type, belongs_level=1)
+        rel_data = self.relationship_rows(self.len_type if lens_type is None else lens_type, 1)
         closest_value = min(rel_data, key=lambda item: abs(
             float(item.base_arc_curvature_radius) - self.base_arc_curvature_radius))
         # logger.info(f"第一段最接近的值：{closest_value.base_arc_curvature_radius}")
@@ -263,14 +279,14 @@ class TearFilmHeightCalculator:
         K_AC = self.ac_arc_k1 if ac_arc_k is None else ac_arc_k  # 计算的平K结果 (软件上的AC弧K值）      计算的陡K结果=计算的平K结果(软件上的AC弧K值）+软件上环曲档位对应的环曲量
         B = self.B  # B+5=反转弧矢高
 
-        rel_data = RelationshipTable.objects.filter(lens_type=lens_type_for_calc, belongs_level=1)
+        rel_data = self.relationship_rows(lens_type_for_calc, 1)
         closest_value = min(rel_data, key=lambda item: abs(
             float(item.base_arc_curvature_radius) - self.base_arc_curvature_radius))
         # logger.info(f"第一段最接近的值：{closest_value.base_arc_curvature_radius}")
         R_BC1 = float(
             closest_value.base_arc_curvature_radius)  # 为第一段基弧曲率半径，R_BC(计算)=337.5 / (K_BC - 4 - 0.75)  K_BC为角膜地形图平K；-4为球镜度 0.75为固定值,再到表中找到最接近R_BC(计算)的基弧曲率半径，则为R_BC1，选A、PRO系列才有两段，S系列只有一段，Q恒定为0.23
 
-        rel_data = RelationshipTable.objects.filter(lens_type=lens_type_for_calc, belongs_level=2)
+        rel_data = self.relationship_rows(lens_type_for_calc, 2)
         closest_value_01 = min(rel_data, key=lambda item: abs(
             float(item.base_arc_curvature_radius) - self.base_arc_curvature_radius))
         # logger.info(f"第二段最接近的值：{closest_value_01.base_arc_curvature_radius}")
@@ -412,6 +428,8 @@ class TearFilmHeightCalculator:
         # logger.info(f"al_type: {al_type}")
         # logger.info(f"al_type: {type(al_type)}")
         al_type = int(al_type)
+        if self.session is not None and self.session.al_type == al_type:
+            return self.session.cornea_profile(radius, degree_list)
         if al_type == 0:
             kbq_list = m_kbq(radius=radius, degree_list=degree_list, filter_data=filter_data)
         elif al_type == 1:
@@ -492,7 +510,11 @@ class TearFilmHeightCalculator:
 
         return y_values
 
-    def main_calculate(self):
+    def cornea_heights(self):
+        """
+        各方向的角膜高度（补缺值后乘以1000），与镜片类型无关，比较多种镜片类型时只计算一次
+        :return: 普通定制 2 个方向、四轴定制 4 个方向的高度列表
+        """
         cornea_height = self.wavelet_denoise(
             al_type=self.al_type,
             radius=[self.bc_interval[0], self.pc_interval[1] - 0.1],
@@ -504,174 +526,119 @@ class TearFilmHeightCalculator:
         data_list = cornea_height["data_list"]
         # logger.info(f"角膜高度:{data_list}")
 
-        # 遍历cornea_height["data_list"]中的每个元素
-        radius_list01 = list()
-        radius_list02 = list()
-        radius_list03 = list()
-        radius_list04 = list()
-
-        # 普通定制
+        # 普通定制两个方向都用平k补缺值，四轴定制每个方向用各自的k值
         if len(data_list[0]) == 3:
-            if self.len_type == "PRO" or self.len_type == "A":
-                lens_height = self.calculate_tear_film_height_pro_A()
-            else:
+            keys = ["degree_list_k1", "degree_list_k2"]
+            ac_k_list = [None, None]
+        else:
+            keys = ["degree_list_k1", "degree_list_k2", "degree_list_k3", "degree_list_k4"]
+            ac_k_list = [self.ac_arc_k1, self.ac_arc_k2, self.ac_arc_k3, self.ac_arc_k4]
 
-                lens_height = self.calculate_tear_film_height()
+        heights = []
+        for key, ac_k in zip(keys, ac_k_list):
+            radius_list = [item.get(key) * (-1) for item in data_list]
+            # 补缺值
+            radius_list = self.replace_nan_values(radius_list, ac_k=ac_k)
+            heights.append([float(i) * 1000 for i in radius_list])
+        return heights
 
-            # lens_height = self.calculate_tear_film_height()
+    def lens_heights(self, lens_type, count):
+        """
+        各方向的镜片高度；s 系列与 A、PRO 系列的计算方法不同，A 与 PRO 按光学区直径查同一张表
+        :param lens_type: 镜片类型，'s' 或 'A' 或 'PRO'
+        :param count: 方向数，2 为普通定制（两个方向共用平k的镜片高度），4 为四轴定制
+        :return: 各方向 calculate_tear_film_height(_pro_A) 的结果，同一计算器内相同的计算只做一次
+        """
+        if lens_type == "PRO" or lens_type == "A":
+            key = ("A/PRO", count)
+            calculate, kwargs = self.calculate_tear_film_height_pro_A, {}
+        else:
+            key = (lens_type, count)
+            calculate, kwargs = self.calculate_tear_film_height, {"lens_type": lens_type}
 
-            for item in data_list:
-                cornea_height_item_0 = item.get("degree_list_k1") * (-1)
-                cornea_height_item_1 = item.get("degree_list_k2") * (-1)
-                radius_list01.append(cornea_height_item_0)
-                radius_list02.append(cornea_height_item_1)
+        if key not in self._lens_heights:
+            if count == 2:
+                lens_height = calculate(**kwargs)
+                self._lens_heights[key] = [lens_height, lens_height]
+            else:
+                self._lens_heights[key] = [calculate(ac_arc_k=ac_k, **kwargs) for ac_k in
+                                           (self.ac_arc_k1, self.ac_arc_k2, self.ac_arc_k3, self.ac_arc_k4)]
+        return self._lens_heights[key]
+
+    def leading_zero_count(self):
+        """ 中心处置零的点数：seour定制前两个值替换成0，tomey定制前三个值替换成0 """
+        if self.al_type == 2 or self.al_type == 3:
+            return 2
+        if self.al_type == 4 or self.al_type == 5:
+            return 3
+        return 0
+
+    def tear_film(self, lens_type, cornea_heights):
+        """
+        泪膜高度 = 镜片高度 - 角膜高度
+        :param lens_type: 镜片类型
+        :param cornea_heights: cornea_heights 的结果（不会被修改）
+        :return: 与 main_calculate 相同
+        """
+        count = len(cornea_heights)
+        lens_heights = self.lens_heights(lens_type, count)
+        radius_lists = [list(heights) for heights in cornea_heights]
+        radius_diffs = [lens_height['y_values'] - np.array(radius_list)
+                        for lens_height, radius_list in zip(lens_heights, radius_lists)]
+
+        zero_count = self.leading_zero_count()
+        for radius_list, radius_diff in zip(radius_lists, radius_diffs):
+            radius_list[:zero_count] = [0] * zero_count
+            radius_diff[:zero_count] = 0
+
+        result = {"x": lens_heights[0]['x_values']}
+        for number, radius_diff in enumerate(radius_diffs, start=1):
+            result[f"y{number}"] = radius_diff.tolist()
+        if count == 2:
+            result["lens_height"] = lens_heights[0]['y_values'].tolist()
+        else:
+            for number, lens_height in enumerate(lens_heights, start=1):
+                result[f"lens_height_0{number}"] = lens_height['y_values'].tolist()
+        for number, radius_list in enumerate(radius_lists, start=1):
+            result[f"radius_list0{number}"] = radius_list
+        result["min_base_arc_curvature_radius"] = lens_heights[0]["min_base_arc_curvature_radius"]
+        return result
 
-            # 补缺值
-            radius_list01 = self.replace_nan_values(radius_list01)
-            radius_list02 = self.replace_nan_values(radius_list02)
-            # logger.info(f"radius_list01_nan:{radius_list01}")
-            # logger.info(f"radius_list02_nan:{radius_list02}")
-            # logger.info(f"radius_list01_nan:{type(radius_list01)}")
-            # logger.info(f"radius_list02_nan:{type(radius_list02)}")
-
-            radius_list01_1000 = [float(i) * 1000 for i in radius_list01]
-            radius_list02_1000 = [float(i) * 1000 for i in radius_list02]
-
-            # logger.info(f"len_height:{lens_height['y_values']}")
-            # logger.info(f"radius_list01:{radius_list01_1000}")
-            # logger.info(f"radius_list02:{radius_list02_1000}")
-
-            radius_diff01 = lens_height['y_values'] - np.array(radius_list01_1000)
-            radius_diff02 = lens_height['y_values'] - np.array(radius_list02_1000)
-            # 如果是seour定制,将radius_diff01的前两个值替换成0
-            if self.al_type == 2 or self.al_type == 3:
-                radius_list01_1000[:2] = [0, 0]
-                radius_list02_1000[:2] = [0, 0]
-
-                radius_diff01[:2] = 0
-                radius_diff02[:2] = 0
-            elif self.al_type == 4 or self.al_type == 5:
-                radius_list01_1000[:3] = [0, 0, 0]
-                radius_list02_1000[:3] = [0, 0, 0]
-
-                radius_diff01[:3] = 0
-                radius_diff02[:3] = 0
-
-            # logger.error(radius_list01)
-            # logger.error(radius_list02)
-
-            # logger.error(f"角度{self.degree_list[0]}差值：{radius_diff01}")
-            # logger.error(f"角度{self.degree_list[1]}差值：{radius_diff02}")
+    def main_calculate(self):
+        return self.tear_film(self.len_type, self.cornea_heights())
 
-            return {
-                "x": lens_height['x_values'],
-                "y1": radius_diff01.tolist(),
-                "y2": radius_diff02.tolist(),
-                "lens_height": lens_height['y_values'].tolist(),
-                "radius_list01": radius_list01_1000,
-                "radius_list02": radius_list02_1000,
-                "min_base_arc_curvature_radius": lens_height["min_base_arc_curvature_radius"],
+    def compare_lens_types(self, lens_types=None):
+        """
+        同一角膜高度下比较多种镜片类型，角膜高度只计算一次
+        :param lens_types: 镜片类型列表，默认 s、A、PRO
+        :return: 镜片类型 -> {"tear_film": 与 main_calculate 相同, "summary": 泪膜厚度统计(μm)}
+        """
+        cornea_heights = self.cornea_heights()
+        comparison = {}
+        for lens_type in (lens_types or list(self.map_lens_type)):
+            tear_film = self.tear_film(lens_type, cornea_heights)
+            comparison[lens_type] = {
+                "tear_film": tear_film,
+                "summary": self.tear_film_summary(tear_film),
             }
+        return comparison
 
-        # 四轴定制
-        elif len(data_list[0]) == 5:
-            if self.len_type == "PRO" or self.len_type == "A":
-                lens_height_01 = self.calculate_tear_film_height_pro_A(ac_arc_k=self.ac_arc_k1)
-                lens_height_02 = self.calculate_tear_film_height_pro_A(ac_arc_k=self.ac_arc_k2)
-                lens_height_03 = self.calculate_tear_film_height_pro_A(ac_arc_k=self.ac_arc_k3)
-                lens_height_04 = self.calculate_tear_film_height_pro_A(ac_arc_k=self.ac_arc_k4)
-            else:
-                lens_height_01 = self.calculate_tear_film_height(ac_arc_k=self.ac_arc_k1)
-                lens_height_02 = self.calculate_tear_film_height(ac_arc_k=self.ac_arc_k2)
-                lens_height_03 = self.calculate_tear_film_height(ac_arc_k=self.ac_arc_k3)
-                lens_height_04 = self.calculate_tear_film_height(ac_arc_k=self.ac_arc_k4)
-
-            # lens_height = self.calculate_tear_film_height()
-            for item in data_list:
-                cornea_height_item_0 = item.get("degree_list_k1") * (-1)
-                cornea_height_item_1 = item.get("degree_list_k2") * (-1)
-                cornea_height_item_2 = item.get("degree_list_k3") * (-1)
-                cornea_height_item_3 = item.get("degree_list_k4") * (-1)
-                radius_list01.append(cornea_height_item_0)
-                radius_list02.append(cornea_height_item_1)
-                radius_list03.append(cornea_height_item_2)
-                radius_list04.append(cornea_height_item_3)
-
-            # logger.info(f"radius_list01:{radius_list01}")
-            # logger.info(f"radius_list02:{radius_list02}")
-            # logger.info(f"radius_list03:{radius_list03}")
-            # logger.info(f"radius_list04:{radius_list04}")
-            # 补缺值
-            radius_list01 = self.replace_nan_values(radius_list01, ac_k=self.ac_arc_k1)
-            radius_list02 = self.replace_nan_values(radius_list02, ac_k=self.ac_arc_k2)
-            radius_list03 = self.replace_nan_values(radius_list03, ac_k=self.ac_arc_k3)
-            radius_list04 = self.replace_nan_values(radius_list04, ac_k=self.ac_arc_k4)
-            # logger.info(f"radius_list01_nan:{radius_list01}")
-            # logger.info(f"radius_list02_nan:{radius_list02}")
-            # logger.info(f"radius_list03_nan:{radius_list03}")
-            # logger.info(f"radius_list04_nan:{radius_list04}")
-            # logger.info(f"radius_list01_nan:{type(radius_list01)}")
-            # logger.info(f"radius_list02_nan:{type(radius_list02)}")
-            # logger.info(f"radius_list03_nan:{type(radius_list03)}")
-            # logger.info(f"radius_list04_nan:{type(radius_list04)}")
-
-            radius_list01_1000 = [float(i) * 1000 for i in radius_list01]
-            radius_list02_1000 = [float(i) * 1000 for i in radius_list02]
-            radius_list03_1000 = [float(i) * 1000 for i in radius_list03]
-            radius_list04_1000 = [float(i) * 1000 for i in radius_list04]
-
-            # logger.info(f"len_height:{lens_height['y_values']}")
-            # logger.info(f"radius_list01:{radius_list01_1000}")
-            # logger.info(f"radius_list02:{radius_list02_1000}")
-
-            radius_diff01 = lens_height_01['y_values'] - np.array(radius_list01_1000)
-            radius_diff02 = lens_height_02['y_values'] - np.array(radius_list02_1000)
-            radius_diff03 = lens_height_03['y_values'] - np.array(radius_list03_1000)
-            radius_diff04 = lens_height_04['y_values'] - np.array(radius_list04_1000)
-
-            # 如果是seour定制,将radius_diff01的前两个值替换成0
-            if self.al_type == 2 or self.al_type == 3:
-                radius_list01_1000[:2] = [0, 0]
-                radius_list02_1000[:2] = [0, 0]
-                radius_list03_1000[:2] = [0, 0]
-                radius_list04_1000[:2] = [0, 0]
-
-                radius_diff01[:2] = 0
-                radius_diff02[:2] = 0
-                radius_diff03[:2] = 0
-                radius_diff04[:2] = 0
-            elif self.al_type == 4 or self.al_type ==5:
-                radius_list01_1000[:3] = [0, 0, 0]
-                radius_list02_1000[:3] = [0, 0, 0]
-                radius_list03_1000[:3] = [0, 0, 0]
-                radius_list04_1000[:3] = [0, 0, 0]
-
-                radius_diff01[:3] = 0
-                radius_diff02[:3] = 0
-                radius_diff03[:3] = 0
-                radius_diff04[:3] = 0
-
-            # logger.error(radius_list01)
-            # logger.error(radius_list02)
-
-            # logger.error(f"角度{self.degree_list[0]}差值：{radius_diff01}")
-            # logger.error(f"角度{self.degree_list[1]}差值：{radius_diff02}")
-
+    def tear_film_summary(self, tear_film):
+        """
+        泪膜厚度统计：光学区到AC弧（BC、RC、AC段）的最小、最大值，AC段的平均值；各方向合并统计，不含中心置零的点
+        """
+        x_values = np.asarray(tear_film["x"])
+        diffs = np.array([tear_film[key] for key in sorted(tear_film) if key.startswith("y")], dtype=np.float64)
+        zero_count = self.leading_zero_count()
+        x_values, diffs = x_values[zero_count:], diffs[:, zero_count:]
+        inner = diffs[:, x_values <= self.ac_interval[1]]
+        ac = diffs[:, (x_values >= self.ac_interval[0]) & (x_values <= self.ac_interval[1])]
+        with np.errstate(all='ignore'):
             return {
-                "x": lens_height_01['x_values'],
-                "y1": radius_diff01.tolist(),
-                "y2": radius_diff02.tolist(),
-                "y3": radius_diff03.tolist(),
-                "y4": radius_diff04.tolist(),
-                "lens_height_01": lens_height_01['y_values'].tolist(),
-                "lens_height_02": lens_height_02['y_values'].tolist(),
-                "lens_height_03": lens_height_03['y_values'].tolist(),
-                "lens_height_04": lens_height_04['y_values'].tolist(),
-                "radius_list01": radius_list01_1000,
-                "radius_list02": radius_list02_1000,
-                "radius_list03": radius_list03_1000,
-                "radius_list04": radius_list04_1000,
-                "min_base_arc_curvature_radius": lens_height_01["min_base_arc_curvature_radius"],
+                "min_clearance": float(np.nanmin(inner)) if np.isfinite(inner).any() else None,
+                "max_clearance": float(np.nanmax(inner)) if np.isfinite(inner).any() else None,
+                "ac_mean_clearance": float(np.nanmean(ac)) if np.isfinite(ac).any() else None,
+                "min_base_arc_curvature_radius": float(tear_film["min_base_arc_curvature_radius"]),
             }
 
 
@@ -0,0 +1,217 @@
+'''
+tomey_parser 解析性能基准
+
+对每个 .tms 文件分别用旧的逐字段/逐值读取方式（legacy）和 TmsFile 一次读入内存的方式（fast，
+冷缓存和热缓存各一次）完成同样的工作：扫描数据块、读取 Stat 指标、导出 radius/height CSV，
+统计每秒处理的文件数和各步骤的耗时；同时校验两种方式输出的 CSV 和 Stat 指标逐字节一致，
+不一致时以非零状态退出。
+
+用法（在项目根目录）:
+    python -m tomey_parser.benchmark                     # 默认使用项目根目录的 101.tms、705.tms
+    python -m tomey_parser.benchmark a.tms b.tms -n 20   # 指定文件和重复次数
+    python -m tomey_parser.benchmark --json result.json  # 同时保存结果，便于比较不同版本
+'''
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+from tomey_parser.tms.block_cache import blockCache
+from tomey_parser.tms.height_extractor import HeightExtractor
+from tomey_parser.tms.radius_extractor import RadiusExtractor
+from tomey_parser.tms.stat_extractor import StatExtractor
+from tomey_parser.tms.structure_extractor import StructureExtractor
+from tomey_parser.tms.tms_file import TmsFile
+
+# 项目自带的样例文件
+DEFAULT_FILES = [Path(__file__).resolve().parents[1] / name for name in ("101.tms", "705.tms")]
+
+# 各解析方式的步骤，按执行顺序
+STEPS = {
+    "legacy": ["blocks", "stats", "radius", "height"],
+    "fast": ["read", "blocks", "stats", "radius", "height"],
+    "fast-warm": ["read", "blocks", "stats", "radius", "height"],
+}
+
+
+class TmsBenchmark:
+    '''
+    解析性能基准: 每个文件按各方式重复解析 repeat 次，记录每一步的耗时（秒）
+    '''
+
+    def __init__(self, files: List[Path], repeat: int = 10):
+        self.files = [Path(f) for f in files]
+        self.repeat = repeat
+        # 解析方式 -> 步骤 -> 每次的耗时
+        self.timings: Dict[str, Dict[str, List[float]]] = {
+            mode: {step: [] for step in steps} for mode, steps in STEPS.items()
+        }
+        # 文件 -> 不一致的项
+        self.mismatches: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def timed(func: Callable):
+        ''' 执行并计时，屏蔽解析过程中的打印（打印耗时远大于解析本身，会掩盖差异） '''
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+        return result, elapsed
+
+    @staticmethod
+    def legacyCsv(extractor, sourceFile: Path) -> str:
+        ''' 旧方式的 CSV：逐值读取、逐值格式化后按行拼接（与改造前的 extract_to_csv_string 相同） '''
+        ret = extractor.doExtract(sourceFile)
+        if not ret:
+            return ""
+        return "\n".join(
+            ",".join(ret[col][row] for col in range(len(ret)))
+            for row in range(extractor.getRowSize())
+        )
+
+    def runLegacy(self, sourceFile: Path) -> Tuple[dict, str, str]:
+        '''
+        旧方式: 每个提取器各自打开文件、逐字段扫描数据块（不使用数据块缓存）
+        :return: (stats, radius CSV, height CSV)
+        '''
+        timings = self.timings["legacy"]
+
+        blockCache.clear()
+        _, elapsed = self.timed(lambda: StructureExtractor().extract(sourceFile))
+        timings["blocks"].append(elapsed)
+
+        blockCache.clear()
+        stats, elapsed = self.timed(lambda: StatExtractor().doExtractValue(
+            sourceFile, StructureExtractor().extract(sourceFile)[StructureExtractor.BLOCK_STATS]))
+        timings["stats"].append(elapsed)
+
+        blockCache.clear()
+        radius, elapsed = self.timed(lambda: self.legacyCsv(RadiusExtractor(), sourceFile))
+        timings["radius"].append(elapsed)
+
+        blockCache.clear()
+        height, elapsed = self.timed(lambda: self.legacyCsv(HeightExtractor(), sourceFile))
+        timings["height"].append(elapsed)
+        return stats, radius, height
+
+    def runFast(self, sourceFile: Path, mode: str) -> Tuple[dict, str, str]:
+        '''
+        TmsFile: 读取一次文件，在内存中扫描数据块并解码
+        :param mode: fast 冷缓存（先清空数据块缓存）；fast-warm 热缓存（数据块和指标命中缓存）
+        :return: (stats, radius CSV, height CSV)
+        '''
+        timings = self.timings[mode]
+        if mode == "fast":
+            blockCache.clear()
+
+        tms, elapsed = self.timed(lambda: TmsFile(sourceFile))
+        timings["read"].append(elapsed)
+        _, elapsed = self.timed(lambda: tms.blocks)
+        timings["blocks"].append(elapsed)
+        stats, elapsed = self.timed(tms.stats)
+        timings["stats"].append(elapsed)
+        radius, elapsed = self.timed(tms.radius_csv)
+        timings["radius"].append(elapsed)
+        height, elapsed = self.timed(tms.height_csv)
+        timings["height"].append(elapsed)
+        return stats, radius, height
+
+    def verify(self, sourceFile: Path, legacy: Tuple[dict, str, str], fast: Tuple[dict, str, str]) -> None:
+        ''' 校验两种方式的输出逐字节一致，记录不一致的项 '''
+        names = ("stats", "radius", "height")
+        problems = []
+        for name, expected, actual in zip(names, legacy, fast):
+            if name == "stats":
+                expected = json.dumps(expected, ensure_ascii=False)
+                actual = json.dumps(actual, ensure_ascii=False)
+            if not expected or expected.encode("utf-8") != actual.encode("utf-8"):
+                problems.append(name)
+        if problems:
+            self.mismatches[str(sourceFile)] = problems
+
+    def run(self) -> None:
+        for sourceFile in self.files:
+            for i in range(self.repeat):
+                legacy = self.runLegacy(sourceFile)
+                fast = self.runFast(sourceFile, "fast")
+                warm = self.runFast(sourceFile, "fast-warm")
+                # 输出与重复次数无关，只校验第一次
+                if i == 0:
+                    self.verify(sourceFile, legacy, fast)
+                    self.verify(sourceFile, legacy, warm)
+        blockCache.clear()
+
+    def summary(self) -> Dict[str, dict]:
+        '''
+        汇总结果
+        :return: 解析方式 -> {files_per_sec, total_ms(每个文件的平均总耗时), steps: 步骤 -> 中位数耗时ms}
+        '''
+        result = {}
+        count = len(self.files) * self.repeat
+        for mode, steps in self.timings.items():
+            total = sum(sum(values) for values in steps.values())
+            result[mode] = {
+                "files_per_sec": count / total if total else 0.0,
+                "total_ms": total / count * 1000 if count else 0.0,
+                "steps": {step: statistics.median(values) * 1000 for step, values in steps.items() if values},
+            }
+        return result
+
+    def report(self) -> str:
+        ''' 文本报表 '''
+        summary = self.summary()
+        allSteps = STEPS["fast"]
+        lines = [
+            f"文件: {', '.join(f.name for f in self.files)}，每个文件重复 {self.repeat} 次，各步骤为中位数耗时(ms)",
+            "{:<10} {:>10} {:>10}".format("mode", "files/s", "total(ms)") + "".join(f" {step:>10}" for step in allSteps),
+        ]
+        for mode, values in summary.items():
+            line = "{:<10} {:>10.1f} {:>10.3f}".format(mode, values["files_per_sec"], values["total_ms"])
+            for step in allSteps:
+                latency = values["steps"].get(step)
+                line += f" {'-':>10}" if latency is None else f" {latency:>10.3f}"
+            lines.append(line)
+        legacyRate = summary["legacy"]["files_per_sec"]
+        if legacyRate:
+            lines.append(f"fast 相对 legacy 加速 {summary['fast']['files_per_sec'] / legacyRate:.1f} 倍，"
+                         f"fast-warm 加速 {summary['fast-warm']['files_per_sec'] / legacyRate:.1f} 倍")
+        if self.mismatches:
+            for sourceFile, problems in self.mismatches.items():
+                lines.append(f"输出不一致: {sourceFile}: {', '.join(problems)}")
+        else:
+            lines.append("输出校验: CSV 和 Stat 指标逐字节一致")
+        return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="tomey_parser 解析性能基准")
+    parser.add_argument("files", nargs="*", type=Path, default=DEFAULT_FILES, help=".tms 文件，默认使用项目自带的样例文件")
+    parser.add_argument("-n", "--repeat", type=int, default=10, help="每个文件的重复次数")
+    parser.add_argument("--json", dest="jsonPath", help="将结果保存为 JSON 文件")
+    args = parser.parse_args(argv)
+
+    missing = [str(f) for f in args.files if not f.is_file()]
+    if missing:
+        print(f"文件不存在: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    benchmark = TmsBenchmark(args.files, max(1, args.repeat))
+    benchmark.run()
+    print(benchmark.report())
+    if args.jsonPath:
+        with open(args.jsonPath, "w", encoding="utf-8") as f:
+            json.dump({
+                "files": [str(f) for f in benchmark.files],
+                "repeat": benchmark.repeat,
+                "summary": benchmark.summary(),
+                "mismatches": benchmark.mismatches,
+            }, f, ensure_ascii=False, indent=2)
+    return 1 if benchmark.mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
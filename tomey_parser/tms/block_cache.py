@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from tomey_parser.domain.models import DefBlock
+
+# 缓存的文件数（每条只有几个数据块定义和指标值，占用很小）
+BLOCK_CACHE_SIZE = 256
+
+
+class BlockCache:
+    '''
+    .tms 文件解析结果缓存: 数据块定义 Dict[str, DefBlock] 和 STA 指标值，LRU淘汰；
+    键为 (路径, 文件大小, 修改时间)，文件被覆盖后自动失效。
+    同一检查反复预览、确认、重试提交时不再重复扫描数据块和读取指标
+    '''
+
+    def __init__(self, maxEntries: int = BLOCK_CACHE_SIZE):
+        self.maxEntries = maxEntries
+        self.entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.statsHits = 0
+        self.statsMisses = 0
+
+    @staticmethod
+    def fileKey(sourceFile: Path, st: os.stat_result = None) -> Optional[Tuple[str, int, int]]:
+        '''
+        文件标识 (绝对路径, 文件大小, 修改时间ns)
+        :param sourceFile: .tms 文件路径
+        :param st: 已取得的文件状态，不传则重新获取
+        :return: 文件标识；文件不存在或无法访问返回 None（不使用缓存）
+        '''
+        path = os.path.abspath(sourceFile)
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        return path, st.st_size, st.st_mtime_ns
+
+    def getBlocks(self, key: Optional[tuple]) -> Optional[Dict[str, DefBlock]]:
+        ''' 取数据块定义，未命中返回 None '''
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.get("blocks") is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return dict(entry["blocks"])
+
+    def putBlocks(self, key: Optional[tuple], blocks: Dict[str, DefBlock]) -> None:
+        ''' 保存数据块定义，空结果（读取失败）不缓存 '''
+        if key is None or not blocks:
+            return
+        with self.lock:
+            self._entry(key)["blocks"] = dict(blocks)
+
+    def getStats(self, key: Optional[tuple]) -> Optional[Dict[str, float]]:
+        ''' 取 STA 指标值，未命中返回 None '''
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.get("stats") is None:
+                self.statsMisses += 1
+                return None
+            self.statsHits += 1
+            self.entries.move_to_end(key)
+            return dict(entry["stats"])
+
+    def putStats(self, key: Optional[tuple], values: Dict[str, float]) -> None:
+        ''' 保存 STA 指标值，空结果（读取失败）不缓存 '''
+        if key is None or not values:
+            return
+        with self.lock:
+            self._entry(key)["stats"] = dict(values)
+
+    def _entry(self, key: tuple) -> dict:
+        ''' 取或新建缓存条目并标记为最近使用，超出容量时淘汰最久未用的（调用方持有锁） '''
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = {}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.statsHits = 0
+            self.statsMisses = 0
+
+    def stats(self) -> Dict[str, int]:
+        ''' 命中统计: hits/misses 为数据块定义，stats_hits/stats_misses 为 STA 指标值 '''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stats_hits': self.statsHits,
+                'stats_misses': self.statsMisses,
+                'entries': len(self.entries),
+            }
+
+
+# 进程内共享的数据块缓存
+blockCache = BlockCache()
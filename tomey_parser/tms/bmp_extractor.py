@@ -1,5 +1,7 @@
+import io
 from typing import Dict
 from pathlib import Path
+from PIL import Image
 from tomey_parser.domain.models import DefBlock
 from tomey_parser.utils.helper import ExtractHelper
 from tomey_parser.tms.structure_extractor import StructureExtractor
@@ -61,3 +63,33 @@ class BmpExtractor:
         except IOError as e:
             # 抛出IO异常
             raise IOError(f"提取BMP失败: {e}") from e
+
+    def decodeBmp(self, buffer, defBlock: DefBlock) -> memoryview:
+        '''
+        从已读入内存的文件内容中截取BMP图片数据，不复制、不写文件
+        :param buffer: 整个文件的字节 (bytes/bytearray/memoryview)
+        :param defBlock: 图片数据块
+        :return: BMP 完整数据的 memoryview
+        '''
+        view = memoryview(buffer)
+        # BMP数据起始偏移量，跳过2字节魔数（"BM"）后是4字节文件大小（小端序）
+        position: int = defBlock.offset + 64
+        file_size_bytes = view[position + 2:position + 6]
+        if len(file_size_bytes) != 4:
+            raise IOError("读取BMP文件头失败, 无法获取文件大小")
+
+        bmp_total_size = ExtractHelper.bytesToIntLittleEndian(file_size_bytes)
+        bmp_data = view[position:position + bmp_total_size]
+        if len(bmp_data) != bmp_total_size:
+            raise IOError(f"读取BMP数据不完整, 预期{bmp_total_size}字节，实际读取{len(bmp_data)}字节")
+        return bmp_data
+
+    def toImage(self, bmpData) -> Image.Image:
+        '''
+        将内存中的BMP数据直接交给 PIL 解码，不写临时文件
+        :param bmpData: BMP 完整数据 (bytes/memoryview)，如 decodeBmp 的返回值
+        :return: PIL 图片（已完成解码，不再依赖 bmpData）
+        '''
+        image = Image.open(io.BytesIO(bmpData))
+        image.load()
+        return image
@@ -1,7 +1,9 @@
 from abc import abstractmethod
+import io
 import traceback
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
+import numpy as np
 from tomey_parser.domain.models import DefBlock
 from tomey_parser.utils.helper import ExtractHelper
 from tomey_parser.tms.structure_extractor import StructureExtractor
@@ -12,25 +14,80 @@ class ExtractorSupport:
     def extract_to_csv_string(self, sourceFile: Path) -> str:
         """
         提取数据并返回 CSV 格式的字符串 (不保存文件)
+        与 doExtract 逐值格式化的结果逐字节一致
         """
-        ret: List[List[str]] = self.doExtract(sourceFile)
-        if not ret:
+        values: Optional[np.ndarray] = self.extract_array(sourceFile)
+        if values is None:
             return ""
-            
-        csv_lines = []
-        row_size = self.getRowSize() # 256
-        column_size = len(ret)       # 34
-        
-        # 转置矩阵：按行拼接
-        for row_index in range(row_size):
-            row_values = []
-            for col_index in range(column_size):
-                col_list = ret[col_index]
-                value = col_list[row_index]
-                row_values.append(value)
-            csv_lines.append(",".join(row_values))
-            
-        return "\n".join(csv_lines)
+        return self.formatCsv(values)
+
+    def extract_array(self, sourceFile: Path) -> Optional[np.ndarray]:
+        '''
+        一次性读取整个数据块, 按小端有符号2字节整数解码并除以精度
+        :param sourceFile: 被读取的原数据文件
+        :return: 形状为 (行数, 列数) 即 (256, 34) 的浮点矩阵, 与CSV/.dat文件的行列一致; 读取失败返回 None
+        :rtype: Optional[np.ndarray]
+        '''
+        try:
+            # 提取数据块定义
+            extractor = StructureExtractor()
+            defBlockMap: Dict[str, DefBlock] = extractor.extract(sourceFile)
+            print(f"提取 {self.tag()} 数据，从文件：{sourceFile.absolute()}")
+            defBlock: DefBlock = defBlockMap[self.tag()]
+
+            with open(sourceFile, 'rb') as raf:
+                raf.seek(defBlock.offset + 64)
+                buffer = raf.read(self.getColumSize() * self.getRowSize() * self.getDataLength())
+            return self.decodeBlock(buffer)
+        except Exception as e:
+            print(f"读文件数据块异常: {str(e)}")
+            traceback.print_exc()
+            return None
+
+    def decodeBlock(self, buffer) -> Optional[np.ndarray]:
+        '''
+        将数据块的原始字节解码为浮点矩阵
+        文件中按列存储: 先是第0列的256个值, 再是第1列...
+        :param buffer: 数据块数据区的字节 (bytes/bytearray/memoryview)
+        :return: 形状为 (256, 34) 的浮点矩阵; 字节数不足返回 None
+        '''
+        raw = self.decodeRaw(buffer)
+        if raw is None:
+            return None
+        # 与 ExtractHelper.formatNumber 相同: 整数 / 精度
+        return raw.astype(np.float64) / self.scale()
+
+    def decodeRaw(self, buffer) -> Optional[np.ndarray]:
+        '''
+        将数据块的原始字节解码为未除以精度的整数矩阵 (小端有符号2字节)
+        :param buffer: 数据块数据区的字节 (bytes/bytearray/memoryview)
+        :return: 形状为 (256, 34) 的 int16 矩阵; 字节数不足返回 None
+        '''
+        count = self.getColumSize() * self.getRowSize()
+        # 读取到文件末尾（实际字节数不足）
+        if len(buffer) < count * self.getDataLength():
+            return None
+        return np.frombuffer(buffer, dtype='<i2', count=count).reshape(self.getColumSize(), self.getRowSize()).T
+
+    def formatCsv(self, values: np.ndarray) -> str:
+        '''
+        按 "%9.4f" 格式化浮点矩阵, 逗号分隔, 行间换行(末行无换行)
+        :param values: 形状为 (256, 34) 的浮点矩阵
+        :return: CSV 字符串
+        '''
+        buffer = io.StringIO()
+        np.savetxt(buffer, values, fmt='%9.4f', delimiter=',', newline='\n')
+        return buffer.getvalue()[:-1]
+
+    def formatNpy(self, values: np.ndarray) -> bytes:
+        '''
+        将浮点矩阵保存为 .npy 格式的字节 (float64, 不丢失精度, 读取时无需逐值解析文本)
+        :param values: 形状为 (256, 34) 的浮点矩阵
+        :return: .npy 文件内容
+        '''
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(values, dtype=np.float64), allow_pickle=False)
+        return buffer.getvalue()
 
     def extractAndSave(self, sourceFile: Path, targetFilePath: str) -> None:
         '''
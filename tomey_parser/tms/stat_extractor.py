@@ -1,7 +1,9 @@
 from typing import Dict
 from pathlib import Path
+import struct
 import traceback
 from tomey_parser.domain.models import DefBlock
+from tomey_parser.tms.block_cache import blockCache
 from tomey_parser.utils.helper import ExtractHelper
 from tomey_parser.tms.structure_extractor import StructureExtractor
 
@@ -31,8 +33,13 @@ class StatExtractor:
     # ↓↓↓↓ 新增方法 ↓↓↓↓
     def extract_data(self, sourceFile: Path) -> Dict[str, float]:
         """
-        仅提取 Stat 数据并返回字典
+        仅提取 Stat 数据并返回字典，同一文件再次提取时直接取缓存
         """
+        key = blockCache.fileKey(sourceFile)
+        cached = blockCache.getStats(key)
+        if cached is not None:
+            return cached
+
         extractor = StructureExtractor()
         defBlockMap: Dict[str, DefBlock] = extractor.extract(sourceFile)
         
@@ -40,7 +47,9 @@ class StatExtractor:
             print(f"警告: 文件 {sourceFile} 中未找到 STATS 数据块")
             return {}
 
-        return self.doExtractValue(sourceFile, defBlockMap[StructureExtractor.BLOCK_STATS])
+        values = self.doExtractValue(sourceFile, defBlockMap[StructureExtractor.BLOCK_STATS])
+        blockCache.putStats(key, values)
+        return values
 
     def extractAndSave(self, sourceFiles: list[Path], targetFilePath: str) -> None:
         '''
@@ -98,6 +107,22 @@ class StatExtractor:
             traceback.print_exc()
         return ret
 
+    def decodeValues(self, buffer, defBlock: DefBlock) -> Dict[str, float]:
+        '''
+        从已读入内存的文件内容中解码指标值，不再逐个 seek/read
+        :param buffer: 整个文件的字节 (bytes/bytearray/memoryview)
+        :param defBlock: stats 数据块
+        :return: Dict类型，每个指标的数值; 数据不完整返回 None
+        '''
+        ret = {}
+        for key, value in self.dataOffsetIndex.items():
+            dataBeginPosi = defBlock.offset + self.LENGTH_BLOCK_HEAD + value
+            if dataBeginPosi + self.LENGTH_VALUE > len(buffer):
+                return None
+            # 有符号小端 32位单精度浮点，与 ExtractHelper.bytesToFloatLittleEndian 一致
+            ret[key] = struct.unpack_from('<f', buffer, dataBeginPosi)[0]
+        return ret
+
     def doSave(self, fileValues: Dict[Path, Dict[str, float]], blockFlag: str, targetFilePath: str) -> None:
         """
         批量保存文件指标数据到指定路径
@@ -3,6 +3,7 @@ from typing import Dict, List, IO, Optional
 from pathlib import Path
 import traceback
 from tomey_parser.domain.models import DefBlock
+from tomey_parser.tms.block_cache import blockCache
 from tomey_parser.utils.helper import ExtractHelper
 
 
@@ -16,6 +17,8 @@ class StructureExtractor:
     BLOCK_STATS = "STA"
     BLOCK_VIDEO = "BMP"
     FLAG_UNKNOWN = "UNKNOWN"
+    # 图片数据块的数据代码
+    CODE_VIDEO = 6
 
     # 要提取的数据块标识及其特征，对应radius、height、stat、bmp的数据
     blcokSpecifics = {
@@ -30,16 +33,22 @@ class StructureExtractor:
 
     def extract(self, sourceFile: Path) -> Dict[str, DefBlock]:
         '''
-        提取数据块定义
+        提取数据块定义，同一文件（路径、大小、修改时间均未变）再次提取时直接取缓存
         :param: sourceFile: 被读取的原数据文件
         :return: 数据块，键=数据标识，值=数据块
         :rtype: Dict[str, DefBlock]
         '''
+        key = blockCache.fileKey(sourceFile)
+        cached = blockCache.getBlocks(key)
+        if cached is not None:
+            return cached
+
         blocks = self.doExtract(sourceFile)
         fileBlocks = {}
         for block in blocks:
             # 键=block.flag，值=block对象
             fileBlocks[block.flag] = block
+        blockCache.putBlocks(key, fileBlocks)
         return fileBlocks
 
     def extractAndSave(self, sourceFiles: list[Path] = [], targetFilePath: str = "") -> None:
@@ -64,26 +73,43 @@ class StructureExtractor:
         '''
         print(f"获取数据块，从文件: {sourceFile.absolute()}")
         blocks = []
-        # 跳过文件头
-        offset = self.header.length if self.header else 0
         # 只读打开
         try:
             with open(sourceFile, 'rb') as raf:
-                while len(blocks) != len(self.blcokSpecifics):
-                    # 数据块头
-                    blockHead = self.extractBlockHead(raf, offset)
-                    # print(f"\t\tblockHead: {blockHead}")
-                    # 判断数据标识
-                    blockHead.flag = self.judgeFlag(blockHead, sourceFile)
-                    if not blockHead.flag.casefold() == self.FLAG_UNKNOWN.casefold():
-                        blocks.append(blockHead)
-                        print(f"\t{blockHead}")
-                    offset += blockHead.length
+                blocks = self.doExtractStream(raf, os.path.getsize(sourceFile), sourceFile)
         except Exception as e:
             print(f"读文件数据块异常: {str(e)}")
             traceback.print_exc()
         return blocks
 
+    def doExtractStream(self, raf: IO[bytes], fileLength: int, sourceFile: Path = None) -> List:
+        '''
+        从已打开的流中提取数据块（文件流或内存流 io.BytesIO 均可）
+        :param: raf: 二进制流
+        :param: fileLength: 流的总字节数，扫描到末尾即停止
+        :param: sourceFile: 原数据文件，仅用于判断标识
+        :return: 块列表，List[DefBlock]
+        '''
+        blocks = []
+        # 跳过文件头
+        offset = self.header.length if self.header else 0
+        while len(blocks) != len(self.blcokSpecifics) and offset < fileLength:
+            # 数据块头
+            blockHead = self.extractBlockHead(raf, offset)
+            # print(f"\t\tblockHead: {blockHead}")
+            # 判断数据标识
+            blockHead.flag = self.judgeFlag(blockHead, sourceFile)
+            if blockHead.flag is None:
+                break
+            if not blockHead.flag.casefold() == self.FLAG_UNKNOWN.casefold():
+                blocks.append(blockHead)
+                print(f"\t{blockHead}")
+            # 块长度异常时停止，避免死循环
+            if blockHead.length <= 0:
+                break
+            offset += blockHead.length
+        return blocks
+
     def extractBlockHead(self, raf: IO[bytes], currentBlockOffset: int) -> DefBlock:
         '''
         提取数据块头
@@ -200,6 +226,9 @@ class StructureExtractor:
             if (value in remark):
                 flag = key
                 break
+        # 部分文件图片块的备注残留了旧内容（如 "Videont History"），按数据代码兜底识别
+        if flag is None and defBlock.code == self.CODE_VIDEO:
+            flag = self.BLOCK_VIDEO
         return self.FLAG_UNKNOWN if flag is None else flag
 
     def doSave(self, file_blocks: Optional[Dict[Path, List[DefBlock]]], targetFilePath: str) -> None:
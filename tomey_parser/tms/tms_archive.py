@@ -0,0 +1,192 @@
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from tomey_parser.tms.height_extractor import HeightExtractor
+from tomey_parser.tms.radius_extractor import RadiusExtractor
+from tomey_parser.tms.tms_catalog import TmsCatalog
+from tomey_parser.tms.tms_file import TmsFile
+
+
+def convertFile(sourceFile: str) -> dict:
+    '''
+    解析单个 .tms 文件为归档行，供进程池调用（必须是模块级函数才能被 pickle）
+    :param sourceFile: .tms 文件路径
+    :return: 归档行；解析失败时只含 source 和 error
+    '''
+    try:
+        # 先取文件状态再读文件，文件在读取过程中被改写时下次会重新转换
+        st = os.stat(sourceFile)
+        # 屏蔽解析过程中的逐块打印，避免大量进程输出刷屏
+        with contextlib.redirect_stdout(io.StringIO()):
+            tms = TmsFile(Path(sourceFile))
+            stats = tms.stats()
+            blocks = {}
+            for name, extractor in TmsArchive.blockExtractors.items():
+                defBlock = tms.block(extractor.tag())
+                raw = extractor.decodeRaw(tms.buffer[defBlock.offset + 64:]) if defBlock else None
+                if raw is None:
+                    raise ValueError(f"未找到或无法读取 {extractor.tag()} 数据块")
+                blocks[name] = np.ascontiguousarray(raw)
+        return {
+            "source": sourceFile,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "blocks": blocks,
+            "stats": {column: stats.get(key, np.nan) for column, key in TmsCatalog.statColumns.items()},
+        }
+    except Exception as e:
+        return {"source": sourceFile, "error": str(e)}
+
+
+class TmsArchive:
+    '''
+    .tms 文件的列式归档（npz 分片 + manifest.jsonl）
+    每个分片按列保存一批文件: path/mtime_ns/size、radius/height（原始 int16，读取时除以精度，无损）、
+    各 Stat 指标（float32，与文件中的存储精度一致）。
+    manifest 每行记录一个文件所在的分片和行号，分片写完后才追加，中断后重新运行可从断点继续；
+    同一文件出现多次时以最后一行为准。
+    '''
+    MANIFEST = "manifest.jsonl"
+    SHARD_PATTERN = "shard-{:05d}.npz"
+
+    # 归档的数据块：列名 -> 解析器（决定数据标识和精度）
+    blockExtractors = {
+        "radius": RadiusExtractor(),
+        "height": HeightExtractor(),
+    }
+
+    def __init__(self, archiveDir: str):
+        self.archiveDir = archiveDir
+        os.makedirs(self.archiveDir, exist_ok=True)
+        self.manifestPath = os.path.join(self.archiveDir, self.MANIFEST)
+
+    def manifest(self) -> Dict[str, dict]:
+        ''' 已归档的文件，键=相对路径，值=manifest 行（后写入的覆盖先写入的） '''
+        entries = {}
+        if not os.path.exists(self.manifestPath):
+            return entries
+        with open(self.manifestPath, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 中断时可能留下不完整的最后一行，忽略即可，对应文件会被重新转换
+                    continue
+                entries[entry["path"]] = entry
+        return entries
+
+    def pending(self, sourceDir: str, recursive: bool = False, force: bool = False) -> Tuple[List[str], int]:
+        '''
+        找出需要转换的文件：新增或修改时间/大小有变化的
+        :param sourceDir: .tms 文件目录
+        :param recursive: 是否包含子目录
+        :param force: 忽略已有归档，全部重新转换
+        :return: (待转换文件的绝对路径列表, 未变化而跳过的文件数)
+        '''
+        entries = {} if force else self.manifest()
+        todo, skipped = [], 0
+        for path in self.listFiles(sourceDir, recursive):
+            st = os.stat(path)
+            entry = entries.get(self.relativePath(sourceDir, path))
+            if entry and (entry["mtime_ns"], entry["size"]) == (st.st_mtime_ns, st.st_size):
+                skipped += 1
+            else:
+                todo.append(path)
+        return todo, skipped
+
+    @staticmethod
+    def listFiles(sourceDir: str, recursive: bool = False) -> List[str]:
+        if recursive:
+            files = [os.path.join(root, name) for root, _, names in os.walk(sourceDir) for name in names]
+        else:
+            files = [entry.path for entry in os.scandir(sourceDir) if entry.is_file()]
+        return sorted(os.path.abspath(f) for f in files if f.lower().endswith(TmsCatalog.SUFFIX))
+
+    @staticmethod
+    def relativePath(sourceDir: str, path: str) -> str:
+        ''' 归档中使用相对于源目录的路径（统一用 / 分隔），归档可以随目录一起迁移 '''
+        return Path(os.path.relpath(path, sourceDir)).as_posix()
+
+    def writeShard(self, sourceDir: str, rows: Iterable[dict]) -> Optional[str]:
+        '''
+        将一批转换结果写成一个分片，写完后再追加 manifest
+        :param sourceDir: .tms 文件目录，用于计算相对路径
+        :param rows: convertFile 成功的返回值
+        :return: 分片文件名；rows 为空返回 None
+        '''
+        rows = list(rows)
+        if not rows:
+            return None
+        shardName = self.nextShardName()
+        columns = {
+            "path": np.array([self.relativePath(sourceDir, row["source"]) for row in rows]),
+            "mtime_ns": np.array([row["mtime_ns"] for row in rows], dtype=np.int64),
+            "size": np.array([row["size"] for row in rows], dtype=np.int64),
+        }
+        for name, extractor in self.blockExtractors.items():
+            columns[name] = np.stack([row["blocks"][name] for row in rows])
+            columns[f"{name}_scale"] = np.array(extractor.scale())
+        for column in TmsCatalog.statColumns:
+            columns[column] = np.array([row["stats"][column] for row in rows], dtype=np.float32)
+
+        # 先写临时文件再改名，中断时不会留下损坏的分片
+        shardPath = os.path.join(self.archiveDir, shardName)
+        tmpPath = shardPath + ".tmp"
+        with open(tmpPath, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmpPath, shardPath)
+
+        with open(self.manifestPath, 'a', encoding='utf-8') as f:
+            for index, path in enumerate(columns["path"]):
+                f.write(json.dumps({
+                    "path": str(path),
+                    "mtime_ns": int(columns["mtime_ns"][index]),
+                    "size": int(columns["size"][index]),
+                    "shard": shardName,
+                    "row": index,
+                }, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return shardName
+
+    def nextShardName(self) -> str:
+        numbers = [
+            int(name[len("shard-"):-len(".npz")])
+            for name in os.listdir(self.archiveDir)
+            if name.startswith("shard-") and name.endswith(".npz")
+        ]
+        return self.SHARD_PATTERN.format(max(numbers, default=0) + 1)
+
+    def load(self) -> Dict[str, np.ndarray]:
+        '''
+        读取整个归档（每个文件只取最新版本），按列返回
+        radius/height 已除以精度，形状 (文件数, 256, 34)，与 TmsFile.radius()/height() 一致
+        '''
+        entries = sorted(self.manifest().values(), key=lambda entry: (entry["shard"], entry["row"]))
+        names = ["path", "mtime_ns", "size", *self.blockExtractors, *TmsCatalog.statColumns]
+        parts: Dict[str, list] = {name: [] for name in names}
+        scales = {}
+        shardRows: Dict[str, List[int]] = {}
+        for entry in entries:
+            shardRows.setdefault(entry["shard"], []).append(entry["row"])
+        for shardName, rowIndexes in shardRows.items():
+            with np.load(os.path.join(self.archiveDir, shardName)) as shard:
+                for name in names:
+                    parts[name].append(shard[name][rowIndexes])
+                for name in self.blockExtractors:
+                    scales[name] = float(shard[f"{name}_scale"])
+
+        result = {}
+        for name in names:
+            result[name] = np.concatenate(parts[name]) if parts[name] else np.array([])
+        for name in self.blockExtractors:
+            if name in scales:
+                result[name] = result[name].astype(np.float64) / scales[name]
+        return result
@@ -0,0 +1,287 @@
+import difflib
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from tomey_parser.domain.models import DefBlock
+from tomey_parser.tms.structure_extractor import StructureExtractor
+from tomey_parser.tms.tms_file import TmsFile
+
+
+class TmsCatalog:
+    '''
+    Tomey 数据目录的 .tms 文件索引（SQLite 持久化）
+    记录每个文件的路径、修改时间、大小、Stat 指标摘要和数据块偏移量；
+    重新扫描时只解析新增或变化的文件。查找只查索引，找不到时才重新扫描目录；
+    只有精确匹配和易混淆字符归一后唯一匹配的文件会直接返回，其余相近的文件作为候选由用户确认；
+    最近的检查记录按修改时间索引查询
+    '''
+    SUFFIX = ".tms"
+
+    # 索引中保存的 Stat 指标：列名 -> StatExtractor 指标名
+    statColumns: Dict[str, str] = {
+        "simk1": "SimK1/ks",
+        "simk2": "SimK2/kf",
+        "mink": "MinK",
+        "cyl": "Cyl",
+        "simk1_ang": "SimK1/ks Ang",
+        "simk2_ang": "SimK2/kf Ang",
+        "mink_ang": "MinK Ang.",
+        "sri": "SRI",
+        "sai": "SAI",
+    }
+
+    # 索引中保存偏移量的数据块：列名前缀 -> 数据标识
+    blockColumns: Dict[str, str] = {
+        "rad": StructureExtractor.BLOCK_RADIUS,
+        "hit": StructureExtractor.BLOCK_HEIGHT,
+        "sta": StructureExtractor.BLOCK_STATS,
+        "bmp": StructureExtractor.BLOCK_VIDEO,
+    }
+
+    # OCR 容易混淆的字符，统一映射后作为模糊匹配的键
+    ocrConfusions = str.maketrans({
+        "o": "0",
+        "i": "1", "l": "1", "|": "1", "!": "1",
+        "z": "2",
+        "s": "5",
+        "b": "8",
+        "g": "9",
+        "_": "-", " ": "",
+    })
+
+    def __init__(self, dataDir: str, dbPath: str):
+        '''
+        :param dataDir: Tomey 数据文件目录
+        :param dbPath: 索引数据库文件路径
+        '''
+        self.dataDir = os.path.abspath(dataDir)
+        self.dbPath = dbPath
+        # 同一时间只有一个扫描（后台扫描与查找未命中时的扫描）
+        self.scanLock = threading.Lock()
+        with self.connect() as conn:
+            self.createTable(conn)
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        ''' 每次调用新建连接（可在多线程中使用），正常结束时提交，最后关闭连接 '''
+        conn = sqlite3.connect(self.dbPath, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def createTable(self, conn: sqlite3.Connection) -> None:
+        statSql = "".join(f", {column} REAL" for column in self.statColumns)
+        blockSql = "".join(f", {prefix}_offset INTEGER, {prefix}_length INTEGER" for prefix in self.blockColumns)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS tms_file (
+                path TEXT PRIMARY KEY,
+                data_dir TEXT NOT NULL,
+                stem TEXT NOT NULL,
+                fuzzy_stem TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                indexed_at REAL NOT NULL
+                {statSql}{blockSql}
+            )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tms_file_stem ON tms_file (data_dir, stem)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tms_file_fuzzy ON tms_file (data_dir, fuzzy_stem)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tms_file_mtime ON tms_file (data_dir, mtime_ns)")
+
+    @classmethod
+    def toStem(cls, name: str) -> str:
+        ''' 去掉首尾空白和 .tms 后缀 '''
+        name = name.strip()
+        return name[:-len(cls.SUFFIX)] if name.lower().endswith(cls.SUFFIX) else name
+
+    @classmethod
+    def fuzzyKey(cls, name: str) -> str:
+        ''' OCR 模糊匹配键：去掉后缀、转小写并合并易混淆字符 '''
+        return cls.toStem(name).lower().translate(cls.ocrConfusions)
+
+    def rescan(self) -> Dict[str, int]:
+        '''
+        增量扫描数据目录：只解析新增或修改时间/大小变化的文件，删除已不存在文件的索引
+        :return: 统计，added/updated/removed/unchanged/failed
+        '''
+        result = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+        if not os.path.isdir(self.dataDir):
+            return result
+
+        with self.scanLock, self.connect() as conn:
+            indexed = {
+                row["path"]: (row["mtime_ns"], row["size"])
+                for row in conn.execute("SELECT path, mtime_ns, size FROM tms_file WHERE data_dir = ?", (self.dataDir,))
+            }
+            seen = set()
+            with os.scandir(self.dataDir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.lower().endswith(self.SUFFIX):
+                        continue
+                    path = os.path.abspath(entry.path)
+                    seen.add(path)
+                    st = entry.stat()
+                    old = indexed.get(path)
+                    if old == (st.st_mtime_ns, st.st_size):
+                        result["unchanged"] += 1
+                        continue
+                    if self.indexFile(conn, path, st):
+                        result["added" if old is None else "updated"] += 1
+                    else:
+                        result["failed"] += 1
+
+            removed = [(path,) for path in indexed if path not in seen]
+            conn.executemany("DELETE FROM tms_file WHERE path = ?", removed)
+            result["removed"] = len(removed)
+        if result["unchanged"] != sum(result.values()):
+            print(f"Tomey 数据目录索引更新: {self.dataDir}, {result}")
+        return result
+
+    def indexFile(self, conn: sqlite3.Connection, path: str, st: os.stat_result) -> bool:
+        ''' 解析单个文件并写入索引，解析失败返回 False '''
+        try:
+            tms = TmsFile(Path(path))
+            stats = tms.stats()
+            blocks = tms.blocks
+        except Exception as e:
+            print(f"索引文件失败: {path}, {e}")
+            traceback.print_exc()
+            return False
+
+        row = {
+            "path": path,
+            "data_dir": self.dataDir,
+            "stem": self.toStem(os.path.basename(path)).lower(),
+            "fuzzy_stem": self.fuzzyKey(os.path.basename(path)),
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "indexed_at": time.time(),
+        }
+        for column, key in self.statColumns.items():
+            row[column] = stats.get(key)
+        for prefix, flag in self.blockColumns.items():
+            block = blocks.get(flag)
+            row[f"{prefix}_offset"] = block.offset if block else None
+            row[f"{prefix}_length"] = block.length if block else None
+
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        conn.execute(f"INSERT OR REPLACE INTO tms_file ({columns}) VALUES ({placeholders})", tuple(row.values()))
+        return True
+
+    def find(self, name: str) -> Optional[dict]:
+        '''
+        按 OCR 识别出的文件名查找检查记录，只返回可以直接使用的文件：
+        精确匹配（忽略大小写），或易混淆字符归一后唯一匹配的文件；
+        都没有时重新扫描目录（可能是新导出的文件）后再查一次。相近但不确定的文件见 candidates
+        :param name: 文件名（可带或不带 .tms 后缀）
+        :return: 索引记录字典（含 path、stats），未找到返回 None
+        '''
+        record = self.lookup(name)
+        if record is None:
+            self.rescan()
+            record = self.lookup(name)
+        return record
+
+    def lookup(self, name: str) -> Optional[dict]:
+        ''' 查索引：精确匹配 -> 易混淆字符归一后唯一匹配；命中的文件已变化时重新索引该文件 '''
+        stem = self.toStem(name)
+        with self.connect() as conn:
+            row = conn.execute("SELECT * FROM tms_file WHERE data_dir = ? AND stem = ?",
+                               (self.dataDir, stem.lower())).fetchone()
+            if row is None:
+                rows = conn.execute("SELECT * FROM tms_file WHERE data_dir = ? AND fuzzy_stem = ? LIMIT 2",
+                                    (self.dataDir, self.fuzzyKey(stem))).fetchall()
+                row = rows[0] if len(rows) == 1 else None
+            if row is not None:
+                row = self.refreshRow(conn, row)
+        return self.toRecord(row) if row is not None else None
+
+    def refreshRow(self, conn: sqlite3.Connection, row: sqlite3.Row) -> Optional[sqlite3.Row]:
+        ''' 核对单个文件：未变化原样返回，已修改则重新索引，已删除则删除索引并返回 None '''
+        path = row["path"]
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            conn.execute("DELETE FROM tms_file WHERE path = ?", (path,))
+            return None
+        if (st.st_mtime_ns, st.st_size) == (row["mtime_ns"], row["size"]):
+            return row
+        if not self.indexFile(conn, path, st):
+            return None
+        return conn.execute("SELECT * FROM tms_file WHERE path = ?", (path,)).fetchone()
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        '''
+        最近的检查记录（只查索引），按文件修改时间倒序
+        :param limit: 返回条数
+        '''
+        with self.connect() as conn:
+            rows = self.recentRows(conn, limit)
+        return [self.toRecord(row) for row in rows]
+
+    def recentRows(self, conn: sqlite3.Connection, limit: int) -> List[sqlite3.Row]:
+        ''' 按修改时间倒序取前 limit 行（走 idx_tms_file_mtime 索引） '''
+        return conn.execute("SELECT * FROM tms_file WHERE data_dir = ? ORDER BY mtime_ns DESC LIMIT ?",
+                            (self.dataDir, limit)).fetchall()
+
+    def candidates(self, name: str, limit: int = 5, cutoff: float = 0.6, window: int = 200) -> List[dict]:
+        '''
+        find 找不到时供用户确认的候选文件（只查索引）：
+        易混淆字符归一后相同的多个文件（按修改时间倒序），以及最近 window 条记录中归一后文件名相似的文件（按相似度）
+        :param name: 文件名（可带或不带 .tms 后缀）
+        :param limit: 最多返回条数
+        :param cutoff: 相似度下限（difflib）
+        :param window: 参与相似度比较的最近记录条数
+        '''
+        key = self.fuzzyKey(name)
+        with self.connect() as conn:
+            # 同一个键的文件很少，在 Python 中排序（SQL 中排序时 SQLite 会改走修改时间索引扫描整个目录）
+            matches = conn.execute("SELECT * FROM tms_file WHERE data_dir = ? AND fuzzy_stem = ?",
+                                   (self.dataDir, key)).fetchall()
+            matches.sort(key=lambda row: row["mtime_ns"], reverse=True)
+            recentRows = self.recentRows(conn, window) if len(matches) < limit else []
+        byKey: Dict[str, List[sqlite3.Row]] = {}
+        for row in recentRows:
+            if row["fuzzy_stem"] != key:
+                byKey.setdefault(row["fuzzy_stem"], []).append(row)
+        for match in difflib.get_close_matches(key, list(byKey), n=limit, cutoff=cutoff):
+            matches.extend(byKey[match])
+        return [self.toRecord(row) for row in matches[:limit]]
+
+    def open(self, record: dict) -> TmsFile:
+        '''
+        打开索引中的文件；文件未变化时直接使用索引中的数据块偏移量，不再扫描数据块
+        :param record: find / recent / candidates 返回的索引记录
+        '''
+        path = record["path"]
+        st = os.stat(path)
+        if (st.st_mtime_ns, st.st_size) != (record["mtime_ns"], record["size"]):
+            return TmsFile(Path(path))
+        blocks = {
+            flag: DefBlock.newOf(flag, block["offset"], block["length"])
+            for flag, block in record["blocks"].items()
+        }
+        return TmsFile(Path(path), blocks=blocks)
+
+    def toRecord(self, row: sqlite3.Row) -> dict:
+        ''' 数据库行 -> 索引记录字典，stats 的键与 StatExtractor 一致 '''
+        blocks = {}
+        for prefix, flag in self.blockColumns.items():
+            if row[f"{prefix}_offset"] is not None:
+                blocks[flag] = {"offset": row[f"{prefix}_offset"], "length": row[f"{prefix}_length"]}
+        return {
+            "path": row["path"],
+            "name": Path(row["path"]).name,
+            "mtime_ns": row["mtime_ns"],
+            "size": row["size"],
+            "stats": {key: row[column] for column, key in self.statColumns.items() if row[column] is not None},
+            "blocks": blocks,
+        }
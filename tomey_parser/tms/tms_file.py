@@ -0,0 +1,222 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import numpy as np
+from PIL import Image
+from tomey_parser.domain.models import DefBlock
+from tomey_parser.tms.structure_extractor import StructureExtractor
+from tomey_parser.tms.stat_extractor import StatExtractor
+from tomey_parser.tms.radius_extractor import RadiusExtractor
+from tomey_parser.tms.height_extractor import HeightExtractor
+from tomey_parser.tms.bmp_extractor import BmpExtractor
+from tomey_parser.tms.block_cache import blockCache
+
+
+class TmsFile:
+    '''
+    一个 .tms 文件: 只读取一次文件、只扫描一次数据块,
+    之后按需(惰性)提供 stats、radius、height、bmp 数据。
+    文件内容一次性读入内存（约400KB），不持有文件句柄，避免占用 Tomey 软件正在写入的文件
+    '''
+
+    def __init__(self, sourceFile: Path, data: bytes = None, blocks: Dict[str, DefBlock] = None):
+        '''
+        :param sourceFile: .tms 文件路径
+        :param data: 文件内容，已在内存中时传入（如前端上传的文件），不再读盘
+        :param blocks: 已知的数据块定义（如索引中记录的偏移量），传入则不再扫描数据块
+        '''
+        self.sourceFile = Path(sourceFile)
+        # 文件标识（路径、大小、修改时间），用于共享数据块缓存；内存中的数据没有标识，不使用缓存
+        self.fileKey: Optional[tuple] = None
+        if data is None:
+            with open(self.sourceFile, 'rb') as raf:
+                # 先取状态再读内容，读取过程中文件被改写时标识与内容不符，下次按新标识重新解析
+                self.fileKey = blockCache.fileKey(self.sourceFile, os.fstat(raf.fileno()))
+                data = raf.read()
+        self.data = data
+        self.buffer = memoryview(data)
+        self._blocks: Optional[Dict[str, DefBlock]] = blocks
+        self._values: Dict[str, object] = {}
+
+    @classmethod
+    def fromBytes(cls, data: bytes, name: str = "upload.tms") -> "TmsFile":
+        '''
+        从内存中的文件内容创建, 无需临时文件
+        :param data: .tms 文件内容
+        :param name: 文件名, 仅用于日志
+        '''
+        return cls(Path(name), data=data)
+
+    @property
+    def blocks(self) -> Dict[str, DefBlock]:
+        ''' 数据块定义，键=数据标识，值=数据块；首次访问时扫描一次 '''
+        if self._blocks is None:
+            self._blocks = blockCache.getBlocks(self.fileKey)
+        if self._blocks is None:
+            print(f"获取数据块，从文件: {self.sourceFile}")
+            blocks = StructureExtractor().doExtractStream(io.BytesIO(self.data), len(self.data), self.sourceFile)
+            self._blocks = {block.flag: block for block in blocks}
+            blockCache.putBlocks(self.fileKey, self._blocks)
+        return self._blocks
+
+    def block(self, flag: str) -> Optional[DefBlock]:
+        ''' 取指定标识的数据块，不存在返回 None '''
+        return self.blocks.get(flag)
+
+    def stats(self) -> Dict[str, float]:
+        '''
+        Stat 指标数据（SimK1/SimK2/Cyl/角度等）
+        :return: 指标字典；未找到 STATS 数据块返回空字典
+        '''
+        if 'stats' not in self._values:
+            values = blockCache.getStats(self.fileKey)
+            if values is None:
+                defBlock = self.block(StructureExtractor.BLOCK_STATS)
+                if defBlock is None:
+                    print(f"警告: 文件 {self.sourceFile} 中未找到 STATS 数据块")
+                    values = {}
+                else:
+                    values = StatExtractor().decodeValues(self.buffer, defBlock) or {}
+                blockCache.putStats(self.fileKey, values)
+            self._values['stats'] = values
+        return self._values['stats']
+
+    def radius(self) -> Optional[np.ndarray]:
+        ''' radius 数据，形状 (256, 34)；读取失败返回 None '''
+        return self._array(RadiusExtractor())
+
+    def height(self) -> Optional[np.ndarray]:
+        ''' height 数据，形状 (256, 34)；读取失败返回 None '''
+        return self._array(HeightExtractor())
+
+    def radius_csv(self) -> str:
+        ''' radius 数据的 CSV 字符串，与 RadiusExtractor.extract_to_csv_string 一致 '''
+        return self._csv(RadiusExtractor())
+
+    def height_csv(self) -> str:
+        ''' height 数据的 CSV 字符串，与 HeightExtractor.extract_to_csv_string 一致 '''
+        return self._csv(HeightExtractor())
+
+    def radius_npy(self) -> bytes:
+        ''' radius 数据的 .npy 字节，与 radius() 的值完全一致；读取失败返回空字节 '''
+        return self._npy(RadiusExtractor())
+
+    def height_npy(self) -> bytes:
+        ''' height 数据的 .npy 字节，与 height() 的值完全一致；读取失败返回空字节 '''
+        return self._npy(HeightExtractor())
+
+    def bmp(self) -> Optional[memoryview]:
+        ''' 内嵌的 BMP 图片数据（memoryview，不复制）；未找到图片数据块返回 None '''
+        defBlock = self.block(StructureExtractor.BLOCK_VIDEO)
+        if defBlock is None:
+            return None
+        return BmpExtractor().decodeBmp(self.buffer, defBlock)
+
+    def image(self) -> Optional[Image.Image]:
+        ''' 内嵌的采集图片（PIL 图片，直接从内存解码）；未找到图片数据块返回 None '''
+        bmpData = self.bmp()
+        if bmpData is None:
+            return None
+        return BmpExtractor().toImage(bmpData)
+
+    def _array(self, extractor) -> Optional[np.ndarray]:
+        tag = extractor.tag()
+        if tag not in self._values:
+            defBlock = self.block(tag)
+            if defBlock is None:
+                print(f"警告: 文件 {self.sourceFile} 中未找到 {tag} 数据块")
+                values = None
+            else:
+                values = extractor.decodeBlock(self.buffer[defBlock.offset + 64:])
+                if values is not None:
+                    # 结果会被缓存复用，禁止调用方原地修改
+                    values.flags.writeable = False
+            self._values[tag] = values
+        return self._values[tag]
+
+    def _csv(self, extractor) -> str:
+        values = self._array(extractor)
+        if values is None:
+            return ""
+        return extractor.formatCsv(values)
+
+    def _npy(self, extractor) -> bytes:
+        values = self._array(extractor)
+        if values is None:
+            return b""
+        return extractor.formatNpy(values)
+
+
+# 缩略图缓存条数 (每条为几十KB的PNG)
+THUMBNAIL_CACHE_SIZE = 32
+# 缩略图默认最大尺寸 (宽, 高)
+THUMBNAIL_SIZE = (240, 180)
+
+
+class ThumbnailCache:
+    '''
+    .tms 内嵌采集图片的缩略图(PNG)缓存，LRU淘汰；
+    键为 (路径, 修改时间, 文件大小, 尺寸)，文件被覆盖后自动失效
+    '''
+
+    def __init__(self, maxEntries: int = THUMBNAIL_CACHE_SIZE):
+        self.maxEntries = maxEntries
+        self.entries: "OrderedDict[tuple, Optional[bytes]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sourceFile: Path, maxSize: Tuple[int, int] = THUMBNAIL_SIZE, tms: TmsFile = None) -> Optional[bytes]:
+        '''
+        获取缩略图
+        :param sourceFile: .tms 文件路径
+        :param maxSize: 缩略图最大尺寸 (宽, 高)，保持宽高比
+        :param tms: 已打开的 TmsFile，未命中缓存时复用，避免再次读盘
+        :return: PNG 字节；文件中没有图片返回 None
+        '''
+        path = os.path.abspath(sourceFile)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size, tuple(maxSize))
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        png = self.render(tms or TmsFile(Path(path)), maxSize)
+        with self.lock:
+            self.entries[key] = png
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        return png
+
+    def render(self, tms: TmsFile, maxSize: Tuple[int, int]) -> Optional[bytes]:
+        ''' 缩小图片并编码为PNG '''
+        image = tms.image()
+        if image is None:
+            return None
+        image = image.convert('RGB')
+        image.thumbnail(maxSize)
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        ''' 命中统计 '''
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
+# 进程内共享的缩略图缓存
+thumbnailCache = ThumbnailCache()